@@ -0,0 +1,85 @@
+"""
+Compare compressing alerts one at a time with gzip against zstd, with and
+without a trained dictionary.
+
+The dictionary is trained on the first --train alerts in the tarball, and
+everything is measured on the next --test alerts, so the dictionary never sees
+the alerts it's measured on.
+"""
+
+import argparse
+import gzip
+import itertools
+import time
+
+import zstandard
+
+from alertbase.alert_tar import iterate_tarfile_raw
+from alertbase.compression import CompressionDictionary
+
+
+def measure(name, alerts, compress, decompress):
+    start = time.perf_counter()
+    compressed = [compress(a) for a in alerts]
+    compress_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for c in compressed:
+        decompress(c)
+    decompress_time = time.perf_counter() - start
+
+    raw_size = sum(len(a) for a in alerts)
+    compressed_size = sum(len(c) for c in compressed)
+    mb = raw_size / 1e6
+    print(
+        f"{name:<16} ratio={raw_size / compressed_size:6.2f} "
+        f"mean_size={compressed_size / len(alerts):9.0f}B "
+        f"compress={mb / compress_time:8.1f}MB/s "
+        f"decode={mb / decompress_time:8.1f}MB/s "
+        f"({len(alerts) / decompress_time:8.0f} alerts/s)"
+    )
+
+
+def main():
+    args = parse_args()
+    alerts = list(
+        itertools.islice(iterate_tarfile_raw(args.tarfile), args.train + args.test)
+    )
+    n_train = args.train
+    train, test = alerts[:n_train], alerts[n_train:]
+    if len(test) == 0:
+        raise ValueError("tarfile doesn't have enough alerts to test with")
+    print(f"training on {len(train)} alerts, testing on {len(test)}")
+
+    start = time.perf_counter()
+    dictionary = CompressionDictionary.train(
+        train, dict_size=args.dict_size, level=args.level
+    )
+    print(
+        f"trained {len(dictionary.data)}B dictionary in "
+        f"{time.perf_counter() - start:.2f}s"
+    )
+
+    print(f"{'raw':<16} mean_size={sum(map(len, test)) / len(test):9.0f}B")
+    measure("gzip", test, gzip.compress, gzip.decompress)
+    plain = zstandard.ZstdCompressor(level=args.level)
+    measure("zstd", test, plain.compress, zstandard.ZstdDecompressor().decompress)
+    measure("zstd+dictionary", test, dictionary.compress, dictionary.decompress)
+
+
+def parse_args() -> argparse.Namespace:
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        "tarfile",
+        nargs="?",
+        default="testdata/alertfiles/ztf_public_20210120.tar.gz",
+    )
+    argparser.add_argument("--train", type=int, default=500)
+    argparser.add_argument("--test", type=int, default=2000)
+    argparser.add_argument("--dict-size", type=int, default=112640)
+    argparser.add_argument("--level", type=int, default=3)
+    return argparser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import dataclasses
+import logging
+import pathlib
+import shutil
+
+from alertbase.index import IndexLayout, migrate
+
+
+def main():
+    args = parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    # Start from the source's layout, changing only what was asked for.
+    layout = IndexLayout.read(args.src) or IndexLayout()
+    if args.postings is not None:
+        layout = dataclasses.replace(layout, postings=args.postings)
+    if args.candidate_keys is not None:
+        layout = dataclasses.replace(layout, candidate_keys=args.candidate_keys)
+    logging.info(f"migrating {args.src} to {args.dst} with layout {layout}")
+    migrate(args.src, args.dst, layout)
+
+    # Carry over the database metadata, so that the new index can be opened
+    # as a Database.
+    meta_path = args.src / "meta.json"
+    if meta_path.exists():
+        shutil.copyfile(meta_path, args.dst / "meta.json")
+
+
+def parse_args() -> argparse.Namespace:
+    argparser = argparse.ArgumentParser(
+        description="Copy an index database into a new one with a different layout",
+    )
+    argparser.add_argument(
+        "src",
+        type=pathlib.Path,
+        help="path to the directory of an existing index database",
+    )
+    argparser.add_argument(
+        "dst",
+        type=pathlib.Path,
+        help="path to a directory where the new index database will be created",
+    )
+    argparser.add_argument(
+        "--postings", type=str,
+        choices=["concatenated", "composite"],
+        help="how to store posting lists in the new database",
+    )
+    argparser.add_argument(
+        "--candidate-keys", type=str,
+        choices=["varint", "uint64"],
+        help="how to encode candidate IDs in the new database (uint64 allows range searches)",
+    )
+    argparser.add_argument(
+        "--verbose", type=bool, default=True,
+        help="be a little chatty with logs",
+    )
+    return argparser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
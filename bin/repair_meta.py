@@ -0,0 +1,35 @@
+import argparse
+import logging
+import pathlib
+
+from alertbase.db import Database
+
+
+def main():
+    args = parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    with Database.open(args.database) as db:
+        db.repair_meta()
+        logging.info(f"repaired metadata: {db.meta}")
+
+
+def parse_args() -> argparse.Namespace:
+    argparser = argparse.ArgumentParser(
+        description="Recompute a database's metadata by scanning its entire index",
+    )
+    argparser.add_argument(
+        "database",
+        type=pathlib.Path,
+        help="path to the directory of an index database",
+    )
+    argparser.add_argument(
+        "--verbose", type=bool, default=True,
+        help="be a little chatty with logs",
+    )
+    return argparser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
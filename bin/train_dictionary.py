@@ -0,0 +1,69 @@
+import argparse
+import logging
+import pathlib
+
+from alertbase.compression import CompressionDictionary, DEFAULT_DICT_SIZE
+from alertbase.db import Database
+
+
+def main():
+    args = parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    dictionary = CompressionDictionary.train_from_tarfile(
+        args.tarfile,
+        n_samples=args.samples,
+        dict_size=args.dict_size,
+        level=args.level,
+    )
+    logging.info(
+        f"trained dictionary id={dictionary.dict_id} size={len(dictionary.data)}"
+    )
+    if args.output is not None:
+        with open(args.output, "wb") as f:
+            f.write(dictionary.data)
+    if args.database is not None:
+        with Database.open(args.database) as db:
+            db.set_compression_dictionary(dictionary)
+            logging.info(f"new alerts in {args.database} will be compressed")
+
+
+def parse_args() -> argparse.Namespace:
+    argparser = argparse.ArgumentParser(
+        description="Train a zstd dictionary for compressing alerts from a sample of a tarfile",
+    )
+    argparser.add_argument(
+        "tarfile",
+        type=pathlib.Path,
+        help="tarfile of alerts to sample",
+    )
+    argparser.add_argument(
+        "--database", type=pathlib.Path,
+        help="store the dictionary in this database's bucket, and compress new alerts with it",
+    )
+    argparser.add_argument(
+        "--output", type=pathlib.Path,
+        help="write the dictionary to this file",
+    )
+    argparser.add_argument(
+        "--samples", type=int, default=1000,
+        help="number of alerts to train from",
+    )
+    argparser.add_argument(
+        "--dict-size", type=int, default=DEFAULT_DICT_SIZE,
+        help="size of the dictionary, in bytes",
+    )
+    argparser.add_argument(
+        "--level", type=int, default=3,
+        help="zstd compression level",
+    )
+    argparser.add_argument(
+        "--verbose", type=bool, default=True,
+        help="be a little chatty with logs",
+    )
+    return argparser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import argparse
 import asyncio
 import pathlib
 import logging
+import sys
 from alertbase.db import Database
 
 
@@ -15,14 +16,26 @@ async def main():
     upload_tarfile_kwargs = {
         "tarfile_path": args.tarfile,
     }
+    if str(args.tarfile) == "-":
+        upload_tarfile_kwargs["tarfile_path"] = sys.stdin.buffer
     if args.limit is not None:
         upload_tarfile_kwargs["limit"] = args.limit
     if args.upload_worker_count is not None:
         upload_tarfile_kwargs["n_worker"] = args.upload_worker_count
     if args.skip_existing is not None:
         upload_tarfile_kwargs["skip_existing"] = args.skip_existing
+    if args.parse_worker_count is not None:
+        upload_tarfile_kwargs["n_parse_worker"] = args.parse_worker_count
+    if args.resume:
+        upload_tarfile_kwargs["resume"] = True
+    if args.bundle_size_mb is not None:
+        upload_tarfile_kwargs["bundle_size"] = int(args.bundle_size_mb * 1024 * 1024)
     logging.info(f"uploading tarfile: {upload_tarfile_kwargs}")
-    await db.upload_tarfile(**upload_tarfile_kwargs)
+    try:
+        await db.upload_tarfile(**upload_tarfile_kwargs)
+    finally:
+        await db.blobstore.close()
+        db.close()
 
 
 def initialize_db(args: argparse.Namespace) -> Database:
@@ -32,8 +45,9 @@ def initialize_db(args: argparse.Namespace) -> Database:
     return Database(
         bucket=args.bucket,
         s3_region=args.s3_region,
-        indexdb_path=args.database,
+        db_path=args.database,
         create_if_missing=args.create_db,
+        blobstore_layout=args.blobstore_layout,
     )
 
 
@@ -50,7 +64,7 @@ def parse_args() -> argparse.Namespace:
     argparser.add_argument(
         "tarfile",
         type=pathlib.Path,
-        help="path to a gzipped tarfile to upload",
+        help="path to a gzipped tarfile to upload, or '-' to read one from stdin",
     )
     argparser.add_argument(
         "--bucket",
@@ -70,6 +84,10 @@ def parse_args() -> argparse.Namespace:
         "--create-db", type=bool, default=False,
         help="create database if it does not exist",
     )
+    argparser.add_argument(
+        "--blobstore-layout", type=str, choices=["v2", "v3"],
+        help="how to store alerts in S3 (v3 stores schemas once); saved with the database",
+    )
     argparser.add_argument(
         "--verbose", type=bool, default=True,
         help="be a little chatty with logs",
@@ -78,6 +96,18 @@ def parse_args() -> argparse.Namespace:
         "--upload-worker-count", type=int,
         help="use n concurrent worker tasks for uploads",
     )
+    argparser.add_argument(
+        "--parse-worker-count", type=int,
+        help="use n processes to parse alerts (0 parses them in the tarfile reader thread)",
+    )
+    argparser.add_argument(
+        "--resume", action="store_true",
+        help="continue an interrupted upload of the same tarfile from its checkpoint",
+    )
+    argparser.add_argument(
+        "--bundle-size-mb", type=float,
+        help="pack alerts into bundle objects of about this many megabytes, one set per night, instead of one object per alert",
+    )
     argparser.add_argument(
         "--limit", type=int,
         help="only upload the first N alerts",
@@ -1,9 +1,12 @@
-from typing import List, Tuple, Optional, Any
+from typing import List, Tuple, Optional, Any, overload
 import numpy as np
 
 def order2nside(order: int) -> int: ...
 
+@overload
 def vec2pix(nside: int, x: float, y: float, z: float, nest: bool=False) -> int: ...
+@overload
+def vec2pix(nside: int, x: np.ndarray, y: np.ndarray, z: np.ndarray, nest: bool=False) -> np.ndarray: ...
 
 def query_disc(nside: int,
                vec: Tuple[float, float, float],
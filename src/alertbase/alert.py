@@ -1,15 +1,18 @@
 from __future__ import annotations
 from typing import Dict, Optional, Any, IO
 import io
+import math
 
 from avro.io import BinaryDecoder, DatumReader
-from avro.datafile import META_SCHEMA, DataFileReader
+from avro.datafile import META_SCHEMA
 from avro import schema
 
-from dataclasses import dataclass
-from astropy.coordinates import SkyCoord, CartesianRepresentation
+from astropy.coordinates import SkyCoord, UnitSphericalRepresentation
 from astropy.time import Time
 import healpy
+import numpy as np
+
+from alertbase import single_object
 
 _optional_float = schema.parse('["null", "float"]')
 _optional_string = schema.parse('["null", "string"]')
@@ -17,19 +20,124 @@ _optional_long = schema.parse('["null", "long"]')
 _optional_int = schema.parse('["null", "int"]')
 
 
-@dataclass
 class AlertRecord:
+    """
+    A single ZTF alert.
+
+    The position and time of the alert are stored as plain floats. The
+    :py:attr:`position` and :py:attr:`timestamp` astropy objects are only
+    constructed when they are accessed, since they are expensive to build and
+    aren't needed for ingesting alerts.
+    """
+
+    __slots__ = (
+        "candidate_id",
+        "object_id",
+        "ra",
+        "dec",
+        "jd",
+        "raw_data",
+        "raw_dict",
+        "_position",
+        "_timestamp",
+    )
+
     #: The ZTF Candidate ID for this alert.
     candidate_id: int
 
     #: The ZTF Object ID for this alert.
     object_id: str
-    position: SkyCoord  #: The RA-Dec position of this alert.
-    timestamp: Time  #: The time of the exposure that sourced this alert.
+
+    ra: float  #: The right ascension of this alert, in degrees.
+    dec: float  #: The declination of this alert, in degrees.
+    jd: float  #: The Julian date of the exposure that sourced this alert.
 
     raw_data: Optional[bytes]  #: The Avro serialization of this dalert's data.
     raw_dict: Optional[Dict[str, Any]]  #: The full alert payload.
 
+    _position: Optional[SkyCoord]
+    _timestamp: Optional[Time]
+
+    def __init__(
+        self,
+        candidate_id: int,
+        object_id: str,
+        position: Optional[SkyCoord] = None,
+        timestamp: Optional[Time] = None,
+        raw_data: Optional[bytes] = None,
+        raw_dict: Optional[Dict[str, Any]] = None,
+        ra: float = math.nan,
+        dec: float = math.nan,
+        jd: float = math.nan,
+    ):
+        """
+        Construct an AlertRecord. The position can be given either as a
+        SkyCoord or as ra and dec in degrees, and the timestamp either as a
+        Time or as a Julian date.
+        """
+        self.candidate_id = candidate_id
+        self.object_id = object_id
+        self.raw_data = raw_data
+        self.raw_dict = raw_dict
+        self.ra = ra
+        self.dec = dec
+        self.jd = jd
+        self._position = None
+        self._timestamp = None
+        if position is not None:
+            self.position = position
+        if timestamp is not None:
+            self.timestamp = timestamp
+
+    @property
+    def position(self) -> SkyCoord:
+        """The RA-Dec position of this alert."""
+        if self._position is None:
+            self._position = SkyCoord(ra=self.ra, dec=self.dec, unit="deg")
+        return self._position
+
+    @position.setter
+    def position(self, position: SkyCoord) -> None:
+        self._position = position
+        spherical = position.represent_as(UnitSphericalRepresentation)
+        self.ra = spherical.lon.degree
+        self.dec = spherical.lat.degree
+
+    @property
+    def timestamp(self) -> Time:
+        """The time of the exposure that sourced this alert."""
+        if self._timestamp is None:
+            self._timestamp = Time(self.jd, format="jd")
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, timestamp: Time) -> None:
+        self._timestamp = timestamp
+        # jd is always a UTC Julian date, like ZTF's, whatever the time's scale.
+        self.jd = timestamp.utc.jd
+
+    def __repr__(self) -> str:
+        return (
+            f"AlertRecord(candidate_id={self.candidate_id!r}, "
+            f"object_id={self.object_id!r}, ra={self.ra!r}, dec={self.dec!r}, "
+            f"jd={self.jd!r})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, AlertRecord):
+            return NotImplemented
+        return (
+            self.candidate_id == other.candidate_id
+            and self.object_id == other.object_id
+            and self.ra == other.ra
+            and self.dec == other.dec
+            and self.jd == other.jd
+            and self.raw_data == other.raw_data
+            and self.raw_dict == other.raw_dict
+        )
+
+    __hash__ = None  # type: ignore
+
     @classmethod
     def from_dict(cls, d: Dict[str, Any]) -> AlertRecord:
         """
@@ -39,18 +147,12 @@ class AlertRecord:
         :param d: The dictionary to load from.
         :returns: The AlertRecord with all fields filled out.
         """
-        pos = SkyCoord(
-            ra=d["candidate"]["ra"],
-            dec=d["candidate"]["dec"],
-            unit="deg",
-        )
-        timestamp = Time(d["candidate"]["jd"], format="jd")
-
         return AlertRecord(
             object_id=d["objectId"],
             candidate_id=d["candid"],
-            position=pos,
-            timestamp=timestamp,
+            ra=d["candidate"]["ra"],
+            dec=d["candidate"]["dec"],
+            jd=d["candidate"]["jd"],
             raw_dict=d,
             raw_data=None,
         )
@@ -60,16 +162,17 @@ class AlertRecord:
         """
         Read from an Avro alert file stored on disk.
 
+        The alert is decoded with a decoder compiled from the file's schema,
+        which is only compiled the first time each schema is seen (see
+        :py:mod:`alertbase.avro_decoder`).
+
         :param fp: A file-like object to read raw bytes from for
                    deserialization.
         :returns: The fully deserialized AlertRecord.
         """
         # Save a copy of the raw bytes
         raw_data = fp.read()
-        buf = io.BytesIO(raw_data)
-        with DataFileReader(buf, DatumReader()) as df:
-            alert_dict = next(df)
-            alert = cls.from_dict(alert_dict)
+        alert = cls.from_dict(single_object.read_container(raw_data))
         alert.raw_data = raw_data
         return alert
 
@@ -77,8 +180,9 @@ class AlertRecord:
     def from_file_unsafe(cls, fp: IO[bytes]) -> AlertRecord:
         """
         Read from an alert file stored on disk, recklessly making assumptions about
-        its schema. This is *much* faster (~20-50x) than the safe call, but can
-        yield errors, or severely incorrect data in the worst case.
+        its schema. This is several times faster than the safe call, since it
+        only reads a few fields, but can yield errors, or severely incorrect
+        data in the worst case.
 
         The returned AlertRecord will have its :py:attr:`raw_data` field filled
         out, but not :py:attr:`raw_dict`.
@@ -111,7 +215,6 @@ class AlertRecord:
 
         # Read jd, the julian date of the observation
         jd = decoder.read_double()
-        timestamp = Time(jd, format="jd")
 
         # Skip many fields:
         decoder.skip_int()  # fid
@@ -131,23 +234,46 @@ class AlertRecord:
 
         ra = decoder.read_double()
         dec = decoder.read_double()
-        pos = SkyCoord(ra=ra, dec=dec, unit="deg")
 
         return AlertRecord(
             object_id=object_id,
             candidate_id=candidate_id,
-            position=pos,
-            timestamp=timestamp,
+            ra=ra,
+            dec=dec,
+            jd=jd,
             raw_data=raw_data,
             raw_dict=None,
         )
 
     def healpixel(self, map_order: int) -> int:
-        pos = self.position.replicate(representation_type=CartesianRepresentation)
-        return healpy.vec2pix(
-            nside=healpy.order2nside(map_order),
-            x=pos.x.value,
-            y=pos.y.value,
-            z=pos.z.value,
-            nest=True,
-        )
+        pixel: int = healpixels(np.array([self.ra]), np.array([self.dec]), map_order)[0]
+        return pixel
+
+
+def healpixels(ra: np.ndarray, dec: np.ndarray, map_order: int) -> np.ndarray:
+    """
+    Compute the nested HEALPix pixels of many positions with a single healpy
+    call.
+
+    This is much faster than calling :py:meth:`AlertRecord.healpixel` on each
+    alert individually.
+
+    :param ra: Right ascensions, in degrees.
+    :param dec: Declinations, in degrees.
+    :param map_order: The order of the HEALPix map.
+    :returns: An array of pixel IDs, one for each position.
+    """
+    # Convert to unit vectors just like astropy's CartesianRepresentation does,
+    # so that positions which lie exactly on pixel boundaries are assigned the
+    # same pixels as they always have been.
+    ra_rad = np.radians(ra)
+    dec_rad = np.radians(dec)
+    cos_dec = np.cos(dec_rad)
+    pixels: np.ndarray = healpy.vec2pix(
+        nside=healpy.order2nside(map_order),
+        x=cos_dec * np.cos(ra_rad),
+        y=cos_dec * np.sin(ra_rad),
+        z=np.sin(dec_rad),
+        nest=True,
+    )
+    return pixels
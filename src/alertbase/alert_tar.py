@@ -1,18 +1,284 @@
-from typing import Iterator
+from __future__ import annotations
+from types import TracebackType
+from typing import (
+    IO,
+    AsyncIterator,
+    Deque,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+import asyncio
+import collections
+import concurrent.futures
+import gzip
+import io
+import itertools
+import logging
+import multiprocessing
 import tarfile
 import pathlib
+import threading
 from alertbase.alert import AlertRecord
 
+logger = logging.getLogger(__name__)
 
-def iterate_tarfile(tarfile_path: pathlib.Path) -> Iterator[AlertRecord]:
+
+#: A tarball can be read from a path, or from a binary file-like object.
+#: File-like objects don't need to be seekable, so pipes and stdin work.
+TarfileSource = Union[str, pathlib.Path, IO[bytes]]
+
+
+def iterate_tarfile(tarfile_path: TarfileSource) -> Iterator[AlertRecord]:
     """
     Iterate over the alerts found in a standard ZTF alert archive tarball. The
     tarball should be gzipped, and contain individual alert files.
     """
-    with tarfile.open(tarfile_path, mode="r:gz") as tf:
-        for member in tf.getmembers():
-            buf = tf.extractfile(member)
-            assert buf is not None
-            ar = AlertRecord.from_file_unsafe(buf)
-            yield ar
-            buf.close()
+    for raw in iterate_tarfile_raw(tarfile_path):
+        yield AlertRecord.from_file_unsafe(io.BytesIO(raw))
+
+
+def iterate_tarfile_raw(tarfile_path: TarfileSource) -> Iterator[bytes]:
+    """
+    Iterate over the raw bytes of each alert file in a standard ZTF alert
+    archive tarball, without parsing them.
+
+    The tarball is read as a stream, so alerts are yielded as soon as they
+    are decompressed, and the input doesn't need to be seekable.
+    """
+    for _, raw in iterate_tarfile_entries(tarfile_path):
+        yield raw
+
+
+def iterate_tarfile_entries(
+    tarfile_path: TarfileSource, start_offset: int = 0
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    Iterate over the alert files in a tarball, yielding the offset of each one
+    within the uncompressed tarball along with its raw bytes.
+
+    If start_offset is given, it must be an offset that was previously yielded
+    for the same tarball. Reading starts at that alert, skipping straight past
+    everything before it without parsing any tar headers or alerts.
+    """
+    if isinstance(tarfile_path, (str, pathlib.Path)):
+        with open(tarfile_path, "rb") as f:
+            yield from _iterate_entries(f, start_offset)
+    else:
+        yield from _iterate_entries(tarfile_path, start_offset)
+
+
+_SKIP_CHUNK_SIZE = 1 << 20
+
+
+def _iterate_entries(
+    fileobj: IO[bytes], start_offset: int
+) -> Iterator[Tuple[int, bytes]]:
+    with gzip.GzipFile(fileobj=fileobj, mode="rb") as gz:
+        # Skip ahead by decompressing and discarding data. GzipFile.seek would
+        # do the same, but it refuses to work if fileobj isn't seekable.
+        remaining = start_offset
+        while remaining > 0:
+            chunk = gz.read(min(remaining, _SKIP_CHUNK_SIZE))
+            if len(chunk) == 0:
+                raise ValueError(f"start offset {start_offset} is past end of tarfile")
+            remaining -= len(chunk)
+        with tarfile.open(fileobj=gz, mode="r|") as tf:
+            for member in tf:
+                if member.isfile():
+                    buf = tf.extractfile(member)
+                    assert buf is not None
+                    yield start_offset + member.offset, buf.read()
+                    buf.close()
+                # TarFile remembers every member it has read. There's no need
+                # for that here, and it adds up for a big tarball.
+                tf.members = []  # type: ignore
+
+
+# The fields that are parsed out of a raw alert by a parser process:
+# candidate_id, object_id, ra, dec, and jd.
+_AlertFields = Tuple[int, str, float, float, float]
+
+
+def _parse_alert_fields(raws: List[bytes]) -> List[_AlertFields]:
+    """
+    Parse a batch of raw alerts. This runs in a parser process, so it only
+    returns the parsed fields, rather than sending the raw bytes back.
+    """
+    result = []
+    for raw in raws:
+        ar = AlertRecord.from_file_unsafe(io.BytesIO(raw))
+        result.append((ar.candidate_id, ar.object_id, ar.ra, ar.dec, ar.jd))
+    return result
+
+
+class AsyncTarfileReader:
+    """
+    Reads alerts from a tarball for asyncio code.
+
+    Decompression happens in a dedicated producer thread, so that it never
+    blocks the event loop. Parsing happens in a pool of n_parse_worker
+    processes, or in the producer thread if n_parse_worker is 0. Parsed
+    alerts are handed to the event loop in batches through a bounded queue,
+    so the producer stays at most max_queued_batches ahead of the consumer.
+
+    Reading starts at start_offset, which should be an offset previously
+    produced by :py:meth:`entries` (see :py:func:`iterate_tarfile_entries`).
+
+    Use it as an async context manager:
+
+    .. code-block:: python
+
+       async with AsyncTarfileReader(path, n_parse_worker=4) as reader:
+           async for alert in reader:
+               ...
+    """
+
+    tarfile_path: TarfileSource
+    n_parse_worker: int
+    batch_size: int
+
+    _loop: asyncio.AbstractEventLoop
+    _queue: asyncio.Queue[Union[List[Tuple[int, AlertRecord]], BaseException, None]]
+
+    def __init__(
+        self,
+        tarfile_path: TarfileSource,
+        n_parse_worker: int = 0,
+        batch_size: int = 64,
+        max_queued_batches: int = 16,
+        start_offset: int = 0,
+    ):
+        self.tarfile_path = tarfile_path
+        self.n_parse_worker = n_parse_worker
+        self.batch_size = batch_size
+        self.start_offset = start_offset
+        self._max_queued_batches = max_queued_batches
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    async def __aenter__(self) -> AsyncTarfileReader:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self._max_queued_batches)
+        self._thread = threading.Thread(
+            target=self._produce, name="alertbase-tarfile-reader", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self._stop.set()
+        # Make room in the queue, in case the producer is blocked on it.
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        assert self._thread is not None
+        await self._loop.run_in_executor(None, self._thread.join)
+
+    def __aiter__(self) -> AsyncIterator[AlertRecord]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[AlertRecord]:
+        async for _, alert in self.entries():
+            yield alert
+
+    async def entries(self) -> AsyncIterator[Tuple[int, AlertRecord]]:
+        """
+        Iterate over the alerts along with their offsets in the uncompressed
+        tarball.
+        """
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            for entry in item:
+                yield entry
+
+    def _put(
+        self, item: Union[List[Tuple[int, AlertRecord]], BaseException, None]
+    ) -> None:
+        """Put an item in the queue from the producer thread, blocking while the
+        queue is full."""
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        future.result()
+
+    def _produce(self) -> None:
+        try:
+            for batch in self._parsed_batches():
+                if self._stop.is_set():
+                    return
+                self._put(batch)
+            logger.info("done reading tarfile %s", self.tarfile_path)
+            self._put(None)
+        except BaseException as e:
+            self._put(e)
+
+    def _raw_batches(self) -> Iterator[List[Tuple[int, bytes]]]:
+        entries = iterate_tarfile_entries(self.tarfile_path, self.start_offset)
+        while True:
+            batch = list(itertools.islice(entries, self.batch_size))
+            if len(batch) == 0:
+                return
+            yield batch
+
+    def _parsed_batches(self) -> Iterator[List[Tuple[int, AlertRecord]]]:
+        if self.n_parse_worker == 0:
+            for entries in self._raw_batches():
+                yield [
+                    (offset, AlertRecord.from_file_unsafe(io.BytesIO(raw)))
+                    for offset, raw in entries
+                ]
+            return
+
+        # Use the spawn start method, since forking a process that is running
+        # threads and an event loop is unsafe.
+        mp_context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(
+            self.n_parse_worker, mp_context=mp_context
+        ) as pool:
+            in_flight: Deque[
+                Tuple[
+                    List[Tuple[int, bytes]],
+                    concurrent.futures.Future[List[_AlertFields]],
+                ]
+            ] = collections.deque()
+            for entries in self._raw_batches():
+                if self._stop.is_set():
+                    return
+                raws = [raw for _, raw in entries]
+                future = pool.submit(_parse_alert_fields, raws)
+                in_flight.append((entries, future))
+                # Keep a couple batches per process in flight, yielding batches
+                # in their original order.
+                if len(in_flight) >= 2 * self.n_parse_worker:
+                    yield _build_alerts(*in_flight.popleft())
+            while len(in_flight) > 0:
+                yield _build_alerts(*in_flight.popleft())
+
+
+def _build_alerts(
+    entries: List[Tuple[int, bytes]],
+    future: concurrent.futures.Future[List[_AlertFields]],
+) -> List[Tuple[int, AlertRecord]]:
+    alerts = []
+    for (offset, raw), fields in zip(entries, future.result()):
+        candidate_id, object_id, ra, dec, jd = fields
+        alert = AlertRecord(
+            candidate_id=candidate_id,
+            object_id=object_id,
+            ra=ra,
+            dec=dec,
+            jd=jd,
+            raw_data=raw,
+        )
+        alerts.append((offset, alert))
+    return alerts
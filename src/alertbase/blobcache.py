@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from typing import Dict, Optional, Union
+
+import collections
+import dataclasses
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+#: The default byte budget for a BlobCache: 1 GiB.
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Cached blobs are named by the SHA-256 hash of their URL. Nothing else in the
+# cache's directory is ever treated as a blob.
+_BLOB_NAME = re.compile(r"[0-9a-f]{64}")
+
+# Temporary files older than this, in seconds, were left behind by a crash;
+# younger ones might belong to a write that's still in progress.
+_STALE_TMP_AGE = 60 * 60
+
+
+@dataclasses.dataclass
+class BlobCacheStats:
+    """Counters describing how well a BlobCache is working."""
+
+    #: The number of lookups which found the blob in the cache.
+    hits: int = 0
+    #: The number of lookups which didn't.
+    misses: int = 0
+    #: The number of blobs evicted to stay under the byte budget.
+    evictions: int = 0
+    #: The total size of the evicted blobs.
+    evicted_bytes: int = 0
+
+
+class BlobCache:
+    """
+    A cache of downloaded blobs in a directory on local disk, keyed by URL.
+
+    Stored alerts never change once they are written, so a blob can be cached
+    forever under its URL. Each blob is stored in a file named by the SHA-256
+    hash of its URL, in a ``blobs`` subdirectory of path which the cache owns;
+    other files are never touched. The cache holds at most max_bytes of blobs,
+    evicting the least recently used ones to make room. Recency survives
+    restarts, since it is tracked with the files' modification times.
+
+    Blobs are written to a temporary file and renamed into place, so a crash
+    never leaves a partially-written blob in the cache. Errors reading or
+    writing the cache are logged and treated as misses, so a full or broken
+    disk slows queries down rather than failing them.
+
+    The byte budget is tracked in memory, so a directory should only be used
+    by one BlobCache at a time.
+    """
+
+    path: pathlib.Path
+    #: The subdirectory of path holding the blobs.
+    blob_path: pathlib.Path
+    max_bytes: int
+    stats: BlobCacheStats
+
+    def __init__(
+        self, path: Union[str, pathlib.Path], max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.stats = BlobCacheStats()
+        # The size of each cached blob by filename, from least to most
+        # recently used.
+        self._entries: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self._size = 0
+        self.blob_path = self.path / "blobs"
+        self.blob_path.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """The total size of the cached blobs, in bytes."""
+        return self._size
+
+    def _load(self) -> None:
+        """Find the blobs left in the directory by previous processes."""
+        found: Dict[str, os.stat_result] = {}
+        for entry in os.scandir(self.blob_path):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # Left behind by a crash in the middle of a write.
+                if time.time() - entry.stat().st_mtime > _STALE_TMP_AGE:
+                    _remove(entry.path)
+                continue
+            if _BLOB_NAME.fullmatch(entry.name) is None:
+                continue
+            found[entry.name] = entry.stat()
+        for name in sorted(found, key=lambda n: found[n].st_mtime_ns):
+            self._entries[name] = found[name].st_size
+            self._size += found[name].st_size
+        self._evict()
+
+    @staticmethod
+    def _filename(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Get a blob from the cache, or None if it isn't cached."""
+        name = self._filename(url)
+        if name not in self._entries:
+            self.stats.misses += 1
+            return None
+        try:
+            with open(self.blob_path / name, "rb") as f:
+                data = f.read()
+            os.utime(self.blob_path / name)
+        except OSError as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning("failed to read %s from blob cache: %s", name, e)
+            self._size -= self._entries.pop(name)
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(name)
+        self.stats.hits += 1
+        return data
+
+    def put(self, url: str, data: bytes) -> None:
+        """Add a blob to the cache, evicting others if needed to make room."""
+        if len(data) > self.max_bytes:
+            return
+        name = self._filename(url)
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.blob_path, prefix=f"{os.getpid()}-", suffix=".tmp"
+            )
+        except OSError as e:
+            logger.warning("failed to write %s to blob cache: %s", name, e)
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.blob_path / name)
+        except OSError as e:
+            logger.warning("failed to write %s to blob cache: %s", name, e)
+            _remove(tmp_path)
+            return
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        self._size -= self._entries.pop(name, 0)
+        self._entries[name] = len(data)
+        self._size += len(data)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes:
+            name, size = self._entries.popitem(last=False)
+            _remove(self.blob_path / name)
+            self._size -= size
+            self.stats.evictions += 1
+            self.stats.evicted_bytes += size
+            logger.debug("evicted %s from blob cache", name)
+
+    def clear(self) -> None:
+        """Remove every blob from the cache."""
+        for name in self._entries:
+            _remove(self.blob_path / name)
+        self._entries.clear()
+        self._size = 0
+
+
+def _remove(path: Union[str, pathlib.Path]) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("failed to remove %s from blob cache: %s", path, e)
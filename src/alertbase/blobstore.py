@@ -1,8 +1,12 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
 
 import io
 import asyncio
+import dataclasses
+import datetime
+import urllib.parse
+import uuid
 import aiobotocore.session
 import aiobotocore.client
 from aiobotocore.config import AioConfig
@@ -13,35 +17,14 @@ import logging
 import functools
 
 from alertbase.alert import AlertRecord
+from alertbase import compression, single_object
+from alertbase.blobcache import BlobCache
+from alertbase.concurrency import AdaptiveLimiter, is_throttling_response
+from alertbase.encoding import jd_to_unix_ns
 
 logger = logging.getLogger(__name__)
 
-# TODO: Single Object Encoding with cached schemas
-#
-#   We upload alerts including their full schema document. That's very wasteful
-#   we could store fingerprint the thing and load the fingerprinted schema just
-#   once.
-#
-#   For example, something like this:
-#
-#   alerts/v2/<obj>/<candidate> is an alert file. It is encoded with Avro Single
-#   Object Encoding, so the first 2 bytes are magic, followed by an 8 byte
-#   schema fingerprint, followed by the contents.
-#
-#   schemas/<fingerprint> store the schema documents
-#
-#   This Blobstore would cache fingerprints it has seen, under the presumption
-#   that there are never going to be so many unique schemas that we'd ever run
-#   into trouble.
-#
-#   When uploading, we'd need to encode with the Single Object Encoding format,
-#   check whether the current schema is already uploaded (cached check, that),
-#   and proceed.
-#
-#
 # TODO: Write tests for blobstore.
-#
-# TODO: Keep a pool of active sessions
 _aio_boto_config = AioConfig(
     connector_args=dict(
         # These get passed in to the aiobotocore AioEndpointCreator, and from
@@ -53,98 +36,634 @@ _aio_boto_config = AioConfig(
 )
 
 
+#: Each alert is stored as a complete Avro Object Container File, including its
+#: schema, under ``alerts/v2/<object ID>/<candidate ID>``.
+V2_LAYOUT = "v2"
+
+#: Each alert is stored with Avro Single Object Encoding under
+#: ``alerts/v3/<object ID>/<candidate ID>``. Schemas are stored once, under
+#: ``schemas/<fingerprint>``.
+V3_LAYOUT = "v3"
+
+
+@dataclasses.dataclass
+class Bundle:
+    """
+    Alerts which are being packed together, to be uploaded as a single S3
+    object. Each alert is stored in the bundle's layout, back to back, and is
+    found by its byte range.
+    """
+
+    #: The S3 key the bundle will be uploaded to.
+    key: str
+    alerts: List[AlertRecord] = dataclasses.field(default_factory=list)
+    #: The encoded bytes of each alert.
+    blobs: List[bytes] = dataclasses.field(default_factory=list)
+    #: The total size of the blobs, in bytes.
+    size: int = 0
+
+    def add(self, alert: AlertRecord, blob: bytes) -> None:
+        self.alerts.append(alert)
+        self.blobs.append(blob)
+        self.size += len(blob)
+
+
+def bundle_group(alert: AlertRecord) -> str:
+    """
+    The group an alert is bundled with: the night it was observed, as an
+    8-digit UTC date. ZTF observes from Palomar, so a night never spans two
+    UTC dates.
+    """
+    unix_seconds = jd_to_unix_ns(alert.jd) / 1e9
+    date = datetime.datetime.fromtimestamp(unix_seconds, datetime.timezone.utc)
+    return date.strftime("%Y%m%d")
+
+
+# A PUT's response only arrives after its body has been sent, so the latency
+# of larger uploads, like bundles, mostly measures bandwidth, not congestion.
+_MAX_TIMED_PUT_SIZE = 1 << 20
+
+
+@dataclasses.dataclass
+class BlobstoreStats:
+    """Counters describing how a Blobstore has used its pool of S3 clients."""
+
+    #: The number of sessions which borrowed an idle client from the pool.
+    pool_hits: int = 0
+    #: The number of sessions which had to create a new client, because none
+    #: were idle.
+    pool_misses: int = 0
+    #: The number of S3 requests made.
+    requests: int = 0
+    #: The number of S3 requests made with a client that had made requests
+    #: before. These can reuse the client's kept-alive connections rather than
+    #: paying for DNS, TCP, and TLS setup again.
+    reused_client_requests: int = 0
+
+
 class Blobstore:
+    """
+    A Blobstore stores alerts in S3.
+
+    It keeps a pool of long-lived S3 clients, which sessions borrow and
+    return, so that connections are reused across sessions and queries.
+    aiobotocore clients are bound to the event loop which created them, so a
+    separate pool is kept for each event loop. Call :py:meth:`close` from an
+    event loop to close its clients before the loop ends.
+    """
+
     region: str
     bucket: str
-    semaphore: asyncio.Semaphore  # Limits active number of BlobstoreSessions
+    layout: str  # How new alerts are stored; see V2_LAYOUT and V3_LAYOUT
+    max_concurrency: int  # Limits active number of BlobstoreSessions
+    max_pool_connections: int  # Limits open connections per S3 client
+    coalesce_gap: int  # Largest gap between alerts that are read in one GET
+    max_coalesced_size: int  # Largest number of bytes read in one GET
+    cache: Optional[BlobCache]  # Local cache of downloaded blobs
+    limiter: AdaptiveLimiter  # Adapts the number of concurrent S3 requests
+    stats: BlobstoreStats
+    schemas: single_object.SchemaCache
+    # The ID of the dictionary that new alerts are compressed with, if any
+    compression_dictionary: Optional[int]
+    dictionaries: Dict[int, compression.CompressionDictionary]
 
     # S3 endpoint; overwritten in tests
     _endpoint: Optional[str]
 
-    def __init__(self, s3_region: str, bucket: str, max_concurrency: int = 50):
+    def __init__(
+        self,
+        s3_region: str,
+        bucket: str,
+        max_concurrency: int = 50,
+        max_pool_connections: int = 10,
+        layout: str = V2_LAYOUT,
+        compression_dictionary: Optional[int] = None,
+        coalesce_gap: int = 256 * 1024,
+        max_coalesced_size: int = 16 * 1024 * 1024,
+        cache: Optional[BlobCache] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+    ):
         """
         Construct a new Blobstore.
 
         max_concurrency sets the maximum number of concurrent sessions.
+        max_pool_connections sets the maximum number of connections that each
+        S3 client keeps open. layout sets how new alerts are uploaded; alerts
+        in any layout can be downloaded. If compression_dictionary is set, new
+        alerts are compressed with the stored dictionary that has that ID (see
+        :py:meth:`BlobstoreSession.store_dictionary`).
+
+        When downloading many alerts, alerts in the same bundle are fetched
+        with one GET if they're no more than coalesce_gap bytes apart, up to
+        max_coalesced_size bytes per GET (see :py:meth:`coalesce`).
+
+        If cache is set, downloaded alerts are kept in it, and alerts found in
+        it aren't downloaded again.
+
+        All S3 requests, for uploads and downloads alike, go through limiter,
+        which adapts how many are allowed at once to the latency and
+        throttling it sees. By default, it allows up to max_concurrency.
         """
+        if layout not in (V2_LAYOUT, V3_LAYOUT):
+            raise ValueError(f"unknown blobstore layout: {layout}")
         self.region = s3_region
         self.bucket = bucket
-        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.layout = layout
+        self.schemas = single_object.SchemaCache()
+        # Fingerprints of schemas which are known to be in the bucket.
+        self._stored_schemas: Set[bytes] = set()
+        self.compression_dictionary = compression_dictionary
+        # Dictionaries which are known to be in the bucket, by ID.
+        self.dictionaries = {}
+        self.coalesce_gap = coalesce_gap
+        self.max_coalesced_size = max_coalesced_size
+        self.cache = cache
+        if limiter is None:
+            limiter = AdaptiveLimiter(max_limit=max_concurrency)
+        self.limiter = limiter
+        self.max_concurrency = max_concurrency
+        self.max_pool_connections = max_pool_connections
+        self.stats = BlobstoreStats()
         self._endpoint = None
+        self._pools: Dict[asyncio.AbstractEventLoop, _ClientPool] = {}
+
+    def coalesce(self, urls: Iterable[str]) -> List[RangeRequest]:
+        """
+        Plan the GETs to download alerts from their URLs, merging nearby
+        alerts in the same bundle into a single request.
+        """
+        refs = (BlobRef.parse(url) for url in urls)
+        return coalesce_ranges(refs, self.coalesce_gap, self.max_coalesced_size)
 
     async def session(self) -> BlobstoreSession:
-        return BlobstoreSession(
-            region=self.region,
-            bucket=self.bucket,
-            semaphore=self.semaphore,
-            endpoint=self._endpoint,
+        return BlobstoreSession(self, self._pool())
+
+    def _pool(self) -> _ClientPool:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            # Forget about pools for event loops which are gone.
+            for old_loop in [lp for lp in self._pools if lp.is_closed()]:
+                del self._pools[old_loop]
+            pool = _ClientPool(self)
+            self._pools[loop] = pool
+        return pool
+
+    async def close(self) -> None:
+        """Close the S3 clients which were created in the running event loop."""
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool.close()
+
+    @contextlib.asynccontextmanager
+    async def clients(self) -> AsyncIterator[None]:
+        """
+        Keep the running event loop's S3 clients open while in the block, and
+        close them when the last block using them exits. Use this when
+        working on an event loop which might be closed afterwards, like one
+        made by :py:func:`asyncio.run`, so that clients and their connections
+        aren't left open.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        pool.users += 1
+        try:
+            yield
+        finally:
+            pool.users -= 1
+            if pool.users == 0 and self._pools.get(loop) is pool:
+                del self._pools[loop]
+                await pool.close()
+
+
+class _ClientPool:
+    """A pool of S3 clients, all bound to a single event loop."""
+
+    def __init__(self, blobstore: Blobstore):
+        self._blobstore = blobstore
+        self.semaphore = asyncio.Semaphore(blobstore.max_concurrency)
+        self._session = aiobotocore.session.AioSession()
+        self._config = _aio_boto_config.merge(
+            AioConfig(max_pool_connections=blobstore.max_pool_connections)
         )
+        self._idle: List[aiobotocore.client.AioBaseClient] = []
+        self._used: Set[int] = set()
+        self._exit_stack = contextlib.AsyncExitStack()
+        # The number of Blobstore.clients blocks using this pool.
+        self.users = 0
+
+    async def acquire(self) -> aiobotocore.client.AioBaseClient:
+        """Borrow a client, creating one if none are idle."""
+        await self.semaphore.acquire()
+        try:
+            if len(self._idle) > 0:
+                self._blobstore.stats.pool_hits += 1
+                # Reuse the most recently returned client, since its
+                # connections are the most likely to still be alive.
+                return self._idle.pop()
+            self._blobstore.stats.pool_misses += 1
+            client: aiobotocore.client.AioBaseClient = (
+                await self._exit_stack.enter_async_context(
+                    self._session.create_client(
+                        "s3",
+                        region_name=self._blobstore.region,
+                        config=self._config,
+                        endpoint_url=self._blobstore._endpoint,
+                    )
+                )
+            )
+            # botocore retries throttled requests by itself; this makes sure
+            # the limiter hears about them even if a retry succeeds.
+            client.meta.events.register("needs-retry.s3", self._on_needs_retry)
+            return client
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def _on_needs_retry(self, response: Any = None, **kwargs: Any) -> None:
+        if is_throttling_response(response):
+            self._blobstore.limiter.on_throttled()
+
+    def release(self, client: aiobotocore.client.AioBaseClient) -> None:
+        """Return a borrowed client to the pool."""
+        self._idle.append(client)
+        self.semaphore.release()
+
+    def record_request(self, client: aiobotocore.client.AioBaseClient) -> None:
+        self._blobstore.stats.requests += 1
+        if id(client) in self._used:
+            self._blobstore.stats.reused_client_requests += 1
+        else:
+            self._used.add(id(client))
+
+    async def close(self) -> None:
+        self._idle = []
+        await self._exit_stack.aclose()
 
 
 class BlobstoreSession:
-    def __init__(
-        self,
-        region: str,
-        bucket: str,
-        semaphore: asyncio.Semaphore,
-        endpoint: Optional[str] = None,
-    ):
-        self._region = region
-        self._bucket = bucket
-        self._sem = semaphore
-        self._endpoint = endpoint
+    """
+    A BlobstoreSession uploads and downloads alerts with an S3 client which it
+    borrows from its Blobstore's pool while it is open.
+    """
+
+    def __init__(self, blobstore: Blobstore, pool: _ClientPool):
+        self._blobstore = blobstore
+        self._bucket = blobstore.bucket
+        self._pool = pool
         self._s3_client: Optional[aiobotocore.client.AioBaseClient] = None
-        self._exit_stack = contextlib.AsyncExitStack()
 
     async def __aenter__(self) -> BlobstoreSession:
-        await self._sem.acquire()
-        session = aiobotocore.session.AioSession()
-        self._s3_client = await self._exit_stack.enter_async_context(
-            session.create_client(
-                "s3",
-                region_name=self._region,
-                config=_aio_boto_config,
-                endpoint_url=self._endpoint,
-            )
-        )
+        self._s3_client = await self._pool.acquire()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):  # type: ignore
-        await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+        assert self._s3_client is not None
+        self._pool.release(self._s3_client)
         self._s3_client = None
-        self._sem.release()
 
     def url_for(self, alert: AlertRecord) -> str:
         return f"s3://{self._bucket}/{self._key_for(alert)}"
 
     def _key_for(self, alert: AlertRecord) -> str:
-        return f"alerts/v2/{alert.object_id}/{alert.candidate_id}"
+        layout = self._blobstore.layout
+        return f"alerts/{layout}/{alert.object_id}/{alert.candidate_id}"
+
+    def new_bundle(self, group: str) -> Bundle:
+        """Start a new, empty bundle for a group (see bundle_group)."""
+        layout = self._blobstore.layout
+        return Bundle(key=f"bundles/{layout}/{group}/{uuid.uuid4().hex}")
+
+    @staticmethod
+    def _schema_key(fingerprint: bytes) -> str:
+        return f"schemas/{fingerprint.hex()}"
+
+    @staticmethod
+    def _dictionary_key(dict_id: int) -> str:
+        return f"dictionaries/{dict_id}"
 
     async def upload(self, alert: AlertRecord) -> str:
         url = self.url_for(alert)
         key = self._key_for(alert)
         logging.debug("doing an async upload to %s", url)
+        body = await self.encode(alert)
+        await self._put(key, body, self._object_metadata())
+        return url
+
+    async def encode(self, alert: AlertRecord) -> bytes:
+        """
+        Encode an alert the way it is stored: in the Blobstore's layout, and
+        compressed if the Blobstore has a compression dictionary.
+        """
         if alert.raw_data is None:
             raise ValueError("alert has no raw data associated with it")
-        assert self._s3_client is not None
-        await self._s3_client.put_object(
-            Bucket=self._bucket,
-            Key=key,
-            Body=alert.raw_data,
+        body = alert.raw_data
+        if self._blobstore.layout == V3_LAYOUT:
+            body = await self._single_object(alert.raw_data)
+        dict_id = self._blobstore.compression_dictionary
+        if dict_id is not None:
+            dictionary = await self._get_dictionary(dict_id)
+            body = dictionary.compress(body)
+        return body
+
+    def _object_metadata(self) -> Dict[str, str]:
+        metadata = {}
+        dict_id = self._blobstore.compression_dictionary
+        if dict_id is not None:
+            # Compressed frames record the dictionary ID too, but this makes
+            # it visible without downloading the object.
+            metadata["zstd-dictionary"] = str(dict_id)
+        return metadata
+
+    async def upload_bundle(self, bundle: Bundle) -> List[str]:
+        """
+        Upload a bundle as a single object, returning a URL for each of its
+        alerts. The URLs have a fragment giving the byte range of the alert
+        within the bundle, like ``s3://bucket/key#offset=0&length=1234``.
+        """
+        base_url = f"s3://{self._bucket}/{bundle.key}"
+        logging.debug(
+            "uploading bundle of %d alerts to %s", len(bundle.blobs), base_url
         )
-        return url
+        urls = []
+        offset = 0
+        for blob in bundle.blobs:
+            urls.append(f"{base_url}#offset={offset}&length={len(blob)}")
+            offset += len(blob)
+        await self._put(bundle.key, b"".join(bundle.blobs), self._object_metadata())
+        return urls
+
+    async def store_dictionary(
+        self, dictionary: compression.CompressionDictionary
+    ) -> None:
+        """
+        Store a compression dictionary in the bucket, so that alerts
+        compressed with it can be decompressed. Dictionaries are immutable and
+        stored under their ID, so storing one again does nothing harmful.
+        """
+        await self._put(self._dictionary_key(dictionary.dict_id), dictionary.data)
+        self._blobstore.dictionaries[dictionary.dict_id] = dictionary
+
+    async def _single_object(self, raw_data: bytes) -> bytes:
+        """
+        Convert an alert's container file into a single object encoding,
+        making sure that its schema is stored in the bucket.
+        """
+        schema_json, datum = single_object.split_container(raw_data)
+        cached = self._blobstore.schemas.add(schema_json)
+        if cached.fingerprint not in self._blobstore._stored_schemas:
+            # Schemas are immutable, so if several uploads race to store the
+            # same one, they all write the same thing.
+            await self._put(self._schema_key(cached.fingerprint), schema_json)
+            self._blobstore._stored_schemas.add(cached.fingerprint)
+        return single_object.encode(cached.fingerprint, datum)
+
+    async def _get_schema(self, fingerprint: bytes) -> single_object.CachedSchema:
+        """Get a schema from the cache, downloading it if it isn't there."""
+        cached = self._blobstore.schemas.get(fingerprint)
+        if cached is not None:
+            return cached
+        schema_json = await self._get(self._schema_key(fingerprint), None, None)
+        cached = self._blobstore.schemas.add(schema_json)
+        if cached.fingerprint != fingerprint:
+            raise ValueError(f"schema stored for {fingerprint.hex()} doesn't match")
+        self._blobstore._stored_schemas.add(fingerprint)
+        return cached
+
+    async def _get_dictionary(self, dict_id: int) -> compression.CompressionDictionary:
+        """Get a compression dictionary, downloading it if it isn't cached."""
+        dictionary = self._blobstore.dictionaries.get(dict_id)
+        if dictionary is not None:
+            return dictionary
+        data = await self._get(self._dictionary_key(dict_id), None, None)
+        dictionary = compression.CompressionDictionary(data)
+        if dictionary.dict_id != dict_id:
+            raise ValueError(f"dictionary stored for {dict_id} doesn't match")
+        self._blobstore.dictionaries[dict_id] = dictionary
+        return dictionary
 
     async def download(self, url: str) -> AlertRecord:
-        if not url.startswith("s3://"):
-            raise ValueError("invalid scheme, url should start with 's3://'")
-        url = url[5:]
-        bucket, key = url.split("/", 1)
+        return await self._decode(await self._download_blob(url))
+
+    async def download_raw(self, url: str) -> bytes:
+        """
+        Download an alert without decoding it, returning it as an uncompressed
+        Avro Object Container File, no matter how it is stored. These are the
+        same bytes as a decoded alert's raw_data.
+        """
+        return await self._container(await self._download_blob(url))
+
+    async def download_coalesced(self, request: RangeRequest) -> List[AlertRecord]:
+        """
+        Download all the alerts in a coalesced request with a single GET,
+        returning them in the same order as request.refs.
+        """
+        alerts = []
+        for blob in await self._download_blobs(request):
+            # Decode one at a time, so that the first alert fetches any schema
+            # or dictionary the rest need, rather than all of them at once.
+            alerts.append(await self._decode(blob))
+        return alerts
+
+    async def download_raw_coalesced(self, request: RangeRequest) -> List[bytes]:
+        """
+        Download all the alerts in a coalesced request with a single GET,
+        without decoding them (see :py:meth:`download_raw`).
+        """
+        return [
+            await self._container(blob) for blob in await self._download_blobs(request)
+        ]
+
+    async def _download_blob(self, url: str) -> bytes:
+        """Get an alert's blob as it is stored, from the cache if it's there."""
+        ref = BlobRef.parse(url)
+        cache = self._blobstore.cache
+        body = cache.get(url) if cache is not None else None
+        if body is None:
+            body = await self._get(ref.key, ref.offset, ref.length)
+            if cache is not None:
+                cache.put(url, body)
+        return body
+
+    async def _download_blobs(self, request: RangeRequest) -> List[bytes]:
+        """Get the blobs of all the alerts in a coalesced request."""
+        if request.refs[0].offset is None:
+            return [await self._download_blob(request.refs[0].url)]
+
+        blobs = self._cached_blobs(request.refs)
+        missing = [ref for ref in request.refs if ref.url not in blobs]
+        if len(missing) > 0:
+            # Only read the part of the range which covers the missing blobs.
+            # Refs are sorted by offset, so the first missing one starts it.
+            assert missing[0].offset is not None
+            start_offset = missing[0].offset
+            end_offset = max(_ref_end(ref) for ref in missing)
+            body = await self._get(request.key, start_offset, end_offset - start_offset)
+            for ref in missing:
+                assert ref.offset is not None
+                start = ref.offset - start_offset
+                end = start + _ref_end(ref) - ref.offset
+                blobs[ref.url] = body[start:end]
+                if self._blobstore.cache is not None:
+                    self._blobstore.cache.put(ref.url, blobs[ref.url])
+        return [blobs[ref.url] for ref in request.refs]
+
+    def _cached_blobs(self, refs: List[BlobRef]) -> Dict[str, bytes]:
+        """Look up blobs in the cache, returning the ones that were found."""
+        cache = self._blobstore.cache
+        if cache is None:
+            return {}
+        found = {}
+        for ref in refs:
+            blob = cache.get(ref.url)
+            if blob is not None:
+                found[ref.url] = blob
+        return found
+
+    async def _get(
+        self, key: str, offset: Optional[int], length: Optional[int]
+    ) -> bytes:
+        """Get an object, or just a byte range of it if offset is given."""
+        request = {"Bucket": self._bucket, "Key": key}
+        if offset is not None and length is not None:
+            request["Range"] = f"bytes={offset}-{offset + length - 1}"
         assert self._s3_client is not None
-        resp = await self._s3_client.get_object(
-            Bucket=self._bucket,
-            Key=key,
-        )
-        body = await resp["Body"].read()
+        self._pool.record_request(self._s3_client)
+        async with self._blobstore.limiter.request() as timer:
+            resp = await self._s3_client.get_object(**request)
+            timer.responded()
+            body: bytes = await resp["Body"].read()
+        return body
+
+    async def _put(
+        self, key: str, body: bytes, metadata: Optional[Dict[str, str]] = None
+    ) -> None:
+        """Put an object."""
+        assert self._s3_client is not None
+        self._pool.record_request(self._s3_client)
+        async with self._blobstore.limiter.request() as timer:
+            if len(body) > _MAX_TIMED_PUT_SIZE:
+                timer.skip()
+            await self._s3_client.put_object(
+                Bucket=self._bucket,
+                Key=key,
+                Body=body,
+                Metadata=metadata or {},
+            )
 
-        f = functools.partial(AlertRecord.from_file_safe, io.BytesIO(body))
+    async def _decode(self, body: bytes) -> AlertRecord:
+        """Decode an alert stored in any layout, compressed or not."""
+        body = await self._decompress(body)
+        if single_object.is_single_object(body):
+            fingerprint, datum = single_object.decode(body)
+            cached = await self._get_schema(fingerprint)
+            f = functools.partial(_alert_from_single_object, cached, datum)
+        else:
+            f = functools.partial(AlertRecord.from_file_safe, io.BytesIO(body))
         return await asyncio.get_running_loop().run_in_executor(None, f)
+
+    async def _container(self, body: bytes) -> bytes:
+        """
+        Convert an alert stored in any layout into an uncompressed container
+        file, without decoding it.
+        """
+        body = await self._decompress(body)
+        if single_object.is_single_object(body):
+            fingerprint, datum = single_object.decode(body)
+            cached = await self._get_schema(fingerprint)
+            return cached.container(datum)
+        return body
+
+    async def _decompress(self, body: bytes) -> bytes:
+        if not compression.is_compressed(body):
+            return body
+        dictionary = await self._get_dictionary(compression.frame_dictionary_id(body))
+        return dictionary.decompress(body)
+
+
+@dataclasses.dataclass
+class BlobRef:
+    """Where an alert is stored, as parsed from its URL."""
+
+    url: str
+    key: str
+    #: The alert's byte range within the object, if it is in a bundle.
+    offset: Optional[int] = None
+    length: Optional[int] = None
+
+    @classmethod
+    def parse(cls, url: str) -> BlobRef:
+        if not url.startswith("s3://"):
+            raise ValueError("invalid scheme, url should start with 's3://'")
+        path, fragment = urllib.parse.urldefrag(url[5:])
+        bucket, key = path.split("/", 1)
+        if not fragment:
+            return BlobRef(url, key)
+        params = urllib.parse.parse_qs(fragment)
+        offset = int(params["offset"][0])
+        length = int(params["length"][0])
+        return BlobRef(url, key, offset, length)
+
+
+@dataclasses.dataclass
+class RangeRequest:
+    """
+    A single GET which covers one or more alerts: either one whole object, or
+    a contiguous byte range of a bundle which holds several alerts.
+    """
+
+    key: str
+    refs: List[BlobRef]
+    #: The byte range to read, if reading part of a bundle.
+    start: int = 0
+    end: int = 0
+
+
+def coalesce_ranges(
+    refs: Iterable[BlobRef], max_gap: int, max_size: int
+) -> List[RangeRequest]:
+    """
+    Group alerts to download into as few GETs as possible. Alerts in the same
+    bundle are merged into one request if the gap between them is at most
+    max_gap bytes, as long as the merged request doesn't exceed max_size
+    bytes. Reading a small gap is cheaper than paying for another request.
+    """
+    requests = []
+    ranged = []
+    for ref in refs:
+        if ref.offset is None:
+            requests.append(RangeRequest(ref.key, [ref]))
+        else:
+            ranged.append(ref)
+    ranged.sort(key=lambda r: (r.key, r.offset))
+
+    current: Optional[RangeRequest] = None
+    for ref in ranged:
+        assert ref.offset is not None and ref.length is not None
+        ref_end = ref.offset + ref.length
+        if (
+            current is not None
+            and current.key == ref.key
+            and ref.offset - current.end <= max_gap
+            and max(ref_end, current.end) - current.start <= max_size
+        ):
+            current.refs.append(ref)
+            current.end = max(current.end, ref_end)
+        else:
+            current = RangeRequest(ref.key, [ref], ref.offset, ref_end)
+            requests.append(current)
+    return requests
+
+
+def _ref_end(ref: BlobRef) -> int:
+    assert ref.offset is not None and ref.length is not None
+    return ref.offset + ref.length
+
+
+def _alert_from_single_object(
+    cached: single_object.CachedSchema, datum: bytes
+) -> AlertRecord:
+    alert = AlertRecord.from_dict(cached.read(datum))
+    # Alerts' raw data is always a container file, no matter how it's stored.
+    alert.raw_data = cached.container(datum)
+    return alert
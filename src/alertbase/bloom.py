@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+from typing import Iterable, Optional, Union
+
+import math
+import os
+import pathlib
+import struct
+
+import numpy as np
+
+_MAGIC = b"ABBF"
+_VERSION = 1
+# magic, version, number of hash functions, number of bits, count, capacity
+_HEADER = struct.Struct(">4sBBQQQ")
+
+
+class BloomFilter:
+    """
+    A Bloom filter over integer IDs.
+
+    A Bloom filter is a compact, probabilistic set. Checking membership can
+    return false positives (at roughly error_rate, as long as no more than
+    capacity IDs have been added), but never false negatives. Adding and
+    checking IDs is vectorized, so it's cheap to do in bulk.
+    """
+
+    n_bits: int
+    n_hashes: int
+    capacity: int
+    count: int
+    bits: np.ndarray
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        # The standard optimal sizing for a Bloom filter.
+        n_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.n_bits = max(n_bits, 8)
+        self.n_hashes = max(round(self.n_bits / capacity * math.log(2)), 1)
+        self.capacity = capacity
+        self.count = 0
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+        self._bytes = self.bits.data
+
+    def __len__(self) -> int:
+        """The number of IDs that have been added to the filter."""
+        return self.count
+
+    def __contains__(self, id: int) -> bool:
+        # Checking a single ID is common enough that it's worth avoiding the
+        # overhead of numpy. This computes the same positions as _positions.
+        bits = self._bytes
+        h1 = _splitmix64_int(id & _MASK64)
+        h2 = _splitmix64_int(h1) | 1
+        for i in range(self.n_hashes):
+            position = ((h1 + i * h2) & _MASK64) % self.n_bits
+            if not (bits[position >> 3] >> (position & 7)) & 1:
+                return False
+        return True
+
+    def add(self, id: int) -> None:
+        self.add_many([id])
+
+    def add_many(self, ids: Iterable[int]) -> None:
+        positions = self._positions(ids)
+        np.bitwise_or.at(
+            self.bits, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8)
+        )
+        self.count += positions.shape[0]
+
+    def contains_many(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        Check many IDs at once, returning a boolean array which is True for
+        each ID that is probably in the filter.
+        """
+        positions = self._positions(ids)
+        hits = (self.bits[positions >> 3] >> (positions & 7)) & 1
+        result: np.ndarray = hits.all(axis=1)
+        return result
+
+    def is_full(self) -> bool:
+        """
+        Returns True if more than capacity IDs have been added, so the false
+        positive rate is higher than it was sized for.
+        """
+        return self.count > self.capacity
+
+    def _positions(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        Compute the bit positions for each ID, returning an array of shape
+        (len(ids), n_hashes). Positions are generated by double hashing: the
+        i'th position is h1 + i*h2, modulo the number of bits.
+        """
+        if isinstance(ids, np.ndarray):
+            arr = ids.astype(np.int64)
+        else:
+            arr = np.fromiter(ids, dtype=np.int64)
+        x = arr.view(np.uint64)
+        h1 = _splitmix64(x)
+        h2 = _splitmix64(h1) | np.uint64(1)
+        i = np.arange(self.n_hashes, dtype=np.uint64)
+        hashes = h1[:, np.newaxis] + i[np.newaxis, :] * h2[:, np.newaxis]
+        positions: np.ndarray = (hashes % np.uint64(self.n_bits)).astype(np.int64)
+        return positions
+
+    def write(self, path: Union[str, pathlib.Path]) -> None:
+        """
+        Write the filter to a file. The write is atomic, so a crash leaves
+        either the old file or the new one.
+        """
+        path = pathlib.Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    _VERSION,
+                    self.n_hashes,
+                    self.n_bits,
+                    self.count,
+                    self.capacity,
+                )
+            )
+            f.write(self.bits.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read(cls, path: Union[str, pathlib.Path]) -> Optional[BloomFilter]:
+        """
+        Read a filter which was written with :py:meth:`write`. Returns None if
+        the file doesn't exist or isn't a readable filter.
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, n_hashes, n_bits, count, capacity = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            return None
+        bits = np.frombuffer(data, dtype=np.uint8, offset=_HEADER.size)
+        if bits.shape[0] != (n_bits + 7) // 8:
+            return None
+        bf = cls.__new__(cls)
+        bf.n_bits = n_bits
+        bf.n_hashes = n_hashes
+        bf.capacity = capacity
+        bf.count = count
+        bf.bits = bits.copy()
+        bf._bytes = bf.bits.data
+        return bf
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _splitmix64_int(x: int) -> int:
+    """The splitmix64 mixing function, for a single unsigned 64-bit int."""
+    z = (x + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    """The splitmix64 mixing function, applied elementwise to a uint64 array."""
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    result: np.ndarray = z ^ (z >> np.uint64(31))
+    return result
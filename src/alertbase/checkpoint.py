@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from typing import Any, Deque, Dict, Iterable, Optional, Set, Union
+
+import collections
+import json
+import os
+import pathlib
+
+
+class IngestCheckpoint:
+    """
+    A journal of progress through a tarball being uploaded into a Database.
+
+    Alerts are uploaded concurrently, so they finish out of order. The
+    checkpoint tracks the offset (in the uncompressed tarball) of each alert
+    that has been started but isn't yet durably indexed. When saved, it
+    records:
+
+     - offset: the lowest offset of any in-flight alert. Everything before it
+       is done, so a resumed upload can seek straight to it.
+     - high_water: the highest offset of any started alert. Beyond it, nothing
+       has been done.
+     - in_flight: the candidate IDs of alerts which were started but not
+       finished. Between offset and high_water, these are the only alerts that
+       need to be uploaded again.
+
+    The in-flight set is bounded by the number of alerts queued up, packed
+    into bundles that haven't been uploaded, and buffered for indexing, so the
+    checkpoint stays small no matter how large the tarball is.
+    """
+
+    path: pathlib.Path
+    source: str
+
+    def __init__(
+        self,
+        path: Union[str, pathlib.Path],
+        source: str,
+        offset: int = 0,
+        high_water: int = -1,
+        in_flight: Iterable[int] = (),
+    ):
+        self.path = pathlib.Path(path)
+        self.source = source
+        # The state left behind by a previous run.
+        self._resume_offset = offset
+        self._resume_high_water = high_water
+        self._resume_in_flight = set(in_flight)
+
+        # Alerts started in this run which haven't finished, in the order
+        # they were started (which is also offset order).
+        self._pending: Dict[int, int] = {}
+        self._pending_offsets: Dict[int, Deque[int]] = {}
+        self._high_water = high_water
+
+    @property
+    def offset(self) -> int:
+        """The offset that a resumed upload should start reading from."""
+        low_water = []
+        if len(self._pending) > 0:
+            low_water.append(next(iter(self._pending)))
+        if len(self._resume_in_flight) > 0:
+            # Some alerts left in flight by a previous run haven't been reached
+            # yet.
+            low_water.append(self._resume_offset)
+        if len(low_water) > 0:
+            return min(low_water)
+        # Nothing is in flight, so the last alert that was started has
+        # finished. Resuming there will skip it, since it is at the high water
+        # mark and isn't in flight.
+        return max(self._high_water, self._resume_offset)
+
+    @property
+    def in_flight(self) -> Set[int]:
+        """The candidate IDs which have been started but not finished."""
+        return set(self._pending.values()) | self._resume_in_flight
+
+    def is_done(self, offset: int, candidate_id: int) -> bool:
+        """
+        Returns True if a previous run already finished the alert at offset.
+        """
+        return (
+            offset <= self._resume_high_water
+            and candidate_id not in self._resume_in_flight
+        )
+
+    def was_in_flight(self, candidate_id: int) -> bool:
+        """
+        Returns True if the alert was in flight when a previous run stopped. It
+        may or may not have been indexed.
+        """
+        return candidate_id in self._resume_in_flight
+
+    def resolve(self, candidate_id: int) -> None:
+        """
+        Record that an alert left in flight by a previous run turned out to be
+        finished already.
+        """
+        self._resume_in_flight.discard(candidate_id)
+
+    def start(self, offset: int, candidate_id: int) -> None:
+        """Record that the alert at offset has started uploading."""
+        self._pending[offset] = candidate_id
+        self._pending_offsets.setdefault(candidate_id, collections.deque()).append(
+            offset
+        )
+        self._high_water = max(self._high_water, offset)
+        self._resume_in_flight.discard(candidate_id)
+
+    def finish(self, candidate_ids: Iterable[int]) -> None:
+        """Record that alerts have been durably indexed."""
+        for candidate_id in candidate_ids:
+            offsets = self._pending_offsets.get(candidate_id)
+            if offsets is None:
+                continue
+            del self._pending[offsets.popleft()]
+            if len(offsets) == 0:
+                del self._pending_offsets[candidate_id]
+            self._resume_in_flight.discard(candidate_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "offset": self.offset,
+            "high_water": self._high_water,
+            "in_flight": sorted(self.in_flight),
+        }
+
+    def save(self) -> None:
+        """
+        Write the checkpoint to disk. The write is atomic, so a crash leaves
+        either the old checkpoint or the new one.
+        """
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        """Delete the checkpoint from disk, if it exists."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def load(cls, path: Union[str, pathlib.Path]) -> Optional[IngestCheckpoint]:
+        """
+        Load a checkpoint which was previously saved to path, or return None if
+        there isn't one.
+        """
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return IngestCheckpoint(
+            path=path,
+            source=data["source"],
+            offset=data["offset"],
+            high_water=data["high_water"],
+            in_flight=data["in_flight"],
+        )
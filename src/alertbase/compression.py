@@ -0,0 +1,143 @@
+"""
+Compression of alert blobs with a shared, trained zstd dictionary.
+
+Alerts are small and extremely similar to each other, so compressing each one
+on its own does poorly: most of what a compressor would learn from an alert is
+thrown away before it gets to the next one. A dictionary trained from a sample
+of alerts captures that shared structure once, and every alert compressed with
+it benefits.
+
+This requires the optional ``zstandard`` package (``pip install
+alertbase[compression]``).
+
+Every zstd frame written here records the ID of the dictionary it was
+compressed with, so compressed blobs are self-describing: the ID is read back
+out of the frame to find the dictionary that's needed to decompress it.
+"""
+
+from __future__ import annotations
+
+from typing import Any, List, Union
+
+import itertools
+import threading
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+from alertbase.alert_tar import TarfileSource, iterate_tarfile_raw
+
+#: The four bytes which begin every zstd frame.
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+#: The default size of trained dictionaries, in bytes. This is zstd's own
+#: default; alerts share a lot of structure, so larger dictionaries don't help
+#: much.
+DEFAULT_DICT_SIZE = 112640
+
+#: The default compression level.
+DEFAULT_LEVEL = 3
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise ImportError(
+            "compression requires the zstandard package; "
+            "install it with 'pip install alertbase[compression]'"
+        )
+
+
+def is_compressed(data: bytes) -> bool:
+    """Returns True if data looks like a zstd frame."""
+    return data[: len(ZSTD_MAGIC)] == ZSTD_MAGIC
+
+
+def frame_dictionary_id(data: bytes) -> int:
+    """
+    Get the ID of the dictionary that a zstd frame was compressed with, or 0
+    if it was compressed without one.
+    """
+    _require_zstandard()
+    dict_id: int = zstandard.get_frame_parameters(data).dict_id
+    return dict_id
+
+
+class CompressionDictionary:
+    """
+    A zstd dictionary, along with the compressors and decompressors that use
+    it.
+
+    zstd compressors aren't safe to share between threads, so each thread
+    gets its own.
+    """
+
+    #: The serialized dictionary, as stored in the blobstore.
+    data: bytes
+    #: The dictionary's ID, which is recorded in every frame compressed with
+    #: it. Trained dictionaries get an ID derived from their contents.
+    dict_id: int
+    level: int
+
+    def __init__(self, data: bytes, level: int = DEFAULT_LEVEL):
+        _require_zstandard()
+        self.data = data
+        self.level = level
+        self._dict = zstandard.ZstdCompressionDict(data)
+        self.dict_id = self._dict.dict_id()
+        if self.dict_id == 0:
+            raise ValueError("data is not a zstd dictionary")
+        self._local = threading.local()
+
+    @classmethod
+    def train(
+        cls,
+        samples: List[bytes],
+        dict_size: int = DEFAULT_DICT_SIZE,
+        level: int = DEFAULT_LEVEL,
+    ) -> CompressionDictionary:
+        """
+        Train a dictionary from sample alert blobs. A few hundred samples is
+        usually plenty.
+        """
+        _require_zstandard()
+        buffers: List[Union[bytes, bytearray, memoryview]] = list(samples)
+        trained = zstandard.train_dictionary(dict_size, buffers, level=level)
+        return cls(trained.as_bytes(), level=level)
+
+    @classmethod
+    def train_from_tarfile(
+        cls,
+        tarfile_path: TarfileSource,
+        n_samples: int = 1000,
+        dict_size: int = DEFAULT_DICT_SIZE,
+        level: int = DEFAULT_LEVEL,
+    ) -> CompressionDictionary:
+        """Train a dictionary from the first n_samples alerts in a tarball."""
+        samples = list(itertools.islice(iterate_tarfile_raw(tarfile_path), n_samples))
+        return cls.train(samples, dict_size=dict_size, level=level)
+
+    def _compressor(self) -> Any:
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self._dict
+            )
+            self._local.compressor = compressor
+        return compressor
+
+    def _decompressor(self) -> Any:
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = zstandard.ZstdDecompressor(dict_data=self._dict)
+            self._local.decompressor = decompressor
+        return decompressor
+
+    def compress(self, data: bytes) -> bytes:
+        compressed: bytes = self._compressor().compress(data)
+        return compressed
+
+    def decompress(self, data: bytes) -> bytes:
+        decompressed: bytes = self._decompressor().decompress(data)
+        return decompressed
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+import asyncio
+import collections
+import contextlib
+import dataclasses
+import logging
+import math
+import time
+
+import botocore.exceptions
+
+logger = logging.getLogger(__name__)
+
+#: S3 error codes which mean that requests are being throttled.
+THROTTLING_ERROR_CODES = frozenset(
+    [
+        "SlowDown",
+        "Throttling",
+        "ThrottlingException",
+        "RequestLimitExceeded",
+        "TooManyRequestsException",
+        "ServiceUnavailable",
+        "503",
+    ]
+)
+
+
+def is_throttling_response(response: Optional[Any]) -> bool:
+    """
+    Returns True if a botocore response, as passed to the ``needs-retry``
+    event, says that requests are being throttled.
+    """
+    if response is None:
+        return False
+    http_response, parsed = response
+    if getattr(http_response, "status_code", None) == 503:
+        return True
+    code = parsed.get("Error", {}).get("Code") if isinstance(parsed, dict) else None
+    return code in THROTTLING_ERROR_CODES
+
+
+def is_throttling_error(exc: BaseException) -> bool:
+    """Returns True if an exception from botocore means throttling."""
+    response = getattr(exc, "response", None)
+    if not isinstance(response, dict):
+        return False
+    if response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 503:
+        return True
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+# Errors which mean a request couldn't get through, rather than that it was
+# rejected.
+_CONNECTION_ERRORS = (
+    botocore.exceptions.ConnectionError,
+    botocore.exceptions.HTTPClientError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+def is_congestion_error(exc: BaseException) -> bool:
+    """
+    Returns True if an exception means that S3 or the network is struggling:
+    a server error (5xx), a timeout, or a connection failure. Other errors,
+    like a missing key, say nothing about how many requests S3 can handle.
+    """
+    if isinstance(exc, _CONNECTION_ERRORS):
+        return True
+    response = getattr(exc, "response", None)
+    if not isinstance(response, dict):
+        return False
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return isinstance(status, int) and status >= 500
+
+
+class RequestTimer:
+    """
+    Times a request for an :py:class:`AdaptiveLimiter`. Its latency runs from
+    the start of the request until :py:meth:`responded` is called, or until
+    the request finishes if it never is.
+    """
+
+    def __init__(self) -> None:
+        self._start = time.monotonic()
+        self._latency: Optional[float] = None
+        self._measured = True
+
+    def responded(self) -> None:
+        """Mark the time the response's headers arrived."""
+        if self._latency is None:
+            self._latency = time.monotonic() - self._start
+
+    def skip(self) -> None:
+        """
+        Don't record this request's latency, because it mostly measures
+        something other than how busy S3 is, like uploading a large body.
+        """
+        self._measured = False
+
+    def latency(self) -> Optional[float]:
+        """The request's latency in seconds, or None if it's skipped."""
+        if not self._measured:
+            return None
+        if self._latency is None:
+            return time.monotonic() - self._start
+        return self._latency
+
+
+@dataclasses.dataclass
+class LimiterStats:
+    """A snapshot of an AdaptiveLimiter's state."""
+
+    #: The current limit on concurrent requests.
+    limit: int
+    #: The number of requests in flight.
+    in_flight: int
+    #: Percentiles of recent request latencies, in seconds.
+    p50: float
+    p90: float
+    p99: float
+    requests: int
+    throttled: int
+    errors: int
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent S3 requests, adapting the limit to what S3
+    can handle, using additive-increase/multiplicative-decrease (AIMD), like
+    TCP congestion control.
+
+    While requests succeed with normal latency, the limit grows by about one
+    each time a full limit's worth of requests completes. It's cut in half
+    when S3 asks for requests to slow down, and by a smaller factor when
+    requests fail or latency rises well above its baseline, which means
+    requests are queueing somewhere. To avoid overreacting when many requests
+    that were in flight at once fail together, the limit is decreased at most
+    once per typical request latency.
+
+    Use it around each request, marking when the response arrives, so that
+    time spent reading a large body doesn't look like congestion:
+
+    .. code-block:: python
+
+       async with limiter.request() as timer:
+           response = await s3_client.get_object(...)
+           timer.responded()
+           body = await response["Body"].read()
+
+    A limiter can be shared between event loops, but not between threads.
+    """
+
+    min_limit: int
+    max_limit: int
+    #: Latency more than this many times the baseline counts as congestion.
+    latency_tolerance: float
+
+    def __init__(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_tolerance: float = 2.0,
+        window: int = 1000,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future[None]] = collections.deque()
+
+        self._latencies: Deque[float] = collections.deque(maxlen=window)
+        # A smoothed recent latency, and a slowly-rising floor under it which
+        # serves as the uncongested baseline.
+        self._smoothed_latency: Optional[float] = None
+        self._baseline_latency: Optional[float] = None
+        self._last_decrease = -math.inf
+
+        self._requests = 0
+        self._throttled = 0
+        self._errors = 0
+
+    @property
+    def limit(self) -> int:
+        """The current limit on concurrent requests."""
+        return max(int(self._limit), self.min_limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self) -> None:
+        """Wait until another request is allowed, and count it as in flight."""
+        while self._in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Pass the wakeup along to someone else.
+                    self._wake()
+                raise
+        self._in_flight += 1
+
+    def release(self) -> None:
+        """Count a request as no longer in flight."""
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        free = self.limit - self._in_flight
+        while free > 0 and len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if waiter.done() or waiter.get_loop().is_closed():
+                continue
+            waiter.set_result(None)
+            free -= 1
+
+    @contextlib.asynccontextmanager
+    async def request(self) -> AsyncIterator[RequestTimer]:
+        """
+        Hold a slot for a request while the context is active. When it
+        succeeds, its latency is recorded, up to the time marked with the
+        :py:class:`RequestTimer` it yields. If it fails, throttling and other
+        signs of congestion (see :py:func:`is_congestion_error`) decrease the
+        limit; other errors are passed through without affecting it.
+        """
+        await self.acquire()
+        timer = RequestTimer()
+        try:
+            yield timer
+        except Exception as e:
+            if is_throttling_error(e):
+                self.on_throttled()
+            elif is_congestion_error(e):
+                self.on_error()
+            raise
+        else:
+            self.on_success(timer.latency())
+        finally:
+            self.release()
+
+    def on_success(self, latency: Optional[float]) -> None:
+        """
+        Record a request which succeeded after latency seconds. A latency of
+        None means that it wasn't measured.
+        """
+        self._requests += 1
+        if latency is not None:
+            self._latencies.append(latency)
+            if self._smoothed_latency is None or self._baseline_latency is None:
+                self._smoothed_latency = latency
+                self._baseline_latency = latency
+            else:
+                self._smoothed_latency += 0.1 * (latency - self._smoothed_latency)
+                # Let the baseline drift up slowly, so that it follows real
+                # changes in latency rather than sticking at one lucky request.
+                self._baseline_latency = min(latency, self._baseline_latency * 1.01)
+
+        if self._congested():
+            self._decrease(0.9)
+        else:
+            self._set_limit(self._limit + 1 / self._limit)
+
+    def _congested(self) -> bool:
+        if self._smoothed_latency is None or self._baseline_latency is None:
+            return False
+        return self._smoothed_latency > self.latency_tolerance * self._baseline_latency
+
+    def on_throttled(self) -> None:
+        """Record a response telling us to slow down."""
+        self._throttled += 1
+        self._decrease(0.5)
+
+    def on_error(self) -> None:
+        """Record a request which failed because of a server or network error."""
+        self._errors += 1
+        self._decrease(0.9)
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self._smoothed_latency or 0.0):
+            return
+        self._last_decrease = now
+        self._set_limit(self._limit * factor)
+        logger.debug("decreased concurrency limit to %d", self.limit)
+
+    def _set_limit(self, limit: float) -> None:
+        self._limit = min(max(limit, float(self.min_limit)), float(self.max_limit))
+        self._wake()
+
+    def latency_percentiles(self) -> Dict[int, float]:
+        """
+        Percentiles (50, 90, and 99) of the latencies of recent successful
+        requests, in seconds. They're NaN before any requests have succeeded.
+        """
+        latencies = sorted(self._latencies)
+        result = {}
+        for p in (50, 90, 99):
+            if len(latencies) == 0:
+                result[p] = math.nan
+            else:
+                index = min(len(latencies) - 1, int(len(latencies) * p / 100))
+                result[p] = latencies[index]
+        return result
+
+    @property
+    def stats(self) -> LimiterStats:
+        percentiles = self.latency_percentiles()
+        return LimiterStats(
+            limit=self.limit,
+            in_flight=self._in_flight,
+            p50=percentiles[50],
+            p90=percentiles[90],
+            p99=percentiles[99],
+            requests=self._requests,
+            throttled=self._throttled,
+            errors=self._errors,
+        )
@@ -1,8 +1,30 @@
 from __future__ import annotations
 
 from types import TracebackType
-from typing import AsyncGenerator, Iterator, Optional, List, Union, Type
-
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    Type,
+)
+
+import collections
+import contextlib
+import itertools
+import os
 import pathlib
 import logging
 import time
@@ -10,15 +32,55 @@ from astropy.time import Time
 from astropy.coordinates import SkyCoord, Angle
 
 from alertbase.alert import AlertRecord
-from alertbase.alert_tar import iterate_tarfile
-from alertbase.blobstore import Blobstore, BlobstoreSession
-from alertbase.index import IndexDB
+from alertbase.alert_tar import AsyncTarfileReader, TarfileSource
+from alertbase.blobstore import (
+    Blobstore,
+    BlobstoreSession,
+    Bundle,
+    RangeRequest,
+    V2_LAYOUT,
+    bundle_group,
+)
+from alertbase.blobcache import BlobCache, DEFAULT_MAX_BYTES as DEFAULT_CACHE_MAX_BYTES
+from alertbase.checkpoint import IngestCheckpoint
+from alertbase.compression import CompressionDictionary
+from alertbase.decode_pool import DecodePool
+from alertbase.index import IndexDB, IndexBatch
+from alertbase.lru import LRUCache
 from alertbase.dbmeta import DBMeta
 
 import asyncio
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+#: The number of candidate ID to URL lookups the Database caches in memory.
+DEFAULT_URL_CACHE_SIZE = 100_000
+#: The number of candidate IDs in the object ID lookups that the Database
+#: caches in memory.
+DEFAULT_OBJECT_CACHE_SIZE = 100_000
+#: The number of bytes of raw alert data in the decoded alerts that the
+#: Database caches in memory. Decoded alerts take a few times more memory
+#: than their raw data.
+DEFAULT_ALERT_CACHE_BYTES = 64 * 1024 * 1024
+
+#: The number of candidates in the first batch that a query stream resolves
+#: from the index before starting downloads. Later batches double in size up to
+#: STREAM_MAX_BATCH_SIZE.
+STREAM_FIRST_BATCH_SIZE = 16
+STREAM_MAX_BATCH_SIZE = 1024
+#: The number of download requests a query stream plans ahead.
+STREAM_REQUEST_QUEUE_SIZE = 64
+#: The number of downloaded alerts a query stream buffers for its consumer.
+STREAM_RESULT_QUEUE_SIZE = 256
+#: How far ahead of its consumer an ordered query stream downloads, in alerts.
+STREAM_REORDER_WINDOW = 1024
+
+# An alert from a query stream, or its raw data, with its position in the
+# stream and its candidate ID.
+_StreamResult = Tuple[int, int, Union[AlertRecord, bytes]]
+
 
 class Database:
     """
@@ -31,6 +93,17 @@ class Database:
     meta: DBMeta
     db_path: pathlib.Path
 
+    #: In-memory caches of index lookups and decoded alerts, so that hot
+    #: queries don't repeat work. Writes through the Database invalidate them.
+    #: Cached alerts are shared between queries, so they shouldn't be
+    #: modified.
+    url_cache: LRUCache[int, str]
+    object_cache: LRUCache[str, List[int]]
+    alert_cache: LRUCache[int, AlertRecord]
+
+    #: Decodes downloaded alerts in worker processes, if set.
+    decode_pool: Optional[DecodePool]
+
     any_writes: bool = False
 
     def __init__(
@@ -39,11 +112,26 @@ class Database:
         bucket: str,
         db_path: Union[pathlib.Path, str],
         create_if_missing: bool = False,
+        blobstore_layout: Optional[str] = None,
+        cache_dir: Optional[Union[pathlib.Path, str]] = None,
+        cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        decode_workers: int = 0,
     ):
-        """Legacy constructor."""
+        """
+        Legacy constructor.
+
+        If blobstore_layout is given, it sets how new alerts are stored in the
+        blobstore from now on, and is saved in the database's metadata.
+
+        If cache_dir is given, downloaded alerts are cached there, using at
+        most cache_max_bytes of disk (see :py:class:`alertbase.blobcache.BlobCache`).
+
+        If decode_workers is more than zero, query streams decode alerts in
+        that many worker processes (see
+        :py:class:`alertbase.decode_pool.DecodePool`), rather than in threads.
+        """
         self.db_path = pathlib.Path(db_path)
         self.index = IndexDB(db_path, create_if_missing)
-        self.blobstore = Blobstore(s3_region, bucket)
 
         meta_path = Database._meta_path(db_path)
         if meta_path.exists():
@@ -52,12 +140,46 @@ class Database:
         else:
             self.meta = DBMeta(bucket, s3_region)
             self.meta.compute_keyranges(self.index)
-        with open(meta_path, "w") as f:
-            self.meta.write_to_file(f)
+        if blobstore_layout is not None:
+            self.meta.blobstore_layout = blobstore_layout
+        self.blobstore = Blobstore(
+            s3_region,
+            bucket,
+            layout=self.meta.blobstore_layout,
+            compression_dictionary=self.meta.compression_dictionary,
+            cache=BlobCache(cache_dir, cache_max_bytes) if cache_dir else None,
+        )
+        # Synchronous methods run on this event loop, so that the Blobstore's
+        # S3 clients (which are bound to a loop) are reused between calls.
+        self._loop = asyncio.new_event_loop()
+        self._loop_used = False
+        self._write_meta()
+
+        # If the metadata is dirty now, a previous writer died without closing
+        # the database, so the stats can't be trusted until they're repaired.
+        self._meta_needs_repair = self.meta.dirty
+        if self._meta_needs_repair:
+            logger.warning(
+                "database at %s was not closed cleanly, so its metadata may be "
+                "inaccurate; use repair_meta() to recompute it",
+                self.db_path,
+            )
+        self.index.on_new_keys = self.meta.update
+
+        self.url_cache = LRUCache(DEFAULT_URL_CACHE_SIZE)
+        self.object_cache = LRUCache(
+            DEFAULT_OBJECT_CACHE_SIZE, sizeof=_candidate_list_size
+        )
+        self.alert_cache = LRUCache(DEFAULT_ALERT_CACHE_BYTES, sizeof=_alert_size)
+        self.decode_pool = DecodePool(decode_workers) if decode_workers > 0 else None
 
     @classmethod
     def create(
-        cls, region: str, bucket: str, db_path: Union[str, pathlib.Path]
+        cls,
+        region: str,
+        bucket: str,
+        db_path: Union[str, pathlib.Path],
+        blobstore_layout: str = V2_LAYOUT,
     ) -> Database:
         """
         Creates a new database on disk and returns the opened database.
@@ -72,12 +194,26 @@ class Database:
                         will be stored. This path should already exist; the
                         database will be created within it.
 
+        :param blobstore_layout: How alerts are stored in the bucket. The
+                                 default, ``"v2"``, stores each alert's Avro
+                                 file as-is. ``"v3"`` stores alerts with Avro
+                                 Single Object Encoding, storing their schema
+                                 just once, which is smaller and faster to
+                                 decode. Alerts stored with either layout can
+                                 always be read.
+
         :returns: The newly-created Database.
         """
-        return Database(region, bucket, db_path, True)
+        return Database(region, bucket, db_path, True, blobstore_layout)
 
     @classmethod
-    def open(cls, db_path: Union[str, pathlib.Path]) -> Database:
+    def open(
+        cls,
+        db_path: Union[str, pathlib.Path],
+        cache_dir: Optional[Union[str, pathlib.Path]] = None,
+        cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        decode_workers: int = 0,
+    ) -> Database:
         """
         Opens a database from disk.
 
@@ -87,6 +223,23 @@ class Database:
         :param db_path: A path on disk to a directory where the database is
                         stored.
 
+        :param cache_dir: A path on disk to a directory to cache downloaded
+                          alerts in. Repeated queries for the same alerts are
+                          served from the cache rather than S3. The directory
+                          is created if it doesn't exist. The cache's size
+                          is tracked in memory, so the directory should only
+                          be used by one Database at a time.
+
+        :param cache_max_bytes: The most disk space the cache may use. The
+                                least recently used alerts are evicted to stay
+                                under it.
+
+        :param decode_workers: The number of processes to decode downloaded
+                               alerts in. Decoding is CPU-bound and holds the
+                               GIL, so for queries which return many alerts,
+                               this can be much faster than the default of
+                               decoding in threads.
+
         :returns: The newly-opened Database.
         """
         meta_path = Database._meta_path(db_path)
@@ -97,6 +250,9 @@ class Database:
             bucket=meta.s3_bucket,
             db_path=db_path,
             create_if_missing=False,
+            cache_dir=cache_dir,
+            cache_max_bytes=cache_max_bytes,
+            decode_workers=decode_workers,
         )
 
     def __enter__(self) -> Database:
@@ -121,36 +277,200 @@ class Database:
     def _meta_path(db_path: Union[str, pathlib.Path]) -> pathlib.Path:
         return db_path / pathlib.Path("meta.json")
 
+    @staticmethod
+    def _checkpoint_path(db_path: Union[str, pathlib.Path]) -> pathlib.Path:
+        return db_path / pathlib.Path("ingest_checkpoint.json")
+
     def close(self) -> None:
         """
-        Close the Database. If any new alerts were written into the database since
-        it was opened, then the stored metadata will be updated by recomputing
-        summary statistics, which can take a little while.
+        Close the Database, saving its metadata. Summary statistics in the
+        metadata are kept up to date as alerts are written, so this is quick.
 
         After calling this, the Database's underlying storage handles will be
         closed, so the Database will no longer work for queries.
+
+        S3 clients opened by the async methods on your own event loop are
+        closed when those methods finish.
         """
         if self.any_writes:
-            logger.info("since writes took place, computing meta.json key ranges")
-            self.meta.compute_keyranges(self.index)
+            self.meta.dirty = self._meta_needs_repair
+        self._write_meta()
+        self.index.close()
+        if self._loop_used:
+            self._loop.run_until_complete(self.blobstore.close())
+        self._loop.close()
+        if self.decode_pool is not None:
+            self.decode_pool.close()
+
+    def _run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine to completion on the Database's event loop."""
+        self._loop_used = True
+        return self._loop.run_until_complete(coro)
+
+    @contextlib.asynccontextmanager
+    async def _clients(self) -> AsyncIterator[None]:
+        """
+        Keep S3 clients open for a public async method. On the Database's own
+        event loop, they stay open for later calls until the Database is
+        closed. On a caller's event loop, which might be closed as soon as the
+        method returns, they are closed once nothing is using them.
+        """
+        if asyncio.get_running_loop() is self._loop:
+            yield
+        else:
+            async with self.blobstore.clients():
+                yield
+
+    def repair_meta(self) -> None:
+        """
+        Recompute the summary statistics in the Database's metadata by scanning
+        the entire index. This can take a long time for a large index.
+
+        This is only necessary if the Database wasn't closed cleanly after
+        writing to it.
+        """
+        logger.info("computing meta.json key ranges")
+        self.meta.compute_keyranges(self.index)
+        self._meta_needs_repair = False
+        if not self.any_writes:
+            self.meta.dirty = False
+        self._write_meta()
+
+    def set_compression_dictionary(
+        self, dictionary: Optional[CompressionDictionary]
+    ) -> None:
+        """
+        Compress alerts written from now on with a zstd dictionary. The
+        dictionary is stored in the bucket, and its ID is saved in the
+        Database's metadata. Alerts that are already stored are unaffected;
+        alerts can be read no matter which dictionary, if any, they were
+        compressed with.
+
+        Dictionaries are usually trained from a sample of alerts with
+        :py:meth:`alertbase.compression.CompressionDictionary.train_from_tarfile`.
+
+        :param dictionary: The dictionary to use, or None to stop compressing
+                           new alerts.
+        """
+        if dictionary is not None:
+
+            async def store() -> None:
+                async with await self.blobstore.session() as session:
+                    await session.store_dictionary(dictionary)
+
+            self._run(store())
+            dict_id: Optional[int] = dictionary.dict_id
         else:
-            logger.debug("skipping keyrange computation because no writes occurred")
-        with open(Database._meta_path(self.db_path), "w") as f:
+            dict_id = None
+        self.blobstore.compression_dictionary = dict_id
+        self.meta.compression_dictionary = dict_id
+        self._write_meta()
+
+    def _write_meta(self) -> None:
+        """
+        Save the metadata to disk. The write is atomic, so a crash leaves
+        either the old metadata or the new.
+        """
+        meta_path = Database._meta_path(self.db_path)
+        tmp_path = meta_path.with_name(meta_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
             self.meta.write_to_file(f)
-        self.index.close()
+        os.replace(tmp_path, meta_path)
 
-    async def _write(self, alert: AlertRecord, session: BlobstoreSession) -> None:
-        self.any_writes = True
+    def _start_writing(self) -> None:
+        """
+        Mark the metadata as dirty before the first write, so that if the
+        process dies before closing the Database, the next one to open it knows
+        the stats are inaccurate.
+        """
+        if not self.any_writes:
+            self.any_writes = True
+            self.meta.dirty = True
+            self._write_meta()
+
+    async def _write(
+        self,
+        alert: AlertRecord,
+        session: BlobstoreSession,
+        batch: Optional[IndexBatch] = None,
+    ) -> None:
+        """
+        Upload an alert and index it. If batch is provided, the alert is added
+        to the batch rather than written into the index immediately; the caller
+        is responsible for flushing the batch.
+        """
+        self._start_writing()
         start = time.monotonic()
         logger.debug("writing alert id=%s", alert.candidate_id)
         url = await session.upload(alert)
-        self.index.insert(url, alert)
+        if batch is None:
+            self.index.insert(url, alert)
+        else:
+            batch.insert(url, alert)
+        self._invalidate_caches(alert)
         logger.info(
             "wrote alert id=%s\ttiming=%.3fs",
             alert.candidate_id,
             time.monotonic() - start,
         )
 
+    async def _write_bundle(
+        self, bundle: Bundle, session: BlobstoreSession, batch: IndexBatch
+    ) -> None:
+        """Upload a bundle of alerts, and add them all to an index batch."""
+        self._start_writing()
+        start = time.monotonic()
+        urls = await session.upload_bundle(bundle)
+        for url, alert in zip(urls, bundle.alerts):
+            batch.insert(url, alert)
+            self._invalidate_caches(alert)
+        logger.info(
+            "wrote bundle key=%s\tn_alerts=%d\tsize=%d\ttiming=%.3fs",
+            bundle.key,
+            len(bundle.alerts),
+            bundle.size,
+            time.monotonic() - start,
+        )
+
+    def _invalidate_caches(self, alert: AlertRecord) -> None:
+        """Forget anything cached about an alert which is being written."""
+        self.url_cache.pop(alert.candidate_id)
+        self.alert_cache.pop(alert.candidate_id)
+        self.object_cache.pop(alert.object_id)
+
+    def _batch(
+        self,
+        on_flush: Optional[Callable[[List[Tuple[str, AlertRecord]]], None]] = None,
+    ) -> IndexBatch:
+        """
+        Create an index batch. Alerts in a batch aren't visible in the index
+        until it's flushed, and a query in the meantime could cache what it
+        saw, so caches are invalidated again on flush.
+        """
+
+        def flushed(written: List[Tuple[str, AlertRecord]]) -> None:
+            for _, alert in written:
+                self._invalidate_caches(alert)
+            if on_flush is not None:
+                on_flush(written)
+
+        return self.index.batch(on_flush=flushed)
+
+    def _get_url(self, candidate_id: int) -> Optional[str]:
+        url = self.url_cache.get(candidate_id)
+        if url is None:
+            url = self.index.get_url(candidate_id)
+            if url is not None:
+                self.url_cache.put(candidate_id, url)
+        return url
+
+    def _object_search(self, object_id: str) -> Iterator[int]:
+        candidates = self.object_cache.get(object_id)
+        if candidates is None:
+            candidates = list(self.index.object_search(object_id))
+            self.object_cache.put(object_id, candidates)
+        return iter(candidates)
+
     def write(self, alert: AlertRecord) -> None:
         """
         Synchronously write a single alert into the database.
@@ -162,7 +482,7 @@ class Database:
             async with await self.blobstore.session() as session:
                 await self._write(alert, session)
 
-        return asyncio.run(do_write())
+        return self._run(do_write())
 
     async def write_many(self, alerts: Iterator[AlertRecord], n_worker: int) -> None:
         """
@@ -184,6 +504,7 @@ class Database:
         """
         q: asyncio.Queue[AlertRecord] = asyncio.Queue()
         iterator_done = asyncio.Event()
+        batch = self._batch()
 
         async def enqueue_alerts() -> None:
             for alert in alerts:
@@ -197,21 +518,23 @@ class Database:
                     if iterator_done.is_set() and q.empty():
                         break
                     alert = await q.get()
-                    await self._write(alert, session)
+                    await self._write(alert, session, batch)
                     q.task_done()
                     await asyncio.sleep(0)  # Yield to the scheduler
 
-        workers = []
-        asyncio.create_task(enqueue_alerts())
-        for i in range(n_worker):
-            task = asyncio.create_task(do_write())
-            workers.append(task)
+        async with self._clients():
+            workers = []
+            asyncio.create_task(enqueue_alerts())
+            for i in range(n_worker):
+                task = asyncio.create_task(do_write())
+                workers.append(task)
 
-        try:
-            await asyncio.gather(*workers)
-        finally:
-            for w in workers:
-                w.cancel()
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for w in workers:
+                    w.cancel()
+                batch.flush()
 
     def get_by_candidate_id(self, candidate_id: int) -> Optional[AlertRecord]:
         """
@@ -222,7 +545,10 @@ class Database:
         :param candidate_id: The ID of the alert candidate to retrieve.
         :returns: The full alert payload.
         """
-        url = self.index.get_url(candidate_id)
+        alert = self.alert_cache.get(candidate_id)
+        if alert is not None:
+            return alert
+        url = self._get_url(candidate_id)
         if url is None:
             return None
 
@@ -230,7 +556,9 @@ class Database:
             async with await self.blobstore.session() as session:
                 return await session.download(url)
 
-        return asyncio.run(fetch(url))
+        alert = self._run(fetch(url))
+        self.alert_cache.put(candidate_id, alert)
+        return alert
 
     def get_by_object_id(self, object_id: str) -> List[AlertRecord]:
         """
@@ -241,7 +569,7 @@ class Database:
         :param object_id: The ZTF Object ID to search for.
         :returns: A list of all alerts associated with the object.
         """
-        candidates = self.index.object_search(object_id)
+        candidates = self._object_search(object_id)
         return self._download_alerts(candidates)
 
     def get_by_time_range(self, start: Time, end: Time) -> List[AlertRecord]:
@@ -263,6 +591,23 @@ class Database:
         candidates = self.index.timerange_search(start, end)
         return self._download_alerts(candidates)
 
+    def get_by_candidate_range(self, start: int, end: int) -> List[AlertRecord]:
+        """
+        Fetch all alerts with candidate IDs in a range. This list can be very
+        large!
+
+        This requires an index with the ``uint64`` candidate key layout; see
+        :py:class:`alertbase.index.IndexLayout`.
+
+        :param start: Start of the range of candidate IDs (inclusive).
+
+        :param end: End of the range of candidate IDs (exclusive).
+
+        :returns: A list of all alerts in the range.
+        """
+        candidates = self.index.candidate_range_search(start, end)
+        return self._download_alerts(candidates)
+
     def get_by_cone_search(self, center: SkyCoord, radius: Angle) -> List[AlertRecord]:
         """
         Fetch all alerts in a circular region of the sky.
@@ -279,7 +624,7 @@ class Database:
         return self._download_alerts(candidates)
 
     def get_by_object_id_stream(
-        self, object_id: str
+        self, object_id: str, ordered: bool = False
     ) -> AsyncGenerator[AlertRecord, None]:
         """
         Asynchronously start retrieving all alerts associated with a particular
@@ -289,14 +634,19 @@ class Database:
 
         :param object_id: The ZTF Object ID to search for.
 
+        :param ordered: If True, yield the alerts in the order they were
+                        added to the database, which is usually time order.
+                        Otherwise, alerts are yielded as soon as they are
+                        downloaded, in any order.
+
         :returns: An asynchronous stream of the alerts associated with the
                   object.
         """
-        candidates = self.index.object_search(object_id)
-        return self._stream_alerts(candidates)
+        candidates = self._object_search(object_id)
+        return self._stream_alerts(candidates, ordered=ordered)
 
     def get_by_time_range_stream(
-        self, start: Time, end: Time
+        self, start: Time, end: Time, ordered: bool = False
     ) -> AsyncGenerator[AlertRecord, None]:
         """
         Asynchronously start retrieving all alerts from between the given start and
@@ -313,13 +663,39 @@ class Database:
         :param end: End of the time range to search over (exclusive).
         :type end: astropy.time.Time
 
+        :param ordered: If True, yield the alerts in time order. Otherwise,
+                        alerts are yielded as soon as they are downloaded, in
+                        any order.
+
         :returns: An asynchronous stream of all alerts between the two times.
         """
         candidates = self.index.timerange_search(start, end)
-        return self._stream_alerts(candidates)
+        return self._stream_alerts(candidates, ordered=ordered)
+
+    def get_by_candidate_range_stream(
+        self, start: int, end: int, ordered: bool = False
+    ) -> AsyncGenerator[AlertRecord, None]:
+        """
+        Asynchronously start retrieving all alerts with candidate IDs in a
+        range.
+
+        This is the async equivalent of :py:obj:`get_by_candidate_range`.
+
+        :param start: Start of the range of candidate IDs (inclusive).
+
+        :param end: End of the range of candidate IDs (exclusive).
+
+        :param ordered: If True, yield the alerts in order of candidate ID.
+                        Otherwise, alerts are yielded as soon as they are
+                        downloaded, in any order.
+
+        :returns: An asynchronous stream of the alerts in the range.
+        """
+        candidates = self.index.candidate_range_search(start, end)
+        return self._stream_alerts(candidates, ordered=ordered)
 
     def get_by_cone_search_stream(
-        self, center: SkyCoord, radius: Angle
+        self, center: SkyCoord, radius: Angle, ordered: bool = False
     ) -> AsyncGenerator[AlertRecord, None]:
         candidates = self.index.cone_search(center, radius)
         """
@@ -333,9 +709,14 @@ class Database:
         :param radius: The radius of the disc to search over.
         :type radius: astropy.coordinates.Angle
 
+        :param ordered: If True, yield the alerts in the order the index
+                        finds them, which groups them by HEALPix pixel.
+                        Otherwise, alerts are yielded as soon as they are
+                        downloaded, in any order.
+
         :returns: An asynchronous stream of the alerts in the region.
         """
-        return self._stream_alerts(candidates)
+        return self._stream_alerts(candidates, ordered=ordered)
 
     def _download_alerts(self, candidates: Iterator[int]) -> List[AlertRecord]:
         """
@@ -349,72 +730,297 @@ class Database:
                 result.append(alert)
             return result
 
-        return asyncio.run(fetch(candidates))
+        return self._run(fetch(candidates))
+
+    def get_raw_stream(
+        self, candidate_ids: Iterable[int], ordered: bool = False
+    ) -> AsyncGenerator[Tuple[int, bytes], None]:
+        """
+        Asynchronously start retrieving alerts without decoding them, for
+        when only their raw data is needed, like to copy them somewhere else.
+        Skipping decoding makes this much faster than the other queries.
+
+        Find the candidate IDs with the database's index, like
+        ``db.get_raw_stream(db.index.timerange_search(start, end))``.
+
+        :param candidate_ids: The candidate IDs of the alerts to retrieve.
+
+        :param ordered: If True, yield the alerts in the order of
+                        candidate_ids. Otherwise, alerts are yielded as soon
+                        as they are downloaded, in any order.
+
+        :returns: An asynchronous stream of pairs of candidate IDs and the
+                  alerts' raw data, as uncompressed Avro Object Container
+                  Files (see :py:attr:`alertbase.alert.AlertRecord.raw_data`).
+        """
+        return self._stream_raw(iter(candidate_ids), ordered)
+
+    async def _stream_raw(
+        self, candidate_ids: Iterator[int], ordered: bool
+    ) -> AsyncGenerator[Tuple[int, bytes], None]:
+        async with self._clients():
+            results = self._stream(candidate_ids, ordered, STREAM_REORDER_WINDOW, True)
+            try:
+                async for candidate_id, raw in results:
+                    assert isinstance(raw, bytes)
+                    yield candidate_id, raw
+            finally:
+                await results.aclose()
 
     async def _stream_alerts(
         self,
         candidate_ids: Iterator[int],
+        ordered: bool = False,
+        window: int = STREAM_REORDER_WINDOW,
     ) -> AsyncGenerator[AlertRecord, None]:
         """
         Asynchronously fetch all the candidates' associated alert data. Returns an
         asynchronous generator over the alerts.
+
+        Alerts are yielded as soon as they are downloaded, unless ordered is
+        True, in which case they are yielded in the order of candidate_ids.
+        Downloads still run concurrently, up to window alerts ahead of the
+        last alert yielded; alerts which arrive early wait in a reorder
+        buffer.
         """
-        url_queue: asyncio.Queue[str] = asyncio.Queue()
-        result_queue: asyncio.Queue[AlertRecord] = asyncio.Queue()
-
-        n = 0
-        for id in candidate_ids:
-            n += 1
-            url = self.index.get_url(id)
-            if url is None:
-                raise ValueError(f"no known URL for candidate: {id}")
-            await url_queue.put(url)
-
-        if n < 10:
-            n_worker = 1
-        elif n < 20:
-            n_worker = 2
-        elif n < 40:
-            n_worker = 3
-        elif n < 60:
-            n_worker = 4
-        elif n < 80:
-            n_worker = 5
-        else:
-            n_worker = 8
+        async with self._clients():
+            results = self._stream(candidate_ids, ordered, window, False)
+            try:
+                async for _, alert in results:
+                    assert isinstance(alert, AlertRecord)
+                    yield alert
+            finally:
+                await results.aclose()
+
+    async def _stream(
+        self,
+        candidate_ids: Iterator[int],
+        ordered: bool,
+        window: int,
+        raw: bool,
+    ) -> AsyncGenerator[Tuple[int, Union[AlertRecord, bytes]], None]:
+        """
+        Download the candidates' alerts, yielding pairs of candidate IDs and
+        alerts, or the alerts' raw data if raw is True.
+
+        Looking up the candidates in the index, resolving their URLs,
+        downloading, and decoding run as a pipeline, connected by bounded
+        queues. The first alerts are downloaded while the index scan
+        continues, and a large query never holds more than a bounded number of
+        alerts or pending requests in memory: if the consumer falls behind,
+        downloading and then the index scan pause until it catches up.
+
+        Alerts which are stored near each other in the same bundle are
+        downloaded together, with a single GET (see
+        :py:meth:`alertbase.blobstore.Blobstore.coalesce`). Candidates are
+        resolved in batches, and only alerts within a batch are coalesced.
+
+        Alerts are decoded in the Database's decode_pool if it has one, while
+        downloads continue, or else in threads.
+        """
+        request_queue: asyncio.Queue[RangeRequest] = asyncio.Queue(
+            STREAM_REQUEST_QUEUE_SIZE
+        )
+        result_queue: asyncio.Queue[Union[_StreamResult, Exception, None]] = (
+            asyncio.Queue(STREAM_RESULT_QUEUE_SIZE)
+        )
 
-        async def process_queue() -> None:
-            async with await self.blobstore.session() as session:
+        # Each alert's position in candidate_ids, and its candidate ID, by
+        # URL, until it's downloaded.
+        positions: Dict[str, Deque[Tuple[int, int]]] = collections.defaultdict(
+            collections.deque
+        )
+        # Limits how many requests can be waiting to be decoded, so that a
+        # slow decode pool holds up downloads.
+        decode_slots = asyncio.Semaphore(STREAM_REQUEST_QUEUE_SIZE)
+
+        # The number of alerts which the producer has found, the number which
+        # have been yielded, and whether the producer has finished.
+        n_alerts = 0
+        n_yielded = 0
+        producer_done = False
+        # Set whenever an alert is yielded in ordered mode, making room in the
+        # reorder window.
+        room = asyncio.Event()
+
+        async def wait_for_room(n: int) -> None:
+            while ordered and n_alerts + n - n_yielded > window:
+                room.clear()
+                await room.wait()
+
+        async def produce() -> None:
+            nonlocal n_alerts
+            try:
+                # Start with a small batch, so that the first downloads start
+                # right away, and then grow it so that larger queries get
+                # coalesced well. In ordered mode, a whole batch must fit in
+                # the reorder window, and batches are kept to a fraction of
+                # it: the next batch is admitted as soon as that much room
+                # opens up, so downloads never have to drain the window
+                # before more can start.
+                max_batch_size = STREAM_MAX_BATCH_SIZE
+                if ordered:
+                    max_batch_size = max(1, min(max_batch_size, window // 4))
+                batch_size = min(STREAM_FIRST_BATCH_SIZE, max_batch_size)
                 while True:
-                    url = await url_queue.get()
-                    alert = await session.download(url)
-                    await result_queue.put(alert)
-
-        tasks = []
-        for i in range(n_worker):
-            task = asyncio.create_task(process_queue())
-            tasks.append(task)
-
-        for i in range(n):
-            result = await result_queue.get()
-            yield result
+                    # The index is read synchronously, so this blocks the
+                    # event loop for a batch at a time.
+                    ids = list(itertools.islice(candidate_ids, batch_size))
+                    if len(ids) == 0:
+                        break
+                    await wait_for_room(len(ids))
+                    urls = []
+                    for id in ids:
+                        position = n_alerts
+                        n_alerts += 1
+                        alert = self.alert_cache.get(id)
+                        if alert is not None:
+                            result = alert.raw_data if raw else alert
+                            assert result is not None
+                            await result_queue.put((position, id, result))
+                            continue
+                        url = self._get_url(id)
+                        if url is None:
+                            raise ValueError(f"no known URL for candidate: {id}")
+                        positions[url].append((position, id))
+                        urls.append(url)
+                    for request in self.blobstore.coalesce(urls):
+                        spawn_workers(1)
+                        await request_queue.put(request)
+                    spawn_workers()
+                    batch_size = min(2 * batch_size, max_batch_size)
+            except Exception as e:
+                await result_queue.put(e)
+            finally:
+                await result_queue.put(None)
+
+        # Each worker makes one request at a time. The number of workers
+        # follows the Blobstore's adaptive limit on concurrent requests, so it
+        # grows while S3 keeps up, and shrinks as workers finish if S3 slows
+        # down.
+        tasks: Set[asyncio.Task[None]] = set()
+        n_workers = 0
+
+        def spawn_workers(pending: int = 0) -> None:
+            nonlocal n_workers
+            limit = self.blobstore.limiter.limit
+            while n_workers < min(limit, request_queue.qsize() + pending):
+                n_workers += 1
+                task = asyncio.create_task(process_queue())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
 
-        for t in tasks:
-            t.cancel()
+        async def process_queue() -> None:
+            nonlocal n_workers
+            try:
+                async with await self.blobstore.session() as session:
+                    while True:
+                        if n_workers > self.blobstore.limiter.limit:
+                            n_workers -= 1
+                            return
+                        try:
+                            request = request_queue.get_nowait()
+                        except asyncio.QueueEmpty:
+                            # Count this worker out right away, so that
+                            # several can't all decide to leave at once. The
+                            # producer starts more as it finds more work.
+                            n_workers -= 1
+                            return
+                        if raw:
+                            raws = await session.download_raw_coalesced(request)
+                            await put_results(request, raws)
+                        elif self.decode_pool is not None:
+                            raws = await session.download_raw_coalesced(request)
+                            # Keep downloading while these are decoded.
+                            await decode_slots.acquire()
+                            task = asyncio.create_task(decode(request, raws))
+                            tasks.add(task)
+                            task.add_done_callback(tasks.discard)
+                        else:
+                            alerts = await session.download_coalesced(request)
+                            await put_results(request, alerts)
+                        spawn_workers()
+            except Exception as e:
+                await result_queue.put(e)
+
+        async def decode(request: RangeRequest, raws: List[bytes]) -> None:
+            assert self.decode_pool is not None
+            try:
+                await put_results(request, await self.decode_pool.decode(raws))
+            except Exception as e:
+                await result_queue.put(e)
+            finally:
+                decode_slots.release()
+
+        async def put_results(
+            request: RangeRequest, results: Sequence[Union[AlertRecord, bytes]]
+        ) -> None:
+            for ref, result in zip(request.refs, results):
+                if isinstance(result, AlertRecord):
+                    self.alert_cache.put(result.candidate_id, result)
+                position, candidate_id = positions[ref.url].popleft()
+                if len(positions[ref.url]) == 0:
+                    del positions[ref.url]
+                await result_queue.put((position, candidate_id, result))
+
+        producer = asyncio.create_task(produce())
+        try:
+            # Results which arrived ahead of their turn, in ordered mode.
+            early: Dict[int, Tuple[int, Union[AlertRecord, bytes]]] = {}
+            while not producer_done or n_yielded < n_alerts:
+                result = await result_queue.get()
+                if result is None:
+                    producer_done = True
+                    continue
+                if isinstance(result, Exception):
+                    raise result
+                position, candidate_id, alert = result
+                if not ordered:
+                    n_yielded += 1
+                    yield candidate_id, alert
+                    continue
+                early[position] = (candidate_id, alert)
+                while n_yielded in early:
+                    item = early.pop(n_yielded)
+                    n_yielded += 1
+                    room.set()
+                    yield item
+        finally:
+            # Stop everything if the consumer stopped early, or on errors.
+            producer.cancel()
+            for t in list(tasks):
+                t.cancel()
 
     async def upload_tarfile(
         self,
-        tarfile_path: pathlib.Path,
+        tarfile_path: TarfileSource,
         n_worker: int = 8,
         limit: Optional[int] = None,
         skip_existing: bool = False,
+        n_parse_worker: Optional[int] = None,
+        resume: bool = False,
+        bundle_size: Optional[int] = None,
     ) -> None:
         """
         Upload a ZTF-style tarfile of alert data using a pool of workers to
         concurrently upload alerts.
 
+        The tarfile is decompressed in a background thread, and alerts are
+        parsed in a pool of processes, so that reading the tarfile never blocks
+        the upload workers. Parser processes are started with the ``spawn``
+        method, so scripts which call this must guard their entrypoint with
+        ``if __name__ == "__main__":``.
+
+        Progress is journaled in an ``ingest_checkpoint.json`` file in the
+        database directory each time alerts are written into the index (see
+        :py:class:`alertbase.checkpoint.IngestCheckpoint`). If the upload is
+        interrupted, it can be picked up again with ``resume=True``. The
+        checkpoint is removed once the whole tarfile has been uploaded.
+
         :param tarfile_path: a local path on disk to a gzipped tarfile containing
-                             individual avro-serialized alert files.
+                             individual avro-serialized alert files, or a
+                             binary file-like object to read one from, such as
+                             ``sys.stdin.buffer``.
 
         :param n_worker: the number of concurrent S3 sessions to open for uploading.
 
@@ -422,56 +1028,177 @@ class Database:
 
         :param skip_existing: if true, don't upload alerts which are already
                               present in the local index
+
+        :param n_parse_worker: the number of processes to use for parsing
+                               alerts. If 0, alerts are parsed in the background
+                               thread which reads the tarfile. By default, one
+                               less than the number of CPUs is used.
+
+        :param resume: if true, continue from the checkpoint left behind by a
+                       previous, interrupted upload of the same tarfile,
+                       skipping straight past alerts which it finished.
+
+        :param bundle_size: if set, pack alerts into bundle objects of about
+                            this many bytes, rather than uploading each alert
+                            as its own S3 object. Alerts are bundled by the
+                            night they were observed, and are read back with
+                            byte-range requests. This takes far fewer
+                            requests, but each upload worker may hold a
+                            bundle in memory.
         """
+        if n_parse_worker is None:
+            n_parse_worker = _default_parse_worker_count()
+
+        checkpoint = self._ingest_checkpoint(tarfile_path, resume)
 
         # Putting a limit on the queue size ensures that we don't slurp
-        # _everything_ into memory at once.
-        upload_queue: asyncio.Queue[AlertRecord] = asyncio.Queue(100)
-        tarfile_read_done = asyncio.Event()
+        # _everything_ into memory at once. A None in the queue tells an
+        # uploader that there is nothing more to upload.
+        upload_queue: asyncio.Queue[Optional[AlertRecord]] = asyncio.Queue(100)
+
+        def on_flush(written: List[Tuple[str, AlertRecord]]) -> None:
+            checkpoint.finish(alert.candidate_id for _, alert in written)
+            checkpoint.save()
+
+        batch = self._batch(on_flush=on_flush)
+        reached_end = False
+        # Bundles which are still being filled, by group.
+        open_bundles: Dict[str, Bundle] = {}
 
         async def tarfile_to_queue() -> None:
+            nonlocal reached_end
             n = 0
-            for alert in iterate_tarfile(tarfile_path):
-                logger.info("scanned alert %s", alert.candidate_id)
-                if skip_existing:
-                    if self.index.get_url(alert.candidate_id) is not None:
-                        logger.info("alert is already stored, skipping it")
-                        continue
-                n += 1
-                if limit is not None and n > limit:
-                    logger.info("tarfile limit reached")
-                    break
-                await upload_queue.put(alert)
-                await asyncio.sleep(0)  # Yield to the scheduler.
-            tarfile_read_done.set()
-            logger.info("done processing tarfile")
+            reader = AsyncTarfileReader(
+                tarfile_path, n_parse_worker, start_offset=checkpoint.offset
+            )
+            try:
+                async with reader:
+                    async for offset, alert in reader.entries():
+                        logger.info("scanned alert %s", alert.candidate_id)
+                        if checkpoint.is_done(offset, alert.candidate_id):
+                            logger.info("alert was done by a previous run, skipping it")
+                            continue
+                        if checkpoint.was_in_flight(alert.candidate_id):
+                            # The previous run might have indexed the alert
+                            # without getting a chance to record that.
+                            if self.index.has_candidate(alert.candidate_id):
+                                logger.info("alert is already stored, skipping it")
+                                checkpoint.resolve(alert.candidate_id)
+                                continue
+                        if skip_existing:
+                            if self.index.has_candidate(alert.candidate_id):
+                                logger.info("alert is already stored, skipping it")
+                                continue
+                        n += 1
+                        if limit is not None and n > limit:
+                            logger.info("tarfile limit reached")
+                            break
+                        checkpoint.start(offset, alert.candidate_id)
+                        await upload_queue.put(alert)
+                    else:
+                        reached_end = True
+                logger.info("done processing tarfile")
+            finally:
+                for _ in range(n_worker):
+                    await upload_queue.put(None)
 
         async def process_queue() -> None:
             logger.debug("process queue online")
             async with await self.blobstore.session() as session:
                 while True:
-                    if tarfile_read_done.is_set() and upload_queue.empty():
+                    alert = await upload_queue.get()
+                    if alert is None:
                         # All input is done, so exit
                         break
-                    # More to go
-                    alert = await upload_queue.get()
-                    await self._write(alert, session)
+                    if bundle_size is None:
+                        await self._write(alert, session, batch)
+                    else:
+                        await add_to_bundle(alert, session)
                     upload_queue.task_done()
-                    await asyncio.sleep(0)  # Yield to the scheduler.
             logger.debug("uploader task done")
 
-        uploaders = []
+        async def add_to_bundle(alert: AlertRecord, session: BlobstoreSession) -> None:
+            assert bundle_size is not None
+            blob = await session.encode(alert)
+            group = bundle_group(alert)
+            bundle = open_bundles.get(group)
+            if bundle is None:
+                bundle = session.new_bundle(group)
+                open_bundles[group] = bundle
+            bundle.add(alert, blob)
+            if bundle.size >= bundle_size:
+                del open_bundles[group]
+                await self._write_bundle(bundle, session, batch)
+
+        async def flush_bundles() -> None:
+            async with await self.blobstore.session() as session:
+                while len(open_bundles) > 0:
+                    _, bundle = open_bundles.popitem()
+                    await self._write_bundle(bundle, session, batch)
+
+        async with self._clients():
+            tasks = [asyncio.create_task(tarfile_to_queue())]
+            for i in range(n_worker):
+                logger.info("spinning up uploader task id=%d", i)
+                task = asyncio.create_task(
+                    process_queue(),
+                )
+                tasks.append(task)
+
+            try:
+                await asyncio.gather(*tasks)
+                # Alerts left in partly-filled bundles are still in flight in
+                # the checkpoint, so if anything failed they're uploaded on
+                # resume.
+                await flush_bundles()
+            finally:
+                for t in tasks:
+                    t.cancel()
+                batch.flush()
+                checkpoint.save()
+        if reached_end:
+            checkpoint.remove()
+
+    def _ingest_checkpoint(
+        self, tarfile_path: TarfileSource, resume: bool
+    ) -> IngestCheckpoint:
+        """
+        Get the checkpoint for an upload of a tarfile, loading the one left by a
+        previous upload if resume is true.
+        """
+        path = Database._checkpoint_path(self.db_path)
+        source = _tarfile_source_name(tarfile_path)
+        if resume:
+            checkpoint = IngestCheckpoint.load(path)
+            if checkpoint is None:
+                logger.info("no checkpoint found, uploading from the beginning")
+            elif checkpoint.source != source:
+                raise ValueError(f"checkpoint is for {checkpoint.source}, not {source}")
+            else:
+                logger.info("resuming upload at offset %d", checkpoint.offset)
+                return checkpoint
+        return IngestCheckpoint(path, source)
 
-        asyncio.create_task(tarfile_to_queue())
-        for i in range(n_worker):
-            logger.info("spinning up uploader task id=%d", i)
-            task = asyncio.create_task(
-                process_queue(),
-            )
-            uploaders.append(task)
 
-        try:
-            await asyncio.gather(*uploaders)
-        finally:
-            for u in uploaders:
-                u.cancel()
+def _candidate_list_size(candidates: List[int]) -> int:
+    # Count the list itself, so that empty lists still take up room.
+    return len(candidates) + 1
+
+
+def _alert_size(alert: AlertRecord) -> int:
+    return len(alert.raw_data) if alert.raw_data is not None else 1
+
+
+def _tarfile_source_name(tarfile_path: TarfileSource) -> str:
+    if isinstance(tarfile_path, (str, pathlib.Path)):
+        return os.path.abspath(tarfile_path)
+    return str(getattr(tarfile_path, "name", "<stream>"))
+
+
+def _default_parse_worker_count() -> int:
+    """
+    Use all but one CPU for parsing alerts, leaving one for the event loop and
+    the tarfile reader. With just one CPU, parse in the reader thread.
+    """
+    n_cpu = os.cpu_count() or 1
+    return n_cpu - 1 if n_cpu > 2 else 0
@@ -1,11 +1,12 @@
 from __future__ import annotations
 
-from typing import Generic, TypeVar, Any, Optional, IO, Dict
+from typing import Generic, TypeVar, Any, Optional, IO, Dict, Sequence
 
 from astropy.time import Time
 import dataclasses
 import json
-from alertbase.index import IndexDB, _TypedLevelDB
+from alertbase.index import IndexDB, NewKeys, _TypedLevelDB
+from alertbase.encoding import unix_ns_to_time
 
 
 @dataclasses.dataclass
@@ -18,6 +19,20 @@ class DBMeta:
     healpixels: DBMetaKeyStats[int]
     timestamps: DBMetaKeyStats[Time]
 
+    #: True while the index is being written to. If the metadata is loaded
+    #: while dirty, the process writing to the index didn't close it cleanly,
+    #: so the stats may be inaccurate until they are repaired with
+    #: compute_keyranges.
+    dirty: bool
+
+    #: How new alerts are stored in the blobstore (see
+    #: :py:data:`alertbase.blobstore.V2_LAYOUT`).
+    blobstore_layout: str
+
+    #: The ID of the zstd dictionary that new alerts are compressed with, or
+    #: None if they aren't compressed.
+    compression_dictionary: Optional[int]
+
     def __init__(
         self,
         bucket: str,
@@ -26,9 +41,15 @@ class DBMeta:
         objects: Optional[DBMetaKeyStats[str]] = None,
         healpixels: Optional[DBMetaKeyStats[int]] = None,
         timestamps: Optional[DBMetaKeyStats[Time]] = None,
+        dirty: bool = False,
+        blobstore_layout: str = "v2",
+        compression_dictionary: Optional[int] = None,
     ):
         self.s3_bucket = bucket
         self.s3_region = region
+        self.dirty = dirty
+        self.blobstore_layout = blobstore_layout
+        self.compression_dictionary = compression_dictionary
         self.candidates = (
             candidates if candidates is not None else DBMetaKeyStats(0, 0, 0)
         )
@@ -43,10 +64,38 @@ class DBMeta:
         )
 
     def compute_keyranges(self, idx: IndexDB) -> None:
-        self.candidates = DBMetaKeyStats.from_db(idx.candidates)
-        self.objects = DBMetaKeyStats.from_db(idx.objects)
-        self.healpixels = DBMetaKeyStats.from_db(idx.healpixels)
-        self.timestamps = DBMetaKeyStats.from_db(idx.timestamps)
+        """
+        Recompute all the stats by scanning every key in the index. This can be
+        slow for a large index; normally, stats are kept up to date with
+        :py:meth:`update` instead.
+        """
+        self.candidates = DBMetaKeyStats.from_db(idx.candidates, 0)
+        self.objects = DBMetaKeyStats.from_db(idx.objects, "")
+        self.healpixels = DBMetaKeyStats.from_db(idx.healpixels, 0)
+        # Timestamp keys are unix nanoseconds; only the min and max need to be
+        # converted into Times.
+        ts = DBMetaKeyStats.from_db(idx.timestamps, 0)
+        self.timestamps = DBMetaKeyStats(
+            count=ts.count,
+            min=unix_ns_to_time(ts.min),
+            max=unix_ns_to_time(ts.max),
+        )
+
+    def update(self, new_keys: NewKeys) -> None:
+        """
+        Update the stats to account for keys that were newly added to the
+        index.
+        """
+        self.candidates.add(new_keys.candidates)
+        self.objects.add(new_keys.objects)
+        self.healpixels.add(new_keys.healpixels)
+        if len(new_keys.timestamps) > 0:
+            min_ns, max_ns = min(new_keys.timestamps), max(new_keys.timestamps)
+            self.timestamps.add_range(
+                len(new_keys.timestamps),
+                unix_ns_to_time(min_ns),
+                unix_ns_to_time(max_ns),
+            )
 
     def to_dict(self) -> Dict[str, Any]:
         return dataclasses.asdict(self)
@@ -89,6 +138,9 @@ class DBMeta:
                 min=Time(data["timestamps"]["min"], format="unix"),
                 max=Time(data["timestamps"]["max"], format="unix"),
             ),
+            dirty=data.get("dirty", False),
+            blobstore_layout=data.get("blobstore_layout", "v2"),
+            compression_dictionary=data.get("compression_dictionary"),
         )
 
 
@@ -102,10 +154,34 @@ class DBMetaKeyStats(Generic[T]):
     max: T
 
     @classmethod
-    def from_db(cls, db: _TypedLevelDB[T, Any]) -> DBMetaKeyStats[T]:
-        count, min, max = db.key_range_stats()
+    def from_db(cls, db: _TypedLevelDB[T, Any], empty: T) -> DBMetaKeyStats[T]:
+        """
+        Compute stats by scanning a database. If it's empty, empty is used for
+        the min and max.
+        """
+        try:
+            count, min, max = db.key_range_stats()
+        except ValueError:
+            # The database is empty.
+            return cls(count=0, min=empty, max=empty)
         return cls(
             count=count,
             min=min,
             max=max,
         )
+
+    def add(self, keys: Sequence[T]) -> None:
+        """Account for new keys, which weren't already counted."""
+        if len(keys) > 0:
+            self.add_range(len(keys), min(keys), max(keys))  # type: ignore
+
+    def add_range(self, count: int, min: T, max: T) -> None:
+        """Account for count new keys, ranging from min to max."""
+        if self.count == 0:
+            self.min, self.max = min, max
+        else:
+            if min < self.min:  # type: ignore
+                self.min = min
+            if max > self.max:  # type: ignore
+                self.max = max
+        self.count += count
@@ -0,0 +1,152 @@
+"""
+Decoding of downloaded alerts in a pool of processes.
+
+The avro package's DatumReader is pure Python, so decoding holds the GIL, and
+decoding in threads can't use more than one core no matter how many downloads
+are running. A DecodePool decodes in worker processes instead, sending raw
+alerts to them in batches so that the cost of passing data between processes
+is spread over many alerts.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+
+from alertbase import single_object
+from alertbase.alert import AlertRecord
+
+logger = logging.getLogger(__name__)
+
+
+def _decode_batch(raws: List[bytes]) -> List[Dict[str, Any]]:
+    """
+    Decode a batch of raw alerts. This runs in a worker process, so it only
+    returns the payloads, rather than sending the raw bytes back.
+    """
+    return [single_object.read_container(raw) for raw in raws]
+
+
+_Pending = Tuple[List[bytes], "asyncio.Future[List[AlertRecord]]"]
+
+
+class DecodePool:
+    """
+    Decodes raw alerts (uncompressed Avro container files, as returned by
+    :py:meth:`alertbase.blobstore.BlobstoreSession.download_raw`) in a pool of
+    n_workers processes.
+
+    Each process works on one batch at a time. While they're all busy, alerts
+    which are waiting to be decoded pile up, and are sent together in the next
+    batch, up to batch_size alerts. So batches are small, for low latency,
+    when the pool keeps up, and grow to amortize overhead when it doesn't.
+
+    The processes are started when they're first needed. A DecodePool can be
+    used from one event loop at a time. Call :py:meth:`close` to stop the
+    processes.
+    """
+
+    n_workers: int
+    batch_size: int
+
+    def __init__(self, n_workers: int, batch_size: int = 64):
+        if n_workers < 1:
+            raise ValueError("a DecodePool needs at least one worker")
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._pending: Deque[_Pending] = collections.deque()
+        self._in_flight = 0
+
+    def _executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._pool is None:
+            # Use the spawn start method, since forking a process that is
+            # running threads and an event loop is unsafe.
+            mp_context = multiprocessing.get_context("spawn")
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.n_workers, mp_context=mp_context
+            )
+        return self._pool
+
+    async def decode(self, raws: List[bytes]) -> List[AlertRecord]:
+        """Decode raw alerts, returning them in the same order."""
+        if len(raws) == 0:
+            return []
+        future: asyncio.Future[List[AlertRecord]]
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((raws, future))
+        self._submit()
+        return await future
+
+    def _submit(self) -> None:
+        while len(self._pending) > 0 and self._in_flight < self.n_workers:
+            batch: List[_Pending] = []
+            size = 0
+            while len(self._pending) > 0:
+                raws, future = self._pending[0]
+                if size > 0 and size + len(raws) > self.batch_size:
+                    break
+                self._pending.popleft()
+                if future.done():
+                    # Cancelled while it waited.
+                    continue
+                batch.append((raws, future))
+                size += len(raws)
+            if len(batch) == 0:
+                continue
+            all_raws = [raw for raws, _ in batch for raw in raws]
+            try:
+                submitted = self._executor().submit(_decode_batch, all_raws)
+            except Exception as e:
+                if isinstance(e, concurrent.futures.BrokenExecutor):
+                    # A worker died. Start a fresh pool for later batches.
+                    logger.warning("decode pool is broken, restarting it: %s", e)
+                    self.close()
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self._in_flight += 1
+            result = asyncio.wrap_future(submitted, loop=batch[0][1].get_loop())
+            result.add_done_callback(functools.partial(self._finish, batch))
+
+    def _finish(
+        self,
+        batch: List[_Pending],
+        result: asyncio.Future[List[Dict[str, Any]]],
+    ) -> None:
+        self._in_flight -= 1
+        exc = None if result.cancelled() else result.exception()
+        start = 0
+        for raws, future in batch:
+            end = start + len(raws)
+            if future.done():
+                pass
+            elif result.cancelled():
+                future.cancel()
+            elif exc is not None:
+                future.set_exception(exc)
+            else:
+                payloads = result.result()[start:end]
+                future.set_result(
+                    [_alert(raw, payload) for raw, payload in zip(raws, payloads)]
+                )
+            start = end
+        self._submit()
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def _alert(raw: bytes, payload: Dict[str, Any]) -> AlertRecord:
+    alert = AlertRecord.from_dict(payload)
+    alert.raw_data = raw
+    return alert
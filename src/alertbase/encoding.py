@@ -1,8 +1,8 @@
-from typing import Tuple, Iterator, Generic, TypeVar, Callable
+from typing import Tuple, Iterator, Generic, TypeVar, Callable, Union
 import struct
 
 from astropy.time import Time
-
+import numpy as np
 
 # This file provides a variety of utilities for converting between python data
 # types and byte arrays.
@@ -17,10 +17,17 @@ class Codec(Generic[T]):
         name: str,
         pack: Pack[T],
         unpack: Unpack[T],
+        order_preserving: bool = False,
     ):
+        """
+        A Codec converts values to and from bytes. If order_preserving is
+        true, packed values sort lexicographically in the same order as the
+        values themselves, so they can be range-scanned as LevelDB keys.
+        """
         self.name = name
         self._pack = pack
         self._unpack = unpack
+        self.order_preserving = order_preserving
 
     def __str__(self) -> str:
         return f"<Codec: {self.name}>"
@@ -44,7 +51,7 @@ def unpack_uint64(data: bytes) -> int:
     return val
 
 
-uint64_codec = Codec("uint64", pack_uint64, unpack_uint64)
+uint64_codec = Codec("uint64", pack_uint64, unpack_uint64, order_preserving=True)
 
 
 # time codec:
@@ -58,7 +65,42 @@ def unpack_time(data: bytes) -> Time:
     return t
 
 
-time_codec = Codec("time", pack_time, unpack_time)
+time_codec = Codec("time", pack_time, unpack_time, order_preserving=True)
+
+
+# Unix nanosecond conversions. These let time keys be handled as plain integers,
+# with astropy only involved at the edges of the public API.
+_UNIX_EPOCH_JD = 2440587.5
+
+
+def time_to_unix_ns(t: Time) -> int:
+    """Convert an astropy Time into integer nanoseconds since the Unix epoch."""
+    return int(t.unix * 1e9)
+
+
+def unix_ns_to_time(ns: int) -> Time:
+    """Convert integer nanoseconds since the Unix epoch into an astropy Time."""
+    return Time(ns / 1e9, format="unix")
+
+
+def jd_to_unix_ns(jd: float) -> int:
+    """Convert a Julian date into integer nanoseconds since the Unix epoch.
+
+    This gives the same result as time_to_unix_ns(Time(jd, format="jd")), but
+    without constructing a Time.
+    """
+    return int((jd - _UNIX_EPOCH_JD) * 86400.0 * 1e9)
+
+
+def jd_to_unix_ns_array(jd: np.ndarray) -> np.ndarray:
+    """Vectorized version of jd_to_unix_ns, returning an int64 array."""
+    result: np.ndarray = ((jd - _UNIX_EPOCH_JD) * 86400.0 * 1e9).astype(np.int64)
+    return result
+
+
+# time_ns codec: unix nanoseconds as plain integers. This packs to exactly the
+# same bytes as time_codec.
+time_ns_codec = Codec("time_ns", pack_uint64, unpack_uint64, order_preserving=True)
 
 
 # varint codec:
@@ -67,12 +109,15 @@ def pack_varint(n: int) -> bytes:
     return _pack_uvarint(_zigzag_encode(n))
 
 
-def _unpack_varint_with_readlength(data: bytes) -> Tuple[int, int]:
-    """Unpacks a variable-length, zig-zag-encoded integer from a given byte buffer.
+def _unpack_varint_with_readlength(
+    data: Union[bytes, memoryview], offset: int = 0
+) -> Tuple[int, int]:
+    """Unpacks a variable-length, zig-zag-encoded integer from a given byte buffer,
+    starting at offset.
 
     Returns the integer and the number of bytes that were read.
     """
-    result, n = _unpack_uvarint(data)
+    result, n = _unpack_uvarint(data, offset)
     return _zigzag_decode(result), n
 
 
@@ -86,32 +131,35 @@ varint_codec = Codec("varint", pack_varint, unpack_varint)
 
 def _pack_uvarint(n: int) -> bytes:
     """Pack an unsigned variable-length integer into bytes. """
-    result = b""
+    result = bytearray()
     while True:
         chunk = n & 0x7F
         n >>= 7
         if n:
-            result += bytes((chunk | 0x80,))
+            result.append(chunk | 0x80)
         else:
-            result += bytes((chunk,))
+            result.append(chunk)
             break
-    return result
+    return bytes(result)
 
 
-def _unpack_uvarint(data: bytes) -> Tuple[int, int]:
-    """Unpacks a variable-length integer stored in given byte buffer.
+def _unpack_uvarint(data: Union[bytes, memoryview], offset: int = 0) -> Tuple[int, int]:
+    """Unpacks a variable-length integer stored in given byte buffer, starting at
+    offset.
 
     Returns the integer and the number of bytes that were read."""
     shift = 0
     result = 0
-    n = 0
-    for b in data:
-        n += 1
+    pos = offset
+    end = len(data)
+    while pos < end:
+        b = data[pos]
+        pos += 1
         result |= (b & 0x7F) << shift
         if not (b & 0x80):
             break
         shift += 7
-    return result, n
+    return result, pos - offset
 
 
 def _zigzag_encode(x: int) -> int:
@@ -127,28 +175,123 @@ def _zigzag_decode(x: int) -> int:
 
 
 # varint iterator codec
+
+# Below this many values, packing a list one value at a time is faster than
+# converting it into an array.
+_ARRAY_PACK_THRESHOLD = 16
+
+
 def pack_varint_iter(ints: Iterator[int]) -> bytes:
-    result = b""
-    for val in ints:
+    vals = list(ints)
+    if len(vals) >= _ARRAY_PACK_THRESHOLD:
+        try:
+            return pack_varint_array(np.array(vals, dtype=np.int64))
+        except OverflowError:
+            # Some values don't fit in 64 bits.
+            pass
+    result = bytearray()
+    for val in vals:
         result += pack_varint(val)
-    return result
+    return bytes(result)
 
 
 def unpack_varint_iter(data: bytes) -> Iterator[int]:
     """Calls unpack_varint repeatedly on data, iterating over the integers encoded
     therein.
 
+    The buffer is read in place through a memoryview, so this takes linear time
+    in the length of data.
     """
+    view = memoryview(data)
     pos = 0
-    while pos < len(data):
-        val, n_read = _unpack_varint_with_readlength(data[pos:])
+    while pos < len(view):
+        val, n_read = _unpack_varint_with_readlength(view, pos)
         pos += n_read
         yield val
 
 
+def unpack_varint_array(data: bytes) -> np.ndarray:
+    """Decode all of the zig-zag-encoded varints in data at once, returning them as
+    an int64 array.
+
+    This is much faster than unpack_varint_iter for long posting lists, but only
+    supports values which fit in 64 bits.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    # Each varint ends with a byte that has its continuation bit unset.
+    ends = np.flatnonzero(buf < 0x80)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Ignore any incomplete varint at the end of the buffer.
+    buf = buf[: ends[-1] + 1]
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Position of each byte within its varint, used to compute its shift.
+    lengths = ends - starts + 1
+    byte_pos = np.arange(len(buf)) - np.repeat(starts, lengths)
+    chunks = (buf & 0x7F).astype(np.uint64) << (byte_pos * 7).astype(np.uint64)
+    zigzagged = np.bitwise_or.reduceat(chunks, starts)
+    # Undo zig-zag encoding.
+    decoded = (zigzagged >> np.uint64(1)) ^ (np.uint64(0) - (zigzagged & np.uint64(1)))
+    result: np.ndarray = decoded.view(np.int64)
+    return result
+
+
 varint_iterator_codec = Codec("varint_iterator", pack_varint_iter, unpack_varint_iter)
 
 
+# varint array codec
+def pack_varint_array(values: np.ndarray) -> bytes:
+    """Pack an array of int64 values as concatenated zig-zag varints, the same
+    format as pack_varint_iter, using a few vectorized operations.
+    """
+    arr = np.asarray(values, dtype=np.int64)
+    # Zig-zag encode. Overflow in the shift wraps, as it should.
+    zigzagged = ((arr << 1) ^ (arr >> 63)).view(np.uint64)
+
+    # Number of bytes needed for each value.
+    n_bytes = np.ones(len(zigzagged), dtype=np.int64)
+    for i in range(1, 10):
+        n_bytes += zigzagged >= np.uint64(1 << (7 * i))
+    offsets = np.cumsum(n_bytes) - n_bytes
+
+    result = np.empty(int(n_bytes.sum()), dtype=np.uint8)
+    for i in range(int(n_bytes.max(initial=0))):
+        # Write the i'th byte of every value that is at least i+1 bytes long.
+        has_byte = n_bytes > i
+        chunk = (zigzagged[has_byte] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        continued = (n_bytes[has_byte] > i + 1).astype(np.uint64) << np.uint64(7)
+        result[offsets[has_byte] + i] = chunk | continued
+    return result.tobytes()
+
+
+varint_array_codec = Codec("varint_array", pack_varint_array, unpack_varint_array)
+
+
+# delta-encoded varint array codec
+def pack_varint_delta_array(values: np.ndarray) -> bytes:
+    """Pack an array of int64 values as the first value followed by the
+    differences between successive values, each as a zig-zag varint.
+
+    This is much more compact than pack_varint_array for sorted lists of large,
+    nearby values like candidate IDs. Unsorted input is still packed correctly.
+    """
+    arr = np.asarray(values, dtype=np.int64)
+    return pack_varint_array(np.diff(arr, prepend=np.int64(0)))
+
+
+def unpack_varint_delta_array(data: bytes) -> np.ndarray:
+    """Unpack values that were packed with pack_varint_delta_array."""
+    result: np.ndarray = np.cumsum(unpack_varint_array(data), dtype=np.int64)
+    return result
+
+
+delta_varint_array_codec = Codec(
+    "delta_varint_array", pack_varint_delta_array, unpack_varint_delta_array
+)
+
+
 # str codec
 def pack_str(val: str) -> bytes:
     return val.encode("utf-8")
@@ -158,4 +301,4 @@ def unpack_str(val: bytes) -> str:
     return val.decode("utf-8", "strict")
 
 
-str_codec = Codec("str", pack_str, unpack_str)
+str_codec = Codec("str", pack_str, unpack_str, order_preserving=True)
@@ -1,6 +1,20 @@
 from __future__ import annotations
-from typing import Iterator, Optional, Generic, TypeVar, Tuple, Union
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Generic,
+    TypeVar,
+    Tuple,
+    Union,
+)
 
+import dataclasses
+import itertools
+import json
 import pathlib
 import plyvel
 from astropy.coordinates import SkyCoord, Angle, CartesianRepresentation
@@ -8,73 +22,186 @@ from astropy.time import Time
 import healpy
 import numpy as np
 
-from alertbase.alert import AlertRecord
+from alertbase.alert import AlertRecord, healpixels
+from alertbase.bloom import BloomFilter
 
 from alertbase.encoding import (
     Codec,
     uint64_codec,
-    time_codec,
+    time_ns_codec,
+    time_to_unix_ns,
+    jd_to_unix_ns_array,
     str_codec,
     varint_codec,
     varint_iterator_codec,
+    unpack_varint_array,
 )
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+#: Posting lists are stored as a single LevelDB value per key, holding the
+#: concatenated varint-encoded candidate IDs.
+CONCATENATED_POSTINGS = "concatenated"
+
+#: Each (key, candidate ID) pair of a posting list is stored as its own LevelDB
+#: key, so appending never needs to read or rewrite existing data.
+COMPOSITE_POSTINGS = "composite"
+
+#: Candidate IDs are stored as zig-zag varints in the candidates database. This
+#: is compact, but doesn't sort in numeric order.
+VARINT_CANDIDATE_KEYS = "varint"
+
+#: Candidate IDs are stored as 64-bit big-endian unsigned integers in the
+#: candidates database, which sort in numeric order. This permits range scans
+#: over candidate IDs.
+UINT64_CANDIDATE_KEYS = "uint64"
+
+
+@dataclasses.dataclass
+class IndexLayout:
+    """
+    Describes how data is laid out in the LevelDB databases of an IndexDB.
+
+    The layout is recorded in a ``layout.json`` file in the database
+    directory. Databases without that file use the default layout.
+    """
+
+    #: How posting lists (the objects, healpixels, and timestamps databases)
+    #: are stored. Either "concatenated" or "composite".
+    postings: str = CONCATENATED_POSTINGS
+
+    #: How keys of the candidates database are encoded. Either "varint" or
+    #: "uint64".
+    candidate_keys: str = VARINT_CANDIDATE_KEYS
+
+    filename = "layout.json"
+
+    def __post_init__(self) -> None:
+        if self.postings not in (CONCATENATED_POSTINGS, COMPOSITE_POSTINGS):
+            raise ValueError(f"unknown posting list layout: {self.postings}")
+        if self.candidate_keys not in (VARINT_CANDIDATE_KEYS, UINT64_CANDIDATE_KEYS):
+            raise ValueError(f"unknown candidate key encoding: {self.candidate_keys}")
+
+    @classmethod
+    def read(cls, db_root: pathlib.Path) -> Optional[IndexLayout]:
+        """Read the layout stored in db_root, if there is one."""
+        path = db_root / cls.filename
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            data = json.load(f)
+        return IndexLayout(**data)
+
+    def write(self, db_root: pathlib.Path) -> None:
+        with open(db_root / self.filename, "w") as f:
+            json.dump(dataclasses.asdict(self), f)
+
+
+@dataclasses.dataclass
+class NewKeys:
+    """
+    The keys which a write added to each of the databases of an IndexDB, which
+    weren't present before.
+    """
+
+    candidates: List[int] = dataclasses.field(default_factory=list)
+    objects: List[str] = dataclasses.field(default_factory=list)
+    healpixels: List[int] = dataclasses.field(default_factory=list)
+    #: Timestamps, in integer nanoseconds since the Unix epoch.
+    timestamps: List[int] = dataclasses.field(default_factory=list)
+
+
 class IndexDB:
     db_root: pathlib.Path
+    layout: IndexLayout
     candidates: _TypedLevelDB[int, str]
-    objects: _TypedLevelDB[str, Iterator[int]]
-    healpixels: _TypedLevelDB[int, Iterator[int]]
-    timestamps: _TypedLevelDB[Time, Iterator[int]]
+    objects: _PostingListLevelDB[str]
+    healpixels: _PostingListLevelDB[int]
+    timestamps: _PostingListLevelDB[int]
 
     order: int
 
+    #: The name of the file in the database directory which holds a Bloom
+    #: filter over the candidate IDs in the index.
+    candidate_filter_filename = "candidates.bloom"
+
+    #: If set, this is called with the new keys after each write into the
+    #: index, so that summary statistics can be kept up to date.
+    on_new_keys: Optional[Callable[[NewKeys], None]]
+
     def __init__(
-        self, db_path: Union[str, pathlib.Path], create_if_missing: bool = False
+        self,
+        db_path: Union[str, pathlib.Path],
+        create_if_missing: bool = False,
+        layout: Optional[IndexLayout] = None,
     ):
+        """
+        Open an IndexDB stored at db_path.
+
+        The layout of a database is fixed when it is created. If layout is
+        provided for an existing database, it must match the stored layout.
+        """
         self.db_root = pathlib.Path(db_path)
 
         if create_if_missing:
             self.db_root.mkdir(parents=True, exist_ok=True)
 
-        self.objects = _TypedLevelDB(
-            db=plyvel.DB(
-                str(self.db_root / "objects"),
-                create_if_missing=create_if_missing,
-            ),
-            key_codec=str_codec,
-            val_codec=varint_iterator_codec,
-        )
+        stored_layout = IndexLayout.read(self.db_root)
+        if stored_layout is None and (self.db_root / "candidates").exists():
+            # Databases created before layouts were recorded.
+            stored_layout = IndexLayout()
+        if stored_layout is None:
+            self.layout = layout if layout is not None else IndexLayout()
+            if create_if_missing:
+                self.layout.write(self.db_root)
+        else:
+            if layout is not None and layout != stored_layout:
+                raise ValueError(
+                    f"database at {self.db_root} has layout {stored_layout}, "
+                    f"not {layout}"
+                )
+            self.layout = stored_layout
+
+        self.objects = self._postings_db("objects", str_codec, create_if_missing)
         self.candidates = _TypedLevelDB(
             db=plyvel.DB(
                 str(self.db_root / "candidates"),
                 create_if_missing=create_if_missing,
             ),
-            key_codec=varint_codec,
+            key_codec=(
+                uint64_codec
+                if self.layout.candidate_keys == UINT64_CANDIDATE_KEYS
+                else varint_codec
+            ),
             val_codec=str_codec,
         )
-        self.healpixels = _TypedLevelDB(
-            db=plyvel.DB(
-                str(self.db_root / "healpixels"),
-                create_if_missing=create_if_missing,
-            ),
-            key_codec=uint64_codec,
-            val_codec=varint_iterator_codec,
+        self.healpixels = self._postings_db(
+            "healpixels", uint64_codec, create_if_missing
         )
-        self.timestamps = _TypedLevelDB(
-            db=plyvel.DB(
-                str(self.db_root / "timestamps"),
-                create_if_missing=create_if_missing,
-            ),
-            key_codec=time_codec,
-            val_codec=varint_iterator_codec,
+        self.timestamps = self._postings_db(
+            "timestamps", time_ns_codec, create_if_missing
         )
 
         self.order = 12
 
+        # The candidate filter is loaded from disk if it was saved, and built
+        # on demand otherwise.
+        self._candidate_filter = BloomFilter.read(self._candidate_filter_path())
+        self._candidate_filter_saved = self._candidate_filter is not None
+        self._candidate_filter_stale_on_disk = False
+
+        self.on_new_keys = None
+
+    def _postings_db(
+        self, name: str, key_codec: Codec[K], create_if_missing: bool
+    ) -> _PostingListLevelDB[K]:
+        db = plyvel.DB(str(self.db_root / name), create_if_missing=create_if_missing)
+        if self.layout.postings == COMPOSITE_POSTINGS:
+            return _CompositeKeyLevelDB(db=db, key_codec=key_codec)
+        return _PostingListLevelDB(db=db, key_codec=key_codec)
+
     def _append(self, db: plyvel.DB, key: bytes, value: bytes) -> None:
         """ Add key-value pair to DB, appending if a value already exists."""
         prev = db.get(key, default=b"", fill_cache=False)
@@ -85,25 +212,51 @@ class IndexDB:
         alert_url: str,
         candidate_id: int,
         object_id: str,
-        time: Time,
+        time: Union[Time, int],
         healpixel: int,
     ) -> None:
         """
-        Add a record to all levelDB databases.
+        Add a record to all levelDB databases. time can be an astropy Time, or an
+        integer number of nanoseconds since the Unix epoch.
         """
+        new_keys = NewKeys(candidates=self._new_candidates([candidate_id]))
         self.candidates.put(candidate_id, alert_url)
-        self.objects.append(object_id, iter([candidate_id]))
-        self.healpixels.append(healpixel, iter([candidate_id]))
-        self.timestamps.append(time, iter([candidate_id]))
+        self._add_to_candidate_filter([candidate_id])
+        new_keys.objects = self.objects.append_many([(object_id, iter([candidate_id]))])
+        new_keys.healpixels = self.healpixels.append_many(
+            [(healpixel, iter([candidate_id]))]
+        )
+        new_keys.timestamps = self.timestamps.append_many(
+            [(_unix_ns(time), iter([candidate_id]))]
+        )
+        self._report_new_keys(new_keys)
 
     def insert(self, url: str, alert: AlertRecord) -> None:
-        self._write(
-            alert_url=url,
-            candidate_id=alert.candidate_id,
-            object_id=alert.object_id,
-            time=alert.timestamp,
-            healpixel=alert.healpixel(self.order),
-        )
+        self.insert_many([(url, alert)])
+
+    def insert_many(self, items: Iterable[Tuple[str, AlertRecord]]) -> None:
+        """
+        Add many alerts to the index at once. Each item is a pair of the URL
+        where the alert is stored and the alert itself.
+
+        This is much faster than calling :py:meth:`insert` repeatedly, since
+        each of the underlying databases is written with a single write batch.
+        """
+        batch = self.batch()
+        for url, alert in items:
+            batch.insert(url, alert)
+        batch.flush()
+
+    def batch(
+        self,
+        max_size: int = 1000,
+        on_flush: Optional[Callable[[List[Tuple[str, AlertRecord]]], None]] = None,
+    ) -> IndexBatch:
+        """
+        Create an IndexBatch which buffers alerts and writes them into this
+        index in bulk, every max_size alerts.
+        """
+        return IndexBatch(self, max_size, on_flush)
 
     def get_url(self, candidate_id: int) -> Optional[str]:
         """
@@ -112,24 +265,118 @@ class IndexDB:
         """
         return self.candidates.get(candidate_id)
 
+    def has_candidate(self, candidate_id: int) -> bool:
+        """
+        Returns True if the index has an alert with the given candidate ID.
+
+        This checks an in-memory Bloom filter first, so it's very fast for IDs
+        which aren't in the index; LevelDB is only consulted for probable hits.
+        """
+        if candidate_id not in self._get_candidate_filter():
+            return False
+        return self.get_url(candidate_id) is not None
+
+    def _candidate_filter_path(self) -> pathlib.Path:
+        return self.db_root / self.candidate_filter_filename
+
+    def _get_candidate_filter(self) -> BloomFilter:
+        if self._candidate_filter is None:
+            self._candidate_filter = self._build_candidate_filter()
+            self._candidate_filter_saved = False
+        return self._candidate_filter
+
+    def _build_candidate_filter(self, chunk_size: int = 100000) -> BloomFilter:
+        """Build a Bloom filter by scanning all the candidate IDs in the index."""
+        n = self.candidates.count()
+        logger.info("building candidate filter over %d candidates", n)
+        # Leave plenty of room to grow before the filter needs to be rebuilt.
+        bf = BloomFilter(capacity=max(2 * n, 1 << 20))
+        keys = self.candidates.keys()
+        while True:
+            chunk = np.fromiter(itertools.islice(keys, chunk_size), dtype=np.int64)
+            if chunk.shape[0] == 0:
+                return bf
+            bf.add_many(chunk)
+
+    def _add_to_candidate_filter(self, candidate_ids: List[int]) -> None:
+        """
+        Update the candidate filter after candidates have been written into the
+        index.
+        """
+        if not self._candidate_filter_stale_on_disk:
+            # The saved filter is about to be out of date. Remove it, so that
+            # if the process dies before close() saves the filter, it gets
+            # rebuilt rather than giving false negatives.
+            self._candidate_filter_stale_on_disk = True
+            self._candidate_filter_path().unlink(missing_ok=True)
+        self._candidate_filter_saved = False
+        if self._candidate_filter is None:
+            return
+        self._candidate_filter.add_many(candidate_ids)
+        if self._candidate_filter.is_full():
+            # Let the filter be rebuilt bigger the next time it's needed.
+            self._candidate_filter = None
+
+    def _new_candidates(self, candidate_ids: Iterable[int]) -> List[int]:
+        """
+        Return the candidate IDs which aren't in the index yet. The candidate
+        filter is used to skip LevelDB lookups, so only probable duplicates are
+        looked up; it's built first if it isn't loaded, since that costs one
+        scan, rather than a lookup for every alert ever written.
+        """
+        new = []
+        bf = self._get_candidate_filter()
+        for candidate_id in candidate_ids:
+            if candidate_id not in bf:
+                new.append(candidate_id)
+            elif self.candidates.get(candidate_id) is None:
+                new.append(candidate_id)
+        return new
+
+    def _report_new_keys(self, new_keys: NewKeys) -> None:
+        if self.on_new_keys is not None:
+            self.on_new_keys(new_keys)
+
     def object_search(self, object_id: str) -> Iterator[int]:
         """
         Retrieve the candidate IDs for a given ZTF object
         """
-        it = self.objects.get(object_id)
-        if it is None:
-            raise StopIteration
-        return it
-
-    def timerange_search(self, start: Time, end: Time) -> Iterator[int]:
+        candidate_ids = self.objects.get_array(object_id)
+        if candidate_ids is None:
+            return iter(())
+        return iter(candidate_ids.tolist())
+
+    def timerange_search(
+        self, start: Union[Time, int], end: Union[Time, int]
+    ) -> Iterator[int]:
         """
         Retrieve the candidate IDs for all alerts that were recorded between
-        start and end time range (values should be julian dates).
+        start and end time range.
+
+        start and end can be astropy Times, or integer numbers of nanoseconds
+        since the Unix epoch (see :py:func:`alertbase.encoding.jd_to_unix_ns`
+        to convert Julian dates).
+        """
+        start_ns, end_ns = _unix_ns(start), _unix_ns(end)
+        for candidate_ids in self.timestamps.iterate_arrays(start_ns, end_ns):
+            yield from candidate_ids.tolist()
+
+    def candidate_range_search(self, start: int, end: int) -> Iterator[int]:
+        """
+        Retrieve the candidate IDs in the index which are at least start, and
+        less than end, in ascending order.
+
+        This requires the "uint64" candidate key layout (see
+        :py:class:`IndexLayout`). Databases with the default layout can be
+        converted with :py:func:`migrate`.
         """
-        iterator = self.timestamps.iterate(start, end)
-        for timestamp in iterator:
-            for candidate_id in timestamp:
-                yield candidate_id
+        if not self.candidates.key_codec.order_preserving:
+            raise ValueError(
+                "candidate range search requires the "
+                f"{UINT64_CANDIDATE_KEYS!r} candidate key layout, "
+                f"but this database has {self.layout.candidate_keys!r}"
+            )
+        return self.candidates.iterate_keys(start, end)
 
     def cone_search(self, center: SkyCoord, radius: Angle) -> Iterator[int]:
         """
@@ -150,9 +397,8 @@ class IndexDB:
         logger.info("compacted range into %d elements", len(ranges))
         for start, stop in ranges:
             logger.info("checking range %d to %d", start, stop)
-            for pixel in self.healpixels.iterate(start, stop):
-                for candidate_id in pixel:
-                    yield candidate_id
+            for candidate_ids in self.healpixels.iterate_arrays(start, stop):
+                yield from candidate_ids.tolist()
 
     @staticmethod
     def _compact_pixel_ranges(pixelseq: np.ndarray) -> np.ndarray:
@@ -203,12 +449,118 @@ class IndexDB:
         return self.timestamps.count()
 
     def close(self) -> None:
+        if self._candidate_filter is not None and not self._candidate_filter_saved:
+            self._candidate_filter.write(self._candidate_filter_path())
         self.candidates.close()
         self.objects.close()
         self.healpixels.close()
         self.timestamps.close()
 
 
+class IndexBatch:
+    """
+    Buffers alerts for insertion into an IndexDB, writing them out in bulk.
+
+    Alerts are held in memory until :py:meth:`flush` is called, or until
+    max_size alerts have been buffered. Posting-list appends for the same key
+    (many alerts share a timestamp or a HEALPix pixel) are merged in memory,
+    and each of the four LevelDB databases is written with a single write
+    batch.
+
+    If on_flush is provided, it is called with the (url, alert) pairs of each
+    flush after they have been written into the index.
+    """
+
+    index: IndexDB
+    max_size: int
+    on_flush: Optional[Callable[[List[Tuple[str, AlertRecord]]], None]]
+
+    def __init__(
+        self,
+        index: IndexDB,
+        max_size: int = 1000,
+        on_flush: Optional[Callable[[List[Tuple[str, AlertRecord]]], None]] = None,
+    ):
+        self.index = index
+        self.max_size = max_size
+        self.on_flush = on_flush
+        self._pending: List[Tuple[str, AlertRecord]] = []
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def insert(self, url: str, alert: AlertRecord) -> None:
+        """
+        Buffer an alert for insertion, flushing the batch if it is full.
+        """
+        self._pending.append((url, alert))
+        if len(self._pending) >= self.max_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all buffered alerts into the index.
+        """
+        if len(self._pending) == 0:
+            return
+        pending = self._pending
+        self._pending = []
+
+        logger.debug("flushing %d alerts into the index", len(pending))
+
+        # Compute all the HEALPix pixels in one vectorized call.
+        ra = np.fromiter(
+            (alert.ra for _, alert in pending), dtype=np.float64, count=len(pending)
+        )
+        dec = np.fromiter(
+            (alert.dec for _, alert in pending), dtype=np.float64, count=len(pending)
+        )
+        pixels = healpixels(ra, dec, self.index.order).tolist()
+        jd = np.fromiter(
+            (alert.jd for _, alert in pending), dtype=np.float64, count=len(pending)
+        )
+        times = jd_to_unix_ns_array(jd).tolist()
+        for i, (_, alert) in enumerate(pending):
+            # A float jd can't hold a time to the nanosecond, so alerts built
+            # from a Time get the exact key a query for that Time would use.
+            # For Times built from a jd, the two agree.
+            if alert._timestamp is not None:
+                times[i] = time_to_unix_ns(alert._timestamp)
+
+        candidates: Dict[int, str] = {}
+        objects: Dict[str, List[int]] = {}
+        pixel_postings: Dict[int, List[int]] = {}
+        timestamps: Dict[int, List[int]] = {}
+        for (url, alert), pixel, time in zip(pending, pixels, times):
+            candidates[alert.candidate_id] = url
+            objects.setdefault(alert.object_id, []).append(alert.candidate_id)
+            pixel_postings.setdefault(pixel, []).append(alert.candidate_id)
+            timestamps.setdefault(time, []).append(alert.candidate_id)
+
+        new_keys = NewKeys(candidates=self.index._new_candidates(candidates))
+        self.index.candidates.put_many(candidates.items())
+        self.index._add_to_candidate_filter(list(candidates))
+        new_keys.objects = self.index.objects.append_many(
+            (k, iter(v)) for k, v in objects.items()
+        )
+        new_keys.healpixels = self.index.healpixels.append_many(
+            (k, iter(v)) for k, v in pixel_postings.items()
+        )
+        new_keys.timestamps = self.index.timestamps.append_many(
+            (k, iter(v)) for k, v in timestamps.items()
+        )
+        self.index._report_new_keys(new_keys)
+
+        if self.on_flush is not None:
+            self.on_flush(pending)
+
+
+def _unix_ns(t: Union[Time, int]) -> int:
+    if isinstance(t, Time):
+        return time_to_unix_ns(t)
+    return t
+
+
 K = TypeVar("K")
 V = TypeVar("V")
 
@@ -241,6 +593,19 @@ class _TypedLevelDB(Generic[K, V]):
             for v in it:
                 yield self.val_codec.unpack(v)
 
+    def iterate_keys(self, start: K, stop: K) -> Iterator[K]:
+        """
+        Iterate over the keys from start (inclusive) to stop (exclusive). This
+        is only meaningful if the key codec is order-preserving.
+        """
+        with self.db.iterator(
+            start=self.key_codec.pack(start),
+            stop=self.key_codec.pack(stop),
+            include_value=False,
+        ) as it:
+            for k in it:
+                yield self.key_codec.unpack(k)
+
     def put(self, key: K, val: V) -> None:
         self.db.put(self.key_codec.pack(key), self.val_codec.pack(val))
 
@@ -249,25 +614,287 @@ class _TypedLevelDB(Generic[K, V]):
         prev = self.db.get(encoded_key, default=b"", fill_cache=False)
         self.db.put(encoded_key, prev + self.val_codec.pack(val))
 
-    def count(self) -> int:
+    def put_many(self, items: Iterable[Tuple[K, V]]) -> None:
+        """Put many key-value pairs in a single write batch."""
+        with self.db.write_batch() as wb:
+            for key, val in items:
+                wb.put(self.key_codec.pack(key), self.val_codec.pack(val))
+
+    def append_many(self, items: Iterable[Tuple[K, V]]) -> List[K]:
+        """Append to the values of many keys, writing them in a single write batch.
+
+        Each existing value is read just once, no matter how many times its
+        key appears in items. Returns the keys which weren't already present.
+        """
+        pending: Dict[bytes, bytes] = {}
+        new_keys = []
+        for key, val in items:
+            encoded_key = self.key_codec.pack(key)
+            if encoded_key not in pending:
+                prev = self.db.get(encoded_key, fill_cache=False)
+                if prev is None:
+                    new_keys.append(key)
+                    prev = b""
+                pending[encoded_key] = prev
+            pending[encoded_key] += self.val_codec.pack(val)
+        with self.db.write_batch() as wb:
+            for encoded_key, encoded_val in pending.items():
+                wb.put(encoded_key, encoded_val)
+        return new_keys
+
+    def items(self) -> Iterator[Tuple[K, V]]:
+        """Iterate over all key-value pairs in the database, in key order."""
+        with self.db.iterator() as it:
+            for key_raw, val_raw in it:
+                yield self.key_codec.unpack(key_raw), self.val_codec.unpack(val_raw)
+
+    def keys(self) -> Iterator[K]:
+        """Iterate over all distinct keys in the database, in key order."""
+        for key_raw in self._raw_keys():
+            yield self.key_codec.unpack(key_raw)
+
+    def _raw_keys(self) -> Iterator[bytes]:
+        """Iterate over the distinct encoded keys in the database."""
         with self.db.iterator(include_value=False) as it:
-            return sum(1 for _ in it)
+            yield from it
+
+    def count(self) -> int:
+        return sum(1 for _ in self._raw_keys())
+
+    def _edge_key(self, reverse: bool) -> Optional[bytes]:
+        """
+        Return the first encoded key in the database, or the last one if
+        reverse is true. Returns None if the database is empty.
+        """
+        with self.db.iterator(reverse=reverse, include_value=False) as it:
+            raw: Optional[bytes] = next(it, None)
+            return raw
 
     def key_range_stats(self) -> Tuple[int, K, K]:
         """ Return the count, min, and max of the key space. """
+        if self.key_codec.order_preserving:
+            # The min and max are just the first and last keys, so only the
+            # count needs a scan, and keys don't need to be decoded for it.
+            first, last = self._edge_key(False), self._edge_key(True)
+            if first is None or last is None:
+                raise ValueError("no values in the database")
+            return (
+                self.count(),
+                self.key_codec.unpack(first),
+                self.key_codec.unpack(last),
+            )
+
         n = 0
         min_val = None
         max_val = None
-        with self.db.iterator(include_value=False) as it:
-            for key_raw in it:
-                n += 1
-                key = self.key_codec.unpack(key_raw)
-                if min_val is None or key < min_val:
-                    min_val = key
-                if max_val is None or key > max_val:
-                    max_val = key
+        for key_raw in self._raw_keys():
+            n += 1
+            key = self.key_codec.unpack(key_raw)
+            if min_val is None or key < min_val:
+                min_val = key
+            if max_val is None or key > max_val:
+                max_val = key
 
         if min_val is None or max_val is None:
             raise ValueError("no values in the database")
 
         return n, min_val, max_val
+
+
+class _PostingListLevelDB(_TypedLevelDB[K, Iterator[int]]):
+    """
+    A database mapping keys to lists of candidate IDs. Each list is stored as a
+    single value of concatenated varints.
+    """
+
+    def __init__(self, db: plyvel.DB, key_codec: Codec[K]):
+        super().__init__(db, key_codec, varint_iterator_codec)
+
+    def get_array(self, key: K) -> Optional[np.ndarray]:
+        """Get the candidate IDs for a key, decoded in bulk into an int64 array."""
+        val = self.db.get(self.key_codec.pack(key))
+        if val is None:
+            return None
+        return unpack_varint_array(val)
+
+    def iterate_arrays(self, start: K, stop: K) -> Iterator[np.ndarray]:
+        """Like iterate, but decodes each posting list into an int64 array."""
+        with self.db.iterator(
+            start=self.key_codec.pack(start),
+            stop=self.key_codec.pack(stop),
+            include_key=False,
+        ) as it:
+            for v in it:
+                yield unpack_varint_array(v)
+
+
+# Composite keys are the encoded key, a separator byte, and the candidate ID
+# as a big-endian uint64.
+_COMPOSITE_SEP = b"\x00"
+_COMPOSITE_SUFFIX_LEN = len(_COMPOSITE_SEP) + 8
+
+
+class _CompositeKeyLevelDB(_PostingListLevelDB[K]):
+    """
+    A posting-list database which stores each (key, candidate ID) pair as its
+    own LevelDB key, with an empty value. The candidate IDs for a key are
+    found with a prefix scan, and appending never reads existing data.
+
+    Candidate IDs for a key are returned in ascending order, and duplicates
+    are stored just once.
+    """
+
+    def _prefix(self, key: K) -> bytes:
+        return self.key_codec.pack(key) + _COMPOSITE_SEP
+
+    @staticmethod
+    def _candidate_id(raw: bytes) -> int:
+        return uint64_codec.unpack(raw[-8:])
+
+    @staticmethod
+    def _key_part(raw: bytes) -> bytes:
+        return raw[:-_COMPOSITE_SUFFIX_LEN]
+
+    def get(self, key: K) -> Optional[Iterator[int]]:
+        with self.db.iterator(prefix=self._prefix(key), include_value=False) as it:
+            ids = [self._candidate_id(raw) for raw in it]
+        if len(ids) == 0:
+            return None
+        return iter(ids)
+
+    def iterate(self, start: K, stop: K) -> Iterator[Iterator[int]]:
+        with self.db.iterator(
+            start=self.key_codec.pack(start),
+            stop=self.key_codec.pack(stop),
+            include_value=False,
+        ) as it:
+            for _, group in itertools.groupby(it, key=self._key_part):
+                yield iter([self._candidate_id(raw) for raw in group])
+
+    def get_array(self, key: K) -> Optional[np.ndarray]:
+        with self.db.iterator(prefix=self._prefix(key), include_value=False) as it:
+            return self._decode_candidate_ids(list(it))
+
+    def iterate_arrays(self, start: K, stop: K) -> Iterator[np.ndarray]:
+        with self.db.iterator(
+            start=self.key_codec.pack(start),
+            stop=self.key_codec.pack(stop),
+            include_value=False,
+        ) as it:
+            for _, group in itertools.groupby(it, key=self._key_part):
+                ids = self._decode_candidate_ids(list(group))
+                assert ids is not None
+                yield ids
+
+    @staticmethod
+    def _decode_candidate_ids(raw_keys: List[bytes]) -> Optional[np.ndarray]:
+        if len(raw_keys) == 0:
+            return None
+        suffixes = b"".join(raw[-8:] for raw in raw_keys)
+        ids: np.ndarray = np.frombuffer(suffixes, dtype=">u8").astype(np.int64)
+        return ids
+
+    def put(self, key: K, val: Iterator[int]) -> None:
+        self.put_many([(key, val)])
+
+    def append(self, key: K, val: Iterator[int]) -> None:
+        self.append_many([(key, val)])
+
+    def put_many(self, items: Iterable[Tuple[K, Iterator[int]]]) -> None:
+        """Replace the posting lists of many keys in a single write batch."""
+        with self.db.write_batch() as wb:
+            for key, val in items:
+                prefix = self._prefix(key)
+                with self.db.iterator(prefix=prefix, include_value=False) as it:
+                    for raw in it:
+                        wb.delete(raw)
+                for candidate_id in val:
+                    wb.put(prefix + uint64_codec.pack(candidate_id), b"")
+
+    def append_many(self, items: Iterable[Tuple[K, Iterator[int]]]) -> List[K]:
+        """Append to the posting lists of many keys in a single write batch.
+
+        Returns the keys which weren't already present. Finding those takes a
+        seek for each distinct key, but no existing data is read.
+        """
+        seen = set()
+        new_keys = []
+        with self.db.write_batch() as wb:
+            for key, val in items:
+                prefix = self._prefix(key)
+                if prefix not in seen:
+                    seen.add(prefix)
+                    if not self._has_prefix(prefix):
+                        new_keys.append(key)
+                for candidate_id in val:
+                    wb.put(prefix + uint64_codec.pack(candidate_id), b"")
+        return new_keys
+
+    def _has_prefix(self, prefix: bytes) -> bool:
+        with self.db.iterator(prefix=prefix, include_value=False) as it:
+            return next(it, None) is not None
+
+    def items(self) -> Iterator[Tuple[K, Iterator[int]]]:
+        with self.db.iterator(include_value=False) as it:
+            for key_raw, group in itertools.groupby(it, key=self._key_part):
+                ids = [self._candidate_id(raw) for raw in group]
+                yield self.key_codec.unpack(key_raw), iter(ids)
+
+    def _edge_key(self, reverse: bool) -> Optional[bytes]:
+        raw = super()._edge_key(reverse)
+        if raw is None:
+            return None
+        return self._key_part(raw)
+
+    def _raw_keys(self) -> Iterator[bytes]:
+        # Rather than visiting every candidate ID, seek past each key's
+        # posting list once the key has been seen.
+        it = self.db.iterator(include_value=False)
+        try:
+            while True:
+                raw = next(it, None)
+                if raw is None:
+                    break
+                key_raw = self._key_part(raw)
+                yield key_raw
+                it.seek(key_raw + bytes((_COMPOSITE_SEP[0] + 1,)))
+        finally:
+            it.close()
+
+
+def migrate(
+    src_path: Union[str, pathlib.Path],
+    dst_path: Union[str, pathlib.Path],
+    layout: IndexLayout,
+    chunk_size: int = 10000,
+) -> None:
+    """
+    Copy the IndexDB at src_path into a new IndexDB at dst_path, which is
+    created with the given layout.
+    """
+    src = IndexDB(src_path)
+    try:
+        dst = IndexDB(dst_path, create_if_missing=True, layout=layout)
+        try:
+            _copy_db(src.candidates, dst.candidates, chunk_size)
+            _copy_db(src.objects, dst.objects, chunk_size)
+            _copy_db(src.healpixels, dst.healpixels, chunk_size)
+            _copy_db(src.timestamps, dst.timestamps, chunk_size)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _copy_db(
+    src: _TypedLevelDB[K, V], dst: _TypedLevelDB[K, V], chunk_size: int
+) -> None:
+    items = src.items()
+    n = 0
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if len(chunk) == 0:
+            break
+        dst.put_many(chunk)
+        n += len(chunk)
+        logger.info("copied %d keys", n)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+import collections
+import dataclasses
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclasses.dataclass
+class LRUCacheStats:
+    """Counters describing how well an LRUCache is working."""
+
+    hits: int = 0
+    misses: int = 0
+    #: The number of entries evicted to stay under the size limit.
+    evictions: int = 0
+
+
+def _count(value: object) -> int:
+    return 1
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A bounded in-memory cache which evicts the least recently used entries.
+
+    The cache holds entries with a total size of at most max_size. By
+    default every entry has a size of 1, so max_size is the number of
+    entries; pass sizeof to measure entries some other way, like in bytes.
+    """
+
+    max_size: int
+    stats: LRUCacheStats
+
+    def __init__(self, max_size: int, sizeof: Callable[[V], int] = _count):
+        self.max_size = max_size
+        self.stats = LRUCacheStats()
+        self._sizeof = sizeof
+        self._entries: collections.OrderedDict[K, V] = collections.OrderedDict()
+        self._sizes: Dict[K, int] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        """The total size of the cached entries."""
+        return self._size
+
+    def get(self, key: K) -> Optional[V]:
+        """Get a cached value, or None if it isn't cached."""
+        value = self._entries.get(key)
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        """Cache a value, evicting others if needed to make room."""
+        size = self._sizeof(value)
+        self.pop(key)
+        if size > self.max_size:
+            return
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._size += size
+        while self._size > self.max_size:
+            old_key, _ = self._entries.popitem(last=False)
+            self._size -= self._sizes.pop(old_key)
+            self.stats.evictions += 1
+
+    def pop(self, key: K) -> None:
+        """Remove a value from the cache, if it is there."""
+        if self._entries.pop(key, None) is not None:
+            self._size -= self._sizes.pop(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._sizes.clear()
+        self._size = 0
@@ -0,0 +1,184 @@
+"""
+Helpers for converting alerts between Avro Object Container Files (the format
+ZTF distributes alerts in) and Avro Single Object Encoding.
+
+A container file holds the full schema document alongside the data. A single
+object encoding holds just a two-byte marker, the 8-byte CRC-64-AVRO
+fingerprint of the schema, and the binary-encoded record. The schema is stored
+once, separately, and looked up by fingerprint.
+
+See https://avro.apache.org/docs/current/spec.html#single_object_encoding.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional, Tuple, cast
+
+import io
+import logging
+
+from avro import schema
+from avro.datafile import MAGIC, META_SCHEMA, DataFileReader
+from avro.io import BinaryDecoder, BinaryEncoder, DatumReader, DatumWriter
+
+from alertbase import avro_decoder
+
+logger = logging.getLogger(__name__)
+
+#: The two bytes which begin every single-object encoded value.
+MARKER = b"\xc3\x01"
+
+_MARKER_LEN = len(MARKER)
+_FINGERPRINT_LEN = 8
+_HEADER_LEN = _MARKER_LEN + _FINGERPRINT_LEN
+
+_read_header = avro_decoder.compile_reader(META_SCHEMA)
+
+
+def is_single_object(data: bytes) -> bool:
+    """Returns True if data looks like a single-object encoded value."""
+    return len(data) >= _HEADER_LEN and data[:_MARKER_LEN] == MARKER
+
+
+def encode(fingerprint: bytes, datum: bytes) -> bytes:
+    """Build a single-object encoded value from a fingerprint and a datum."""
+    if len(fingerprint) != _FINGERPRINT_LEN:
+        raise ValueError("schema fingerprint must be 8 bytes")
+    return MARKER + fingerprint + datum
+
+
+def decode(data: bytes) -> Tuple[bytes, bytes]:
+    """
+    Split a single-object encoded value into its schema fingerprint and its
+    binary-encoded datum.
+    """
+    if not is_single_object(data):
+        raise ValueError("data is not single-object encoded")
+    return data[_MARKER_LEN:_HEADER_LEN], data[_HEADER_LEN:]
+
+
+def split_container(raw: bytes) -> Tuple[bytes, bytes]:
+    """
+    Split an uncompressed Avro Object Container File which holds exactly one
+    record into the JSON schema document and the binary-encoded record.
+    """
+    if raw[: len(MAGIC)] != MAGIC:
+        raise ValueError("data is not an Avro container file")
+    header, position = _read_header(raw, 0)
+    codec = header["meta"].get("avro.codec", b"null")
+    if codec != b"null":
+        raise ValueError(f"unsupported container codec: {codec!r}")
+    block_count, position = avro_decoder.read_long(raw, position)
+    if block_count != 1:
+        raise ValueError(f"container has {block_count} records, expected 1")
+    block_size, start = avro_decoder.read_long(raw, position)
+    end = start + block_size
+    datum = raw[start:end]
+    schema_json: bytes = header["meta"]["avro.schema"]
+    return schema_json, datum
+
+
+def read_container(raw: bytes) -> Dict[str, Any]:
+    """
+    Decode an Avro Object Container File holding a single record. Schemas are
+    parsed, and their decoders compiled, just once per process.
+    """
+    try:
+        schema_json, datum = split_container(raw)
+    except ValueError:
+        # Compressed or multi-record containers need the general reader.
+        with DataFileReader(io.BytesIO(raw), DatumReader()) as df:
+            return cast(Dict[str, Any], next(df))
+    return _container_schemas.add(schema_json).read(datum)
+
+
+class CachedSchema:
+    """A schema which has been parsed, along with everything derived from it."""
+
+    #: The schema's JSON document, as it appears in container files.
+    schema_json: bytes
+    #: The CRC-64-AVRO fingerprint of the schema.
+    fingerprint: bytes
+    schema: schema.Schema
+    reader: DatumReader
+    #: A decoder compiled for the schema, if it could be compiled.
+    decoder: Optional[avro_decoder.Decoder]
+
+    def __init__(self, schema_json: bytes):
+        self.schema_json = schema_json
+        self.schema = schema.parse(schema_json.decode("utf-8"))
+        self.fingerprint = self.schema.fingerprint("CRC-64-AVRO")
+        self.reader = DatumReader(self.schema)
+        try:
+            self.decoder = avro_decoder.compile_decoder(self.schema)
+        except ValueError as e:
+            logger.debug("can't compile decoder for %s: %s", self.fingerprint.hex(), e)
+            self.decoder = None
+        self._container_header = self._build_container_header()
+
+    def _build_container_header(self) -> bytes:
+        buf = io.BytesIO()
+        DatumWriter(META_SCHEMA).write(
+            {
+                "magic": MAGIC,
+                "meta": {"avro.schema": self.schema_json, "avro.codec": b"null"},
+                "sync": self._sync_marker(),
+            },
+            BinaryEncoder(buf),
+        )
+        return buf.getvalue()
+
+    def _sync_marker(self) -> bytes:
+        # Container files need a 16-byte sync marker. It's normally random, but
+        # any value works; a fixed one makes rebuilt containers reproducible.
+        return self.fingerprint * 2
+
+    def read(self, datum: bytes) -> Dict[str, Any]:
+        """Decode a binary-encoded record written with this schema."""
+        if self.decoder is not None:
+            try:
+                return cast(Dict[str, Any], self.decoder(datum))
+            except ValueError:
+                # Let the general reader have a go, and report what's wrong.
+                pass
+        record = self.reader.read(BinaryDecoder(io.BytesIO(datum)))
+        return cast(Dict[str, Any], record)
+
+    def container(self, datum: bytes) -> bytes:
+        """Rebuild an Avro Object Container File holding a single record."""
+        buf = io.BytesIO()
+        buf.write(self._container_header)
+        encoder = BinaryEncoder(buf)
+        encoder.write_long(1)
+        encoder.write_long(len(datum))
+        buf.write(datum)
+        buf.write(self._sync_marker())
+        return buf.getvalue()
+
+
+class SchemaCache:
+    """
+    An in-process cache of parsed schemas, indexed by fingerprint and by JSON
+    document. Alert streams use very few distinct schemas, so the cache is
+    never evicted.
+    """
+
+    def __init__(self) -> None:
+        self._by_fingerprint: Dict[bytes, CachedSchema] = {}
+        self._by_json: Dict[bytes, CachedSchema] = {}
+
+    def add(self, schema_json: bytes) -> CachedSchema:
+        """Parse a schema, or get it from the cache if it has been seen."""
+        cached = self._by_json.get(schema_json)
+        if cached is None:
+            cached = CachedSchema(schema_json)
+            self._by_json[schema_json] = cached
+            self._by_fingerprint.setdefault(cached.fingerprint, cached)
+        return cached
+
+    def get(self, fingerprint: bytes) -> Optional[CachedSchema]:
+        return self._by_fingerprint.get(fingerprint)
+
+
+# Schemas seen by read_container.
+_container_schemas = SchemaCache()
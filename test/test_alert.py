@@ -1,8 +1,11 @@
+import pickle
 import shutil
 import tempfile
-from alertbase.alert import AlertRecord
+from alertbase.alert import AlertRecord, healpixels
 import pytest
+import numpy as np
 from astropy.coordinates import SkyCoord
+from astropy.time import Time
 
 
 @pytest.fixture(scope="function")
@@ -58,3 +61,39 @@ def test_calculate_healpixel():
     assert zeros.healpixel(1) == 17
     assert zeros.healpixel(2) == 70
     assert zeros.healpixel(3) == 282
+
+
+def test_calculate_healpixels_vectorized():
+    ra = np.array([0.0, 12.5, 234.1362886, 359.9])
+    dec = np.array([90.0, 0.1, 16.6055949, -89.5])
+    pixels = healpixels(ra, dec, 12)
+    # Computed independently, by healpy from astropy's Cartesian
+    # representation of each position.
+    assert pixels.tolist() == [16777215, 73836020, 34840825, 184550469]
+
+
+def test_alertrecord_builds_astropy_objects_lazily(alert_file):
+    ar = AlertRecord.from_file_unsafe(open(alert_file, "rb"))
+    assert ar.ra == 234.1362886
+    assert ar.dec == 16.6055949
+    assert ar.jd == 2459065.65625
+    assert ar._position is None
+    assert ar._timestamp is None
+
+    assert ar.position.ra.value == 234.1362886
+    assert ar.timestamp.jd == 2459065.65625
+    assert ar._position is not None
+    assert ar._timestamp is not None
+
+
+def test_timestamp_is_stored_as_utc():
+    utc = Time("2020-01-01T00:00:00", scale="utc")
+    for t in (utc, utc.tt, utc.tai):
+        ar = AlertRecord(candidate_id=1, object_id="obj", timestamp=t)
+        assert ar.jd == utc.jd
+
+
+def test_alertrecord_has_slots(alert_file):
+    ar = AlertRecord.from_file_unsafe(open(alert_file, "rb"))
+    assert not hasattr(ar, "__dict__")
+    assert pickle.loads(pickle.dumps(ar)) == ar
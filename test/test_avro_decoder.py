@@ -0,0 +1,164 @@
+import io
+import json
+
+import pytest
+from avro import schema
+from avro.io import BinaryDecoder, BinaryEncoder, DatumReader, DatumWriter
+
+from alertbase import avro_decoder, single_object
+
+ALERT_FILE = "testdata/alertfiles/1311156250015010003.avro"
+
+EVERYTHING = schema.parse(
+    json.dumps(
+        {
+            "type": "record",
+            "name": "Everything",
+            "fields": [
+                {"name": "null", "type": "null"},
+                {"name": "boolean", "type": "boolean"},
+                {"name": "int", "type": "int"},
+                {"name": "long", "type": "long"},
+                {"name": "float", "type": "float"},
+                {"name": "double", "type": "double"},
+                {"name": "bytes", "type": "bytes"},
+                {"name": "string", "type": "string"},
+                {
+                    "name": "enum",
+                    "type": {"type": "enum", "name": "E", "symbols": ["A", "B"]},
+                },
+                {
+                    "name": "fixed",
+                    "type": {"type": "fixed", "name": "F", "size": 3},
+                },
+                {"name": "union", "type": ["null", "string", "E"]},
+                {"name": "array", "type": {"type": "array", "items": "long"}},
+                {"name": "map", "type": {"type": "map", "values": "F"}},
+                {
+                    "name": "next",
+                    "type": ["null", "Everything"],
+                },
+            ],
+        }
+    )
+)
+
+VALUE = {
+    "null": None,
+    "boolean": True,
+    "int": -3,
+    "long": 2**40,
+    "float": 1.5,
+    "double": -2.25,
+    "bytes": b"\x00\xff",
+    "string": "héllo",
+    "enum": "B",
+    "fixed": b"abc",
+    "union": "A",
+    "array": [1, -1000000, 0],
+    "map": {"x": b"xyz", "": b"123"},
+    "next": {
+        "null": None,
+        "boolean": False,
+        "int": 0,
+        "long": -1,
+        "float": 0.0,
+        "double": 1e300,
+        "bytes": b"",
+        "string": "",
+        "enum": "A",
+        "fixed": b"\x00\x00\x00",
+        "union": None,
+        "array": [],
+        "map": {},
+        "next": None,
+    },
+}
+
+
+def encode(s, value):
+    buf = io.BytesIO()
+    DatumWriter(s).write(value, BinaryEncoder(buf))
+    return buf.getvalue()
+
+
+def test_matches_datum_reader():
+    datum = encode(EVERYTHING, VALUE)
+    want = DatumReader(EVERYTHING).read(BinaryDecoder(io.BytesIO(datum)))
+    decoder = avro_decoder.compile_decoder(EVERYTHING)
+    assert decoder(datum) == want == VALUE
+
+
+def test_alert():
+    with open(ALERT_FILE, "rb") as f:
+        schema_json, datum = single_object.split_container(f.read())
+    s = schema.parse(schema_json.decode("utf-8"))
+    want = DatumReader(s).read(BinaryDecoder(io.BytesIO(datum)))
+    assert avro_decoder.compile_decoder(s)(datum) == want
+
+
+def test_sized_blocks():
+    # Blocks can have negative counts, followed by their size in bytes.
+    s = schema.parse('{"type": "array", "items": "int"}')
+    buf = io.BytesIO()
+    encoder = BinaryEncoder(buf)
+    encoder.write_long(-2)
+    encoder.write_long(2)
+    encoder.write_int(1)
+    encoder.write_int(2)
+    encoder.write_long(1)
+    encoder.write_int(3)
+    encoder.write_long(0)
+    assert avro_decoder.compile_decoder(s)(buf.getvalue()) == [1, 2, 3]
+
+
+def test_invalid_data():
+    decoder = avro_decoder.compile_decoder(EVERYTHING)
+    datum = encode(EVERYTHING, VALUE)
+    with pytest.raises(ValueError):
+        decoder(datum[:-5])
+    with pytest.raises(ValueError):
+        decoder(datum + b"\x00")
+
+    union = avro_decoder.compile_decoder(schema.parse('["null", "int"]'))
+    with pytest.raises(ValueError):
+        union(b"\x04")
+
+
+def test_reader_position():
+    reader = avro_decoder.compile_reader(schema.parse('"string"'))
+    assert reader(b"xx\x04hi!", 2) == ("hi", 5)
+
+
+def test_read_long():
+    buf = io.BytesIO()
+    for n in (0, -1, 63, -64, 64, 2**62, -(2**63)):
+        BinaryEncoder(buf).write_long(n)
+    data = buf.getvalue()
+    position = 0
+    values = []
+    while position < len(data):
+        value, position = avro_decoder.read_long(data, position)
+        values.append(value)
+    assert values == [0, -1, 63, -64, 64, 2**62, -(2**63)]
+    with pytest.raises(ValueError):
+        avro_decoder.read_long(b"\x80", 0)
+
+
+def test_logical_types_unsupported():
+    s = schema.parse('{"type": "long", "logicalType": "timestamp-millis"}')
+    with pytest.raises(ValueError):
+        avro_decoder.compile_decoder(s)
+
+
+def test_cached_schema_fallback():
+    timestamp = {"type": "long", "logicalType": "timestamp-millis"}
+    record = {
+        "type": "record",
+        "name": "R",
+        "fields": [{"name": "t", "type": timestamp}],
+    }
+    schema_json = json.dumps(record).encode()
+    cached = single_object.CachedSchema(schema_json)
+    assert cached.decoder is None
+    assert cached.read(b"\x00")["t"].year == 1970
@@ -0,0 +1,116 @@
+import errno
+import os
+
+from alertbase.blobcache import BlobCache
+
+
+def test_get_put(tmp_path):
+    cache = BlobCache(tmp_path, max_bytes=100)
+    assert cache.get("s3://bucket/a") is None
+    cache.put("s3://bucket/a", b"alert a")
+    assert cache.get("s3://bucket/a") == b"alert a"
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.size == len(b"alert a")
+
+
+def test_fragments_are_separate_keys(tmp_path):
+    cache = BlobCache(tmp_path)
+    cache.put("s3://bucket/bundle#offset=0&length=1", b"a")
+    cache.put("s3://bucket/bundle#offset=1&length=1", b"b")
+    assert cache.get("s3://bucket/bundle#offset=0&length=1") == b"a"
+    assert cache.get("s3://bucket/bundle#offset=1&length=1") == b"b"
+
+
+def test_lru_eviction(tmp_path):
+    cache = BlobCache(tmp_path, max_bytes=30)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    cache.put("c", b"c" * 10)
+    # Touch a, so that b is the least recently used.
+    assert cache.get("a") is not None
+    cache.put("d", b"d" * 10)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get("d") is not None
+    assert cache.stats.evictions == 1
+    assert cache.stats.evicted_bytes == 10
+    assert cache.size == 30
+    assert len(os.listdir(cache.blob_path)) == 3
+
+
+def test_too_big(tmp_path):
+    cache = BlobCache(tmp_path, max_bytes=5)
+    cache.put("a", b"too big to cache")
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_reopen(tmp_path):
+    cache = BlobCache(tmp_path, max_bytes=30)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    # A leftover from a crash in the middle of a write, long ago.
+    stale = cache.blob_path / "partial.tmp"
+    stale.write_bytes(b"partial")
+    os.utime(stale, (0, 0))
+    # A write which might still be in progress.
+    (cache.blob_path / "writing.tmp").write_bytes(b"writing")
+
+    reopened = BlobCache(tmp_path, max_bytes=30)
+    assert reopened.size == 20
+    assert reopened.get("a") == b"a" * 10
+    assert not stale.exists()
+    assert (cache.blob_path / "writing.tmp").exists()
+
+    # Reopening with a smaller budget evicts the least recently used blob.
+    reopened = BlobCache(tmp_path, max_bytes=10)
+    assert len(reopened) == 1
+
+
+def test_clear(tmp_path):
+    cache = BlobCache(tmp_path)
+    cache.put("a", b"a")
+    cache.clear()
+    assert cache.get("a") is None
+    assert os.listdir(cache.blob_path) == []
+
+
+def test_leaves_other_files_alone(tmp_path):
+    # The cache directory might be shared with other things.
+    (tmp_path / "notes.txt").write_bytes(b"notes")
+    BlobCache(tmp_path).put("a", b"a")
+    (tmp_path / "blobs" / "other.txt").write_bytes(b"other")
+
+    cache = BlobCache(tmp_path, max_bytes=4)
+    assert len(cache) == 1
+    cache.put("b", b"bbbb")
+    cache.clear()
+    assert (tmp_path / "notes.txt").read_bytes() == b"notes"
+    assert (tmp_path / "blobs" / "other.txt").read_bytes() == b"other"
+
+
+def test_write_errors_are_ignored(tmp_path, monkeypatch):
+    cache = BlobCache(tmp_path)
+
+    def replace(src, dst):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(os, "replace", replace)
+    cache.put("a", b"a")
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert os.listdir(cache.blob_path) == []
+
+
+def test_read_errors_are_misses(tmp_path):
+    cache = BlobCache(tmp_path)
+    cache.put("a", b"a")
+    # Make the blob unreadable.
+    path = cache.blob_path / BlobCache._filename("a")
+    path.unlink()
+    path.mkdir()
+    assert cache.get("a") is None
+    assert cache.stats.misses == 1
+    assert len(cache) == 0
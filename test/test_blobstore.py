@@ -8,7 +8,7 @@ import moto.server
 import werkzeug.serving
 import threading
 from alertbase.alert import AlertRecord
-from alertbase.blobstore import Blobstore
+from alertbase.blobstore import Blobstore, BlobRef, bundle_group, coalesce_ranges
 
 
 @pytest.fixture
@@ -64,6 +64,69 @@ async def test_upload(blobstore, alert_from_file):
     assert alert_from_file.candidate_id == redownload.candidate_id
 
 
+@pytest.mark.asyncio
+async def test_upload_bundle(blobstore, alert_from_file):
+    async with await blobstore.session() as session:
+        bundle = session.new_bundle(bundle_group(alert_from_file))
+        for _ in range(3):
+            bundle.add(alert_from_file, await session.encode(alert_from_file))
+        urls = await session.upload_bundle(bundle)
+        assert len(urls) == 3
+        length = len(alert_from_file.raw_data)
+        assert urls[1].endswith(f"#offset={length}&length={length}")
+        redownload = await session.download(urls[2])
+    assert alert_from_file.candidate_id == redownload.candidate_id
+
+
+def test_bundle_group(alert_record):
+    assert bundle_group(alert_record) == "20100101"
+
+
+def test_bundle_group_uses_utc():
+    # Just before midnight UTC, but already the next day in TT.
+    utc = astropy.time.Time("2020-01-01T23:59:30", scale="utc")
+    alert = AlertRecord(candidate_id=1, object_id="obj", timestamp=utc.tt)
+    assert bundle_group(alert) == "20200101"
+
+
+def test_blob_ref_parse():
+    ref = BlobRef.parse("s3://bucket/alerts/v2/obj/123")
+    assert (ref.key, ref.offset, ref.length) == ("alerts/v2/obj/123", None, None)
+    ref = BlobRef.parse("s3://bucket/bundles/v2/20100101/abc#offset=10&length=20")
+    assert (ref.key, ref.offset, ref.length) == ("bundles/v2/20100101/abc", 10, 20)
+    with pytest.raises(ValueError):
+        BlobRef.parse("https://bucket/key")
+
+
+def test_coalesce_ranges():
+    def ref(key, offset, length):
+        return BlobRef(f"{key}-{offset}", key, offset, length)
+
+    refs = [
+        ref("b", 100, 50),
+        ref("a", 0, 100),
+        BlobRef("whole", "whole"),
+        ref("a", 300, 100),
+        ref("a", 100, 100),
+        ref("a", 10_000, 100),
+    ]
+    requests = coalesce_ranges(refs, max_gap=100, max_size=1000)
+    have = [(r.key, r.start, r.end, [x.url for x in r.refs]) for r in requests]
+    assert have == [
+        ("whole", 0, 0, ["whole"]),
+        ("a", 0, 400, ["a-0", "a-100", "a-300"]),
+        ("a", 10_000, 10_100, ["a-10000"]),
+        ("b", 100, 150, ["b-100"]),
+    ]
+
+
+def test_coalesce_ranges_max_size():
+    refs = [BlobRef(str(i), "a", i * 100, 100) for i in range(10)]
+    requests = coalesce_ranges(refs, max_gap=0, max_size=250)
+    assert [len(r.refs) for r in requests] == [2, 2, 2, 2, 2]
+    assert all(r.end - r.start <= 250 for r in requests)
+
+
 def test_create_blobstore():
     Blobstore("region", "bucket", 2)
 
@@ -74,6 +137,8 @@ async def test_session_urls(alert_record):
     async with await bs.session() as session:
         url = session.url_for(alert_record)
         assert url == "s3://bucket/alerts/v2/1/cid"
+        bundle = session.new_bundle("20100101")
+        assert bundle.key.startswith("bundles/v2/20100101/")
 
 
 @pytest.mark.asyncio
@@ -98,6 +163,39 @@ async def test_concurrency_limit_exceeded(alert_record):
     await session1.__aexit__(None, None, None)
 
 
+@pytest.mark.asyncio
+async def test_sessions_share_clients():
+    bs = Blobstore("region", "bucket", 2)
+    async with await bs.session() as session1:
+        client = session1._s3_client
+    async with await bs.session() as session2:
+        # The client is returned to the pool and reused.
+        assert session2._s3_client is client
+        async with await bs.session() as session3:
+            assert session3._s3_client is not client
+    assert bs.stats.pool_hits == 1
+    assert bs.stats.pool_misses == 2
+
+    await bs.close()
+    async with await bs.session() as session4:
+        assert session4._s3_client is not client
+    assert bs.stats.pool_misses == 3
+    await bs.close()
+
+
+@pytest.mark.asyncio
+async def test_clients_closed_after_last_user():
+    bs = Blobstore("region", "bucket", 2)
+    loop = asyncio.get_running_loop()
+    async with bs.clients():
+        async with bs.clients():
+            async with await bs.session():
+                pass
+        # Still in use by the outer block.
+        assert loop in bs._pools
+    assert loop not in bs._pools
+
+
 @pytest.fixture
 def alert_record():
     return AlertRecord(
@@ -0,0 +1,53 @@
+import numpy as np
+
+from alertbase.bloom import BloomFilter
+
+
+def test_bloom_filter_no_false_negatives():
+    bf = BloomFilter(capacity=10000)
+    ids = np.random.default_rng(1).integers(0, 2**62, size=10000)
+    bf.add_many(ids)
+    assert len(bf) == 10000
+    assert bf.contains_many(ids).all()
+    assert int(ids[0]) in bf
+
+
+def test_bloom_filter_false_positive_rate():
+    bf = BloomFilter(capacity=10000, error_rate=0.01)
+    bf.add_many(range(10000))
+    false_positives = bf.contains_many(range(10000, 110000)).sum()
+    assert false_positives < 2000
+
+
+def test_bloom_filter_is_full():
+    bf = BloomFilter(capacity=10)
+    bf.add_many(range(10))
+    assert not bf.is_full()
+    bf.add(10)
+    assert bf.is_full()
+
+
+def test_bloom_filter_roundtrip(tmp_path):
+    bf = BloomFilter(capacity=1000)
+    bf.add_many([1, 2, 3, -4])
+    bf.write(tmp_path / "filter.bloom")
+
+    loaded = BloomFilter.read(tmp_path / "filter.bloom")
+    assert loaded is not None
+    assert len(loaded) == 4
+    assert (loaded.bits == bf.bits).all()
+    assert -4 in loaded
+    assert 5 not in loaded
+
+
+def test_bloom_filter_read_invalid(tmp_path):
+    assert BloomFilter.read(tmp_path / "missing.bloom") is None
+    (tmp_path / "bad.bloom").write_bytes(b"not a bloom filter")
+    assert BloomFilter.read(tmp_path / "bad.bloom") is None
+
+
+def test_bloom_filter_scalar_matches_vectorized():
+    bf = BloomFilter(capacity=1000)
+    bf.add_many(range(0, 2000, 2))
+    ids = list(range(-50, 5000))
+    assert [i in bf for i in ids] == bf.contains_many(ids).tolist()
@@ -0,0 +1,78 @@
+from alertbase.checkpoint import IngestCheckpoint
+
+
+def test_checkpoint_out_of_order(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    cp = IngestCheckpoint(path, "alerts.tar.gz")
+    cp.start(0, 100)
+    cp.start(10, 101)
+    cp.start(20, 102)
+    cp.start(30, 103)
+
+    # The later alerts finish first, so the low water mark can't move.
+    cp.finish([102, 101])
+    assert cp.offset == 0
+    assert cp.in_flight == {100, 103}
+
+    cp.finish([100])
+    assert cp.offset == 30
+    assert cp.in_flight == {103}
+
+    cp.finish([103])
+    assert cp.offset == 30
+    assert cp.in_flight == set()
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    cp = IngestCheckpoint(path, "alerts.tar.gz")
+    cp.start(0, 100)
+    cp.start(10, 101)
+    cp.start(20, 102)
+    cp.finish([100, 102])
+    cp.save()
+
+    loaded = IngestCheckpoint.load(path)
+    assert loaded is not None
+    assert loaded.source == "alerts.tar.gz"
+    assert loaded.offset == 10
+    assert loaded.in_flight == {101}
+
+    # Alerts which finished, even out of order, are skipped.
+    assert loaded.is_done(0, 100)
+    assert not loaded.is_done(10, 101)
+    assert loaded.was_in_flight(101)
+    assert loaded.is_done(20, 102)
+    assert not loaded.is_done(30, 103)
+
+
+def test_checkpoint_resume_keeps_unreached_in_flight(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    cp = IngestCheckpoint(
+        path, "alerts.tar.gz", offset=10, high_water=30, in_flight=[101, 103]
+    )
+    assert cp.offset == 10
+
+    # The first in-flight alert is redone, but the second hasn't been reached.
+    cp.start(10, 101)
+    cp.finish([101])
+    assert cp.offset == 10
+    assert cp.in_flight == {103}
+
+    cp.resolve(103)
+    assert cp.offset == 30
+    assert cp.in_flight == set()
+
+
+def test_checkpoint_load_missing(tmp_path):
+    assert IngestCheckpoint.load(tmp_path / "checkpoint.json") is None
+
+
+def test_checkpoint_remove(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    cp = IngestCheckpoint(path, "alerts.tar.gz")
+    cp.save()
+    assert path.exists()
+    cp.remove()
+    assert not path.exists()
+    cp.remove()
@@ -0,0 +1,68 @@
+import io
+import random
+
+import avro.datafile
+import avro.io
+import pytest
+
+from alertbase.alert import AlertRecord
+
+zstandard = pytest.importorskip("zstandard")
+
+from alertbase import compression  # noqa: E402
+
+ALERT_FILE = "testdata/alertfiles/1311156250015010003.avro"
+
+
+@pytest.fixture(scope="module")
+def samples():
+    # Vary a few fields of the test alert to get distinct, realistic alerts.
+    with open(ALERT_FILE, "rb") as f:
+        reader = avro.datafile.DataFileReader(f, avro.io.DatumReader())
+        schema = reader.datum_reader.writers_schema
+        record = next(reader)
+    rng = random.Random(0)
+    result = []
+    for i in range(100):
+        record["candid"] = 1000 + i
+        record["candidate"]["ra"] = rng.uniform(0, 360)
+        record["candidate"]["magpsf"] = rng.uniform(15, 20)
+        buf = io.BytesIO()
+        writer = avro.datafile.DataFileWriter(buf, avro.io.DatumWriter(), schema)
+        writer.append(record)
+        writer.flush()
+        result.append(buf.getvalue())
+    return result
+
+
+@pytest.fixture(scope="module")
+def dictionary(samples):
+    return compression.CompressionDictionary.train(samples, dict_size=16384)
+
+
+def test_roundtrip(dictionary, samples):
+    compressed = dictionary.compress(samples[0])
+    assert len(compressed) < len(samples[0])
+    assert compression.is_compressed(compressed)
+    assert not compression.is_compressed(samples[0])
+    assert compression.frame_dictionary_id(compressed) == dictionary.dict_id
+    assert dictionary.decompress(compressed) == samples[0]
+
+    alert = AlertRecord.from_file_safe(io.BytesIO(dictionary.decompress(compressed)))
+    assert alert.candidate_id == 1000
+
+
+def test_dictionary_beats_plain_zstd(dictionary, samples):
+    plain = zstandard.ZstdCompressor(level=dictionary.level)
+    assert len(dictionary.compress(samples[-1])) < len(plain.compress(samples[-1]))
+
+
+def test_reload(dictionary, samples):
+    reloaded = compression.CompressionDictionary(dictionary.data)
+    assert reloaded.dict_id == dictionary.dict_id
+    assert reloaded.decompress(dictionary.compress(samples[1])) == samples[1]
+
+
+def test_not_a_dictionary():
+    with pytest.raises(ValueError):
+        compression.CompressionDictionary(b"definitely not a dictionary")
@@ -0,0 +1,156 @@
+import asyncio
+import math
+
+import botocore.exceptions
+import pytest
+
+from alertbase.concurrency import (
+    AdaptiveLimiter,
+    is_congestion_error,
+    is_throttling_error,
+    is_throttling_response,
+)
+
+
+def client_error(code, status):
+    return botocore.exceptions.ClientError(
+        {
+            "Error": {"Code": code, "Message": ""},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        },
+        "GetObject",
+    )
+
+
+def test_additive_increase():
+    limiter = AdaptiveLimiter(initial_limit=4, max_limit=10)
+    # About one more per limit's worth of successes.
+    for _ in range(6):
+        limiter.on_success(0.01)
+    assert limiter.limit == 5
+    for _ in range(1000):
+        limiter.on_success(0.01)
+    assert limiter.limit == 10
+
+
+def test_throttling_halves_limit():
+    limiter = AdaptiveLimiter(initial_limit=16)
+    limiter.on_throttled()
+    assert limiter.limit == 8
+    assert limiter.stats.throttled == 1
+
+
+def test_decrease_at_most_once_per_latency():
+    limiter = AdaptiveLimiter(initial_limit=16)
+    limiter.on_success(60.0)
+    # Both of these were in flight together, so only the first counts.
+    limiter.on_throttled()
+    limiter.on_throttled()
+    assert limiter.limit == 8
+
+
+def test_latency_increase_decreases_limit():
+    limiter = AdaptiveLimiter(initial_limit=16, latency_tolerance=2.0)
+    for _ in range(10):
+        limiter.on_success(0.001)
+    before = limiter.limit
+    for _ in range(50):
+        limiter.on_success(0.1)
+    assert limiter.limit < before
+
+
+def test_min_limit():
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=2)
+    limiter.on_throttled()
+    assert limiter.limit == 2
+
+
+def test_latency_percentiles():
+    limiter = AdaptiveLimiter()
+    assert math.isnan(limiter.latency_percentiles()[50])
+    for i in range(100):
+        limiter.on_success(i / 1000)
+    percentiles = limiter.latency_percentiles()
+    assert percentiles[50] == 0.05
+    assert percentiles[90] == 0.09
+    assert percentiles[99] == 0.099
+    assert limiter.stats.requests == 100
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_release():
+    limiter = AdaptiveLimiter(initial_limit=1)
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    limiter.release()
+    await asyncio.wait_for(waiting, 1)
+    assert limiter.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_request_classifies_errors():
+    limiter = AdaptiveLimiter(initial_limit=8)
+    with pytest.raises(botocore.exceptions.ClientError):
+        async with limiter.request():
+            raise client_error("SlowDown", 503)
+    assert limiter.stats.throttled == 1
+    assert limiter.limit == 4
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        async with limiter.request():
+            raise client_error("InternalError", 500)
+    assert limiter.stats.errors == 1
+
+    with pytest.raises(botocore.exceptions.ReadTimeoutError):
+        async with limiter.request():
+            raise botocore.exceptions.ReadTimeoutError(endpoint_url="url")
+    assert limiter.stats.errors == 2
+
+    # Errors which don't mean congestion leave the limit alone.
+    limit = limiter.limit
+    with pytest.raises(botocore.exceptions.ClientError):
+        async with limiter.request():
+            raise client_error("NoSuchKey", 404)
+    with pytest.raises(ValueError):
+        async with limiter.request():
+            raise ValueError("boom")
+    assert limiter.stats.errors == 2
+    assert limiter.limit == limit
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_request_latency_stops_at_response():
+    limiter = AdaptiveLimiter()
+    async with limiter.request() as timer:
+        timer.responded()
+        # Reading a large body.
+        await asyncio.sleep(0.05)
+    assert limiter.latency_percentiles()[50] < 0.05
+
+    async with limiter.request() as timer:
+        timer.skip()
+        await asyncio.sleep(0.05)
+    assert limiter.stats.requests == 2
+    assert limiter.latency_percentiles()[99] < 0.05
+
+
+def test_is_congestion_error():
+    assert is_congestion_error(client_error("InternalError", 500))
+    assert is_congestion_error(
+        botocore.exceptions.EndpointConnectionError(endpoint_url="url")
+    )
+    assert is_congestion_error(asyncio.TimeoutError())
+    assert not is_congestion_error(client_error("NoSuchKey", 404))
+    assert not is_congestion_error(ValueError())
+
+
+def test_is_throttling():
+    assert is_throttling_error(client_error("SlowDown", 503))
+    assert not is_throttling_error(client_error("NoSuchKey", 404))
+    assert not is_throttling_error(ValueError())
+    assert is_throttling_response((None, {"Error": {"Code": "SlowDown"}}))
+    assert not is_throttling_response((None, {"ResponseMetadata": {}}))
+    assert not is_throttling_response(None)
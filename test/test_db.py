@@ -0,0 +1,297 @@
+import asyncio
+
+import astropy.time
+import pytest
+
+from alertbase.alert import AlertRecord
+from alertbase import db as dbmodule
+from alertbase.db import Database
+
+
+class FakeSession:
+    # Stands in for a BlobstoreSession, without talking to S3.
+    def __init__(self):
+        self.downloaded = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def upload(self, alert):
+        return f"s3://bucket/alerts/v2/{alert.object_id}/{alert.candidate_id}"
+
+    async def download_coalesced(self, request):
+        await asyncio.sleep(0)
+        self.downloaded += len(request.refs)
+        return [
+            make_alert(int(ref.url.rsplit("/", 1)[1]), "obj") for ref in request.refs
+        ]
+
+    async def download_raw_coalesced(self, request):
+        await asyncio.sleep(0)
+        self.downloaded += len(request.refs)
+        return [ref.url.rsplit("/", 1)[1].encode() for ref in request.refs]
+
+
+class FakeDecodePool:
+    # Stands in for a DecodePool, without starting processes.
+    def __init__(self):
+        self.decoded = 0
+
+    async def decode(self, raws):
+        await asyncio.sleep(0)
+        self.decoded += len(raws)
+        return [make_alert(int(raw), "obj") for raw in raws]
+
+
+def make_alert(candidate_id, object_id):
+    return AlertRecord(
+        candidate_id=candidate_id,
+        object_id=object_id,
+        ra=10.0,
+        dec=20.0,
+        timestamp=astropy.time.Time("2020-01-01T00:00:00"),
+        raw_data=b"raw",
+    )
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database.create("region", "bucket", tmp_path)
+    yield db
+    db.close()
+
+
+def test_lookups_are_cached(db):
+    asyncio.run(db._write(make_alert(1, "obj"), FakeSession()))
+    assert db._get_url(1) == "s3://bucket/alerts/v2/obj/1"
+    assert list(db._object_search("obj")) == [1]
+    assert 1 in db.url_cache
+    assert "obj" in db.object_cache
+
+    # Served from the cache.
+    assert db._get_url(1) == "s3://bucket/alerts/v2/obj/1"
+    assert db.url_cache.stats.hits == 1
+
+
+def test_write_invalidates(db):
+    alert = make_alert(1, "obj")
+    asyncio.run(db._write(alert, FakeSession()))
+    assert list(db._object_search("obj")) == [1]
+    db.alert_cache.put(1, alert)
+
+    asyncio.run(db._write(make_alert(2, "obj"), FakeSession()))
+    assert "obj" not in db.object_cache
+    assert sorted(db._object_search("obj")) == [1, 2]
+
+    asyncio.run(db._write(alert, FakeSession()))
+    assert 1 not in db.alert_cache
+    assert 1 not in db.url_cache
+
+
+def test_batch_flush_invalidates(db):
+    batch = db._batch()
+
+    async def write():
+        await db._write(make_alert(1, "obj"), FakeSession(), batch)
+
+    asyncio.run(write())
+    # Not visible until the batch is flushed, but a query now mustn't leave a
+    # stale result in the cache.
+    assert list(db._object_search("obj")) == []
+    batch.flush()
+    assert list(db._object_search("obj")) == [1]
+
+
+def write_alerts(db, n):
+    async def write():
+        for i in range(n):
+            await db._write(make_alert(i, "obj"), FakeSession())
+
+    asyncio.run(write())
+
+
+def use_fake_session(db):
+    session = FakeSession()
+
+    async def make_session():
+        return session
+
+    db.blobstore.session = make_session
+    return session
+
+
+def test_stream_is_pipelined(db):
+    write_alerts(db, 200)
+    use_fake_session(db)
+    pulled = []
+
+    def candidates():
+        for i in range(200):
+            pulled.append(i)
+            yield i
+
+    async def stream():
+        alerts = db._stream_alerts(candidates())
+        first = await alerts.__anext__()
+        # Results start coming before the index scan is done.
+        assert len(pulled) < 200
+        rest = [alert async for alert in alerts]
+        return [first] + rest
+
+    alerts = asyncio.run(stream())
+    assert sorted(a.candidate_id for a in alerts) == list(range(200))
+
+
+def test_stream_closes_clients_on_callers_loop(db):
+    write_alerts(db, 10)
+    use_fake_session(db)
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        alerts = db.get_by_object_id_stream("obj")
+        first = await alerts.__anext__()
+        assert loop in db.blobstore._pools
+        rest = [alert async for alert in alerts]
+        assert loop not in db.blobstore._pools
+        return [first] + rest
+
+    assert len(asyncio.run(stream())) == 10
+
+
+def test_stream_backpressure(db, monkeypatch):
+    monkeypatch.setattr(dbmodule, "STREAM_RESULT_QUEUE_SIZE", 4)
+    monkeypatch.setattr(dbmodule, "STREAM_REQUEST_QUEUE_SIZE", 4)
+    write_alerts(db, 200)
+    session = use_fake_session(db)
+
+    async def stream():
+        alerts = db._stream_alerts(iter(range(200)))
+        await alerts.__anext__()
+        await asyncio.sleep(0.1)
+        # Downloads stop when the consumer isn't keeping up.
+        assert session.downloaded < 50
+        await alerts.aclose()
+
+    asyncio.run(stream())
+
+
+def test_stream_unknown_candidate(db):
+    write_alerts(db, 1)
+    use_fake_session(db)
+
+    async def stream():
+        return [alert async for alert in db._stream_alerts(iter([0, 12345]))]
+
+    with pytest.raises(ValueError):
+        asyncio.run(stream())
+
+
+class ShuffledSession(FakeSession):
+    # Finishes downloads out of order.
+    async def download_coalesced(self, request):
+        candidate_id = int(request.refs[0].url.rsplit("/", 1)[1])
+        await asyncio.sleep((candidate_id * 7919 % 10) / 1000)
+        return await super().download_coalesced(request)
+
+
+def test_stream_ordered(db):
+    write_alerts(db, 100)
+    session = ShuffledSession()
+
+    async def make_session():
+        return session
+
+    db.blobstore.session = make_session
+    ids = list(range(100))
+    ids.reverse()
+    # Some are already cached, so they're ready right away.
+    for i in range(0, 100, 3):
+        db.alert_cache.put(i, make_alert(i, "obj"))
+
+    async def stream(ordered):
+        alerts = db._stream_alerts(iter(ids), ordered=ordered, window=10)
+        return [alert.candidate_id async for alert in alerts]
+
+    assert asyncio.run(stream(True)) == ids
+
+
+def test_stream_ordered_window(db):
+    write_alerts(db, 100)
+    session = use_fake_session(db)
+
+    async def stream():
+        alerts = db._stream_alerts(iter(range(100)), ordered=True, window=10)
+        await alerts.__anext__()
+        await asyncio.sleep(0.1)
+        # Downloads don't run more than the window ahead.
+        assert session.downloaded <= 11
+        await alerts.aclose()
+
+    asyncio.run(stream())
+
+
+class SlowSession(FakeSession):
+    # Counts downloads as they start, and takes a while to finish them.
+    def __init__(self):
+        super().__init__()
+        self.started = 0
+
+    async def download_coalesced(self, request):
+        self.started += len(request.refs)
+        await asyncio.sleep(0.002)
+        return await super().download_coalesced(request)
+
+
+def test_stream_ordered_keeps_downloading(db):
+    write_alerts(db, 64)
+    session = SlowSession()
+
+    async def make_session():
+        return session
+
+    db.blobstore.session = make_session
+
+    async def stream():
+        ahead = []
+        alerts = db._stream_alerts(iter(range(64)), ordered=True, window=16)
+        async for alert in alerts:
+            ahead.append(session.started - len(ahead) - 1)
+        return ahead
+
+    ahead = asyncio.run(stream())
+    # While the consumer keeps pulling alerts, later downloads are always
+    # under way, rather than the window draining at the end of each batch.
+    assert min(ahead[:-1]) > 0
+
+
+def test_raw_stream(db):
+    write_alerts(db, 50)
+    use_fake_session(db)
+    db.alert_cache.put(3, make_alert(3, "obj"))
+
+    async def stream():
+        return [item async for item in db.get_raw_stream(range(50), ordered=True)]
+
+    items = asyncio.run(stream())
+    assert [candidate_id for candidate_id, _ in items] == list(range(50))
+    assert items[3] == (3, b"raw")
+    assert items[4] == (4, b"4")
+    # Undecoded alerts aren't cached.
+    assert len(db.alert_cache) == 1
+
+
+def test_stream_decode_pool(db):
+    write_alerts(db, 50)
+    use_fake_session(db)
+    db.decode_pool = FakeDecodePool()
+
+    async def stream():
+        return [alert async for alert in db._stream_alerts(iter(range(50)))]
+
+    alerts = asyncio.run(stream())
+    assert sorted(a.candidate_id for a in alerts) == list(range(50))
+    assert db.decode_pool.decoded == 50
+    db.decode_pool = None
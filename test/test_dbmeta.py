@@ -1,4 +1,7 @@
+from alertbase.db import Database
 from alertbase.dbmeta import DBMeta
+from alertbase.index import IndexDB
+import astropy.time
 
 
 class TestDBMeta:
@@ -10,3 +13,103 @@ class TestDBMeta:
         with open(tmp_path / filename, "r") as f:
             have = DBMeta.read_from_file(f)
         assert have == dbm
+
+    def test_to_file_roundtrip_blobstore_layout(self, tmp_path):
+        dbm = DBMeta("bucket", "region", blobstore_layout="v3")
+        with open(tmp_path / "meta.json", "w") as f:
+            dbm.write_to_file(f)
+        with open(tmp_path / "meta.json", "r") as f:
+            have = DBMeta.read_from_file(f)
+        assert have.blobstore_layout == "v3"
+
+    def test_compute_keyranges(self, tmp_path):
+        idx = IndexDB(tmp_path, create_if_missing=True)
+        t1 = astropy.time.Time("2020-01-01T00:00:00")
+        t2 = astropy.time.Time("2020-01-02T00:00:00")
+        idx._write("url1", 1, "obj1", t1, 10)
+        idx._write("url2", 2, "obj2", t2, 20)
+
+        dbm = DBMeta("bucket", "region")
+        dbm.compute_keyranges(idx)
+        assert dbm.candidates.count == 2
+        assert (dbm.candidates.min, dbm.candidates.max) == (1, 2)
+        assert (dbm.objects.min, dbm.objects.max) == ("obj1", "obj2")
+        assert (dbm.healpixels.min, dbm.healpixels.max) == (10, 20)
+        assert dbm.timestamps.count == 2
+        assert dbm.timestamps.min == t1
+        assert dbm.timestamps.max == t2
+
+    def test_compute_keyranges_empty(self, tmp_path):
+        idx = IndexDB(tmp_path, create_if_missing=True)
+        dbm = DBMeta("bucket", "region")
+        dbm.compute_keyranges(idx)
+        assert dbm.candidates.count == 0
+        assert dbm.timestamps.count == 0
+
+    def test_update_matches_compute_keyranges(self, tmp_path):
+        idx = IndexDB(tmp_path, create_if_missing=True)
+        dbm = DBMeta("bucket", "region")
+        idx.on_new_keys = dbm.update
+
+        t1 = astropy.time.Time("2020-01-01T00:00:00")
+        t2 = astropy.time.Time("2020-01-02T00:00:00")
+        idx._write("url2", 2, "obj2", t2, 20)
+        idx._write("url1", 1, "obj1", t1, 10)
+        # Keys which already exist aren't counted again.
+        idx._write("url3", 3, "obj1", t1, 10)
+        idx._write("url3", 3, "obj1", t1, 10)
+
+        want = DBMeta("bucket", "region")
+        want.compute_keyranges(idx)
+        assert dbm == want
+        assert dbm.candidates.count == 3
+        assert dbm.objects.count == 2
+
+
+class TestDatabaseMeta:
+    def test_create_empty(self, tmp_path):
+        db = Database.create("region", "bucket", tmp_path)
+        assert db.meta.candidates.count == 0
+        db.close()
+
+    def test_blobstore_layout_persisted(self, tmp_path):
+        db = Database.create("region", "bucket", tmp_path, blobstore_layout="v3")
+        assert db.blobstore.layout == "v3"
+        db.close()
+        db = Database.open(tmp_path)
+        assert db.meta.blobstore_layout == "v3"
+        assert db.blobstore.layout == "v3"
+        db.close()
+
+    def test_dirty_until_closed(self, tmp_path):
+        db = Database.create("region", "bucket", tmp_path)
+        db._start_writing()
+        assert _read_meta(tmp_path).dirty
+        db.close()
+        assert not _read_meta(tmp_path).dirty
+
+    def test_repair_after_crash(self, tmp_path):
+        db = Database.create("region", "bucket", tmp_path)
+        db._start_writing()
+        # Simulate a crash: the index is written, but the stats aren't saved.
+        db.index.on_new_keys = None
+        db.index._write("url1", 1, "obj1", astropy.time.Time("2020-01-01"), 10)
+        db.index.close()
+
+        db = Database.open(tmp_path)
+        assert db.meta.dirty
+        assert db.meta.candidates.count == 0
+        db.close()
+        assert _read_meta(tmp_path).dirty
+
+        db = Database.open(tmp_path)
+        db.repair_meta()
+        assert not db.meta.dirty
+        assert db.meta.candidates.count == 1
+        db.close()
+        assert not _read_meta(tmp_path).dirty
+
+
+def _read_meta(db_path):
+    with open(db_path / "meta.json", "r") as f:
+        return DBMeta.read_from_file(f)
@@ -0,0 +1,74 @@
+import asyncio
+import concurrent.futures.process
+import io
+
+import pytest
+
+from alertbase.alert import AlertRecord
+from alertbase.decode_pool import DecodePool
+
+ALERT_FILE = "testdata/alertfiles/1311156250015010003.avro"
+
+
+@pytest.fixture
+def raw_alert():
+    with open(ALERT_FILE, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def pool():
+    pool = DecodePool(2, batch_size=4)
+    yield pool
+    pool.close()
+
+
+def test_decode(pool, raw_alert):
+    want = AlertRecord.from_file_safe(io.BytesIO(raw_alert))
+
+    async def decode():
+        # More requests than workers, so some are batched together.
+        results = await asyncio.gather(
+            *[pool.decode([raw_alert] * 3) for _ in range(5)],
+            pool.decode([]),
+        )
+        return [alert for alerts in results for alert in alerts]
+
+    alerts = asyncio.run(decode())
+    assert len(alerts) == 15
+    assert all(alert == want for alert in alerts)
+
+
+def test_decode_error(pool):
+    async def decode():
+        return await pool.decode([b"not an alert"])
+
+    with pytest.raises(Exception):
+        asyncio.run(decode())
+
+
+class BrokenExecutor:
+    # Stands in for a process pool whose worker died.
+    def submit(self, *args):
+        raise concurrent.futures.process.BrokenProcessPool("a worker died")
+
+    def shutdown(self):
+        pass
+
+
+def test_broken_pool(pool, raw_alert):
+    pool._pool = BrokenExecutor()
+
+    async def decode():
+        return await asyncio.wait_for(pool.decode([raw_alert]), 10)
+
+    with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+        asyncio.run(decode())
+    assert pool._in_flight == 0
+    # The next batch gets a fresh pool.
+    assert len(asyncio.run(decode())) == 1
+
+
+def test_needs_workers():
+    with pytest.raises(ValueError):
+        DecodePool(0)
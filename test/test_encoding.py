@@ -2,6 +2,7 @@ import alertbase.encoding
 import pytest
 import astropy.time
 import struct
+import numpy as np
 
 
 class TestVarintIteratorCodec:
@@ -41,6 +42,64 @@ class TestVarintIteratorCodec:
         have = list(have_iter)
         assert have == values
 
+    @pytest.mark.parametrize("values,encoded", cases)
+    def test_unpacking_array(self, values, encoded):
+        have = alertbase.encoding.unpack_varint_array(bytes(encoded))
+        assert have.dtype == np.int64
+        assert have.tolist() == values
+
+    def test_unpacking_memoryview(self):
+        encoded = bytearray.fromhex("800280048008")
+        have = list(alertbase.encoding.unpack_varint_iter(memoryview(encoded)))
+        assert have == [128, 256, 512]
+
+
+def _random_int64s(seed, n):
+    rng = np.random.default_rng(seed)
+    # Mix small and full-width values so that every varint length is covered.
+    bits = rng.integers(0, 64, n)
+    vals = rng.integers(-(1 << 63), (1 << 63) - 1, n, dtype=np.int64, endpoint=True)
+    return vals >> bits
+
+
+class TestVarintArrayCodec:
+    seeds = range(10)
+
+    @pytest.mark.parametrize("values,encoded", TestVarintIteratorCodec.cases)
+    def test_packing(self, values, encoded):
+        have = alertbase.encoding.pack_varint_array(np.array(values, dtype=np.int64))
+        assert have == encoded
+
+    @pytest.mark.parametrize("seed", seeds)
+    def test_roundtrip(self, seed):
+        values = _random_int64s(seed, 1000)
+        packed = alertbase.encoding.varint_array_codec.pack(values)
+        unpacked = alertbase.encoding.varint_array_codec.unpack(packed)
+        np.testing.assert_array_equal(unpacked, values)
+
+    @pytest.mark.parametrize("seed", seeds)
+    def test_matches_iterator_codec(self, seed):
+        values = _random_int64s(seed, 100)
+        have = alertbase.encoding.pack_varint_array(values)
+        want = b"".join(alertbase.encoding.pack_varint(int(v)) for v in values)
+        assert have == want
+        unpacked = alertbase.encoding.varint_iterator_codec.unpack(have)
+        assert list(unpacked) == values.tolist()
+
+    @pytest.mark.parametrize("seed", seeds)
+    def test_delta_roundtrip(self, seed):
+        values = _random_int64s(seed, 1000)
+        for vals in (values, np.sort(values)):
+            packed = alertbase.encoding.delta_varint_array_codec.pack(vals)
+            unpacked = alertbase.encoding.delta_varint_array_codec.unpack(packed)
+            np.testing.assert_array_equal(unpacked, vals)
+
+    def test_delta_is_compact_for_sorted_ids(self):
+        values = np.arange(1311156250015010003, 1311156250015011003, 7)
+        plain = alertbase.encoding.pack_varint_array(values)
+        delta = alertbase.encoding.pack_varint_delta_array(values)
+        assert len(delta) < len(plain) / 4
+
 
 class TestTimePacking:
     def test_pack_time_roundtrip(self):
@@ -50,6 +109,28 @@ class TestTimePacking:
         assert time == unpacked
 
 
+class TestUnixNanoseconds:
+    jds = [2440587.5, 2459065.65625, 2459234.7043634, 2459234.9999999]
+
+    @pytest.mark.parametrize("jd", jds)
+    def test_jd_matches_astropy(self, jd):
+        have = alertbase.encoding.jd_to_unix_ns(jd)
+        want = alertbase.encoding.unpack_uint64(
+            alertbase.encoding.pack_time(astropy.time.Time(jd, format="jd"))
+        )
+        assert have == want
+
+    def test_jd_array(self):
+        have = alertbase.encoding.jd_to_unix_ns_array(np.array(self.jds))
+        want = [alertbase.encoding.jd_to_unix_ns(jd) for jd in self.jds]
+        assert have.tolist() == want
+
+    def test_time_roundtrip(self):
+        time = astropy.time.Time("2010-01-01T00:00:00")
+        ns = alertbase.encoding.time_to_unix_ns(time)
+        assert alertbase.encoding.unix_ns_to_time(ns) == time
+
+
 class TestUint64Codec:
     cases = [0, 1, int(1e12), 1 << 32, 1 << 63, (1 << 64) - 1]
 
@@ -4,7 +4,10 @@ import tempfile
 import pathlib
 
 import alertbase
+import alertbase.index
+import alertbase.encoding
 import astropy.time
+import astropy.coordinates
 
 
 @pytest.fixture(scope="function")
@@ -67,3 +70,237 @@ class TestIndexDB:
         candidates = list(db.timerange_search(start=timestamp, end=timestamp + 1))
         assert len(candidates) == 1
         assert candidates[0] == candidate_id
+
+    def test_insert_many(self, tmpdir):
+        db = alertbase.IndexDB(tmpdir, create_if_missing=True)
+        timestamp = astropy.time.Time("2020-01-01T00:00:00")
+        alerts = [
+            _alert(candidate_id=1, object_id="obj1", timestamp=timestamp),
+            _alert(candidate_id=2, object_id="obj1", timestamp=timestamp),
+            _alert(candidate_id=3, object_id="obj2", timestamp=timestamp + 1),
+        ]
+        db.insert_many((f"url{a.candidate_id}", a) for a in alerts)
+
+        assert db.get_url(1) == "url1"
+        assert db.get_url(3) == "url3"
+        assert list(db.object_search("obj1")) == [1, 2]
+        assert list(db.object_search("obj2")) == [3]
+        assert db.count_timestamps() == 2
+        assert db.count_healpixels() == 1
+
+        candidates = list(db.timerange_search(start=timestamp, end=timestamp + 2))
+        assert candidates == [1, 2, 3]
+
+        # Times can also be given as unix nanoseconds.
+        start_ns = alertbase.encoding.time_to_unix_ns(timestamp + 1)
+        candidates = list(db.timerange_search(start=start_ns, end=start_ns + 1))
+        assert candidates == [3]
+        count, min_ns, max_ns = db.timestamps.key_range_stats()
+        assert (count, max_ns) == (2, start_ns)
+
+    def test_batch_appends_to_existing(self, tmpdir):
+        db = alertbase.IndexDB(tmpdir, create_if_missing=True)
+        db.insert("url1", _alert(candidate_id=1, object_id="obj"))
+
+        batch = db.batch(max_size=2)
+        batch.insert("url2", _alert(candidate_id=2, object_id="obj"))
+        assert len(batch) == 1
+        assert db.get_url(2) is None
+
+        batch.insert("url3", _alert(candidate_id=3, object_id="obj"))
+        assert len(batch) == 0
+        assert list(db.object_search("obj")) == [1, 2, 3]
+
+    def test_composite_layout_roundtrip(self, tmpdir):
+        layout = alertbase.index.IndexLayout(postings="composite")
+        db = alertbase.IndexDB(tmpdir, create_if_missing=True, layout=layout)
+        timestamp = astropy.time.Time("2020-01-01T00:00:00")
+        db.insert("url3", _alert(candidate_id=3, object_id="obj", timestamp=timestamp))
+        db.insert("url1", _alert(candidate_id=1, object_id="obj", timestamp=timestamp))
+        db.insert("url2", _alert(candidate_id=2, object_id="ob", timestamp=timestamp))
+
+        assert list(db.object_search("obj")) == [1, 3]
+        assert list(db.object_search("ob")) == [2]
+        assert db.count_objects() == 2
+        assert db.count_timestamps() == 1
+        assert db.objects.key_range_stats() == (2, "ob", "obj")
+
+        candidates = list(db.timerange_search(start=timestamp, end=timestamp + 1))
+        assert candidates == [1, 2, 3]
+        db.close()
+
+        # The layout is stored with the database.
+        db = alertbase.IndexDB(tmpdir)
+        assert db.layout == layout
+        assert list(db.object_search("obj")) == [1, 3]
+        db.close()
+
+    def test_timerange_search_from_exact_time(self, tmp_path):
+        db = alertbase.IndexDB(tmp_path, create_if_missing=True)
+        timestamp = astropy.time.Time("2020-01-01T00:00:00.123")
+        db.insert("url1", _alert(candidate_id=1, object_id="obj", timestamp=timestamp))
+        one_second = astropy.time.TimeDelta(1, format="sec")
+        assert list(db.timerange_search(timestamp, timestamp + one_second)) == [1]
+        db.close()
+
+    def test_layout_mismatch(self, tmpdir):
+        alertbase.IndexDB(tmpdir, create_if_missing=True).close()
+        layout = alertbase.index.IndexLayout(postings="composite")
+        with pytest.raises(ValueError):
+            alertbase.IndexDB(tmpdir, layout=layout)
+
+    def test_migrate(self, tmp_path):
+        src = alertbase.IndexDB(tmp_path / "src", create_if_missing=True)
+        timestamp = astropy.time.Time("2020-01-01T00:00:00")
+        alerts = [
+            _alert(candidate_id=1, object_id="obj1", timestamp=timestamp),
+            _alert(candidate_id=2, object_id="obj1", timestamp=timestamp),
+            _alert(candidate_id=3, object_id="obj2", timestamp=timestamp + 1),
+        ]
+        src.insert_many((f"url{a.candidate_id}", a) for a in alerts)
+        src.close()
+
+        layout = alertbase.index.IndexLayout(postings="composite")
+        alertbase.index.migrate(tmp_path / "src", tmp_path / "dst", layout)
+
+        dst = alertbase.IndexDB(tmp_path / "dst")
+        assert dst.layout == layout
+        assert dst.count_candidates() == 3
+        assert dst.count_objects() == 2
+        assert dst.get_url(2) == "url2"
+        assert list(dst.object_search("obj1")) == [1, 2]
+        candidates = list(dst.timerange_search(start=timestamp, end=timestamp + 2))
+        assert candidates == [1, 2, 3]
+
+    def test_object_search_missing(self, tmpdir):
+        db = alertbase.IndexDB(tmpdir, create_if_missing=True)
+        assert list(db.object_search("missing")) == []
+
+    def test_has_candidate(self, tmp_path):
+        db = alertbase.IndexDB(tmp_path, create_if_missing=True)
+        db.insert("url1", _alert(candidate_id=1, object_id="obj"))
+        assert db.has_candidate(1)
+        assert not db.has_candidate(2)
+
+        # The filter is kept up to date with new writes.
+        db.insert_many([("url2", _alert(candidate_id=2, object_id="obj"))])
+        assert db.has_candidate(2)
+        db.close()
+
+        # It's saved with the database, and loaded when it's opened.
+        assert (tmp_path / "candidates.bloom").exists()
+        db = alertbase.IndexDB(tmp_path)
+        assert db._candidate_filter is not None
+        assert db.has_candidate(1)
+        assert db.has_candidate(2)
+        assert not db.has_candidate(3)
+
+        # Writing invalidates the saved filter until the database is closed.
+        db.insert("url3", _alert(candidate_id=3, object_id="obj"))
+        assert not (tmp_path / "candidates.bloom").exists()
+        assert db.has_candidate(3)
+        db.close()
+        assert (tmp_path / "candidates.bloom").exists()
+
+    def test_has_candidate_rebuilds_missing_filter(self, tmp_path):
+        db = alertbase.IndexDB(tmp_path, create_if_missing=True)
+        db.insert_many(
+            (f"url{i}", _alert(candidate_id=i, object_id="obj")) for i in range(100)
+        )
+        db.close()
+        # As if the process died before saving the filter.
+        (tmp_path / "candidates.bloom").unlink()
+
+        db = alertbase.IndexDB(tmp_path)
+        assert db._candidate_filter is None
+        assert all(db.has_candidate(i) for i in range(100))
+        assert not db.has_candidate(100)
+        db.close()
+        assert (tmp_path / "candidates.bloom").exists()
+
+    def test_new_candidates_use_filter(self, tmp_path):
+        db = alertbase.IndexDB(tmp_path, create_if_missing=True)
+        db.insert_many(
+            (f"url{i}", _alert(candidate_id=i, object_id="obj")) for i in range(100)
+        )
+        db.close()
+        (tmp_path / "candidates.bloom").unlink()
+
+        db = alertbase.IndexDB(tmp_path)
+        new_keys = []
+        db.on_new_keys = new_keys.append
+        lookups = []
+        get = db.candidates.get
+
+        def counting_get(key):
+            lookups.append(key)
+            return get(key)
+
+        db.candidates.get = counting_get
+        db.insert_many(
+            (f"url{i}", _alert(candidate_id=i, object_id="obj")) for i in range(50, 150)
+        )
+        assert sorted(new_keys[0].candidates) == list(range(100, 150))
+        # The filter is built, rather than looking up every alert in LevelDB.
+        assert db._candidate_filter is not None
+        assert len(lookups) < 60
+        db.close()
+
+    def test_candidate_range_search(self, tmp_path):
+        layout = alertbase.index.IndexLayout(candidate_keys="uint64")
+        db = alertbase.IndexDB(tmp_path, create_if_missing=True, layout=layout)
+        db.insert_many(
+            (f"url{i}", _alert(candidate_id=i, object_id="obj"))
+            for i in [300, 5, 1000, 70, 129]
+        )
+        assert list(db.candidate_range_search(70, 301)) == [70, 129, 300]
+        assert list(db.candidate_range_search(0, 5)) == []
+        assert db.get_url(129) == "url129"
+        assert db.candidates.key_range_stats() == (5, 5, 1000)
+        db.close()
+
+    def test_candidate_range_search_needs_ordered_keys(self, tmp_path):
+        db = alertbase.IndexDB(tmp_path, create_if_missing=True)
+        with pytest.raises(ValueError):
+            db.candidate_range_search(0, 10)
+
+    def test_key_range_stats_ordered(self, tmp_path):
+        for postings in ["concatenated", "composite"]:
+            layout = alertbase.index.IndexLayout(postings=postings)
+            db = alertbase.IndexDB(
+                tmp_path / postings, create_if_missing=True, layout=layout
+            )
+            db.insert("url1", _alert(candidate_id=1, object_id="obj"))
+            db.insert("url2", _alert(candidate_id=2, object_id="ob"))
+            db.insert("url3", _alert(candidate_id=3, object_id="objx"))
+            assert db.objects.key_range_stats() == (3, "ob", "objx")
+            db.close()
+
+    def test_migrate_candidate_keys(self, tmp_path):
+        src = alertbase.IndexDB(tmp_path / "src", create_if_missing=True)
+        src.insert_many(
+            (f"url{i}", _alert(candidate_id=i, object_id="obj")) for i in [3, 1, 2]
+        )
+        src.close()
+
+        layout = alertbase.index.IndexLayout(candidate_keys="uint64")
+        alertbase.index.migrate(tmp_path / "src", tmp_path / "dst", layout)
+
+        dst = alertbase.IndexDB(tmp_path / "dst")
+        assert dst.layout == layout
+        assert list(dst.candidate_range_search(0, 10)) == [1, 2, 3]
+        assert dst.get_url(2) == "url2"
+        dst.close()
+
+
+def _alert(candidate_id, object_id, timestamp=None):
+    if timestamp is None:
+        timestamp = astropy.time.Time("2020-01-01T00:00:00")
+    return alertbase.AlertRecord(
+        candidate_id=candidate_id,
+        object_id=object_id,
+        position=astropy.coordinates.SkyCoord(ra=10, dec=20, unit="deg"),
+        timestamp=timestamp,
+        raw_data=None,
+        raw_dict=None,
+    )
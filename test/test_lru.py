@@ -0,0 +1,47 @@
+from alertbase.lru import LRUCache
+
+
+def test_get_put():
+    cache = LRUCache(2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert "a" in cache
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats.evictions == 1
+
+
+def test_sizeof():
+    cache = LRUCache(10, sizeof=len)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.size == 10
+    cache.put("a", b"123")
+    assert cache.size == 8
+    cache.put("c", b"123")
+    assert "b" not in cache
+    assert cache.size == 6
+    cache.put("d", b"this is too big to cache")
+    assert "d" not in cache
+    assert cache.size == 6
+
+
+def test_pop():
+    cache = LRUCache(10, sizeof=len)
+    cache.put("a", b"12345")
+    cache.pop("a")
+    cache.pop("missing")
+    assert "a" not in cache
+    assert cache.size == 0
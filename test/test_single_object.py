@@ -0,0 +1,80 @@
+import io
+
+import pytest
+from avro import schema
+from avro.datafile import DataFileReader, DataFileWriter
+from avro.io import DatumReader, DatumWriter
+
+from alertbase import single_object
+from alertbase.alert import AlertRecord
+
+ALERT_FILE = "testdata/alertfiles/1311156250015010003.avro"
+
+
+@pytest.fixture
+def raw_alert():
+    with open(ALERT_FILE, "rb") as f:
+        return f.read()
+
+
+def test_split_container(raw_alert):
+    schema_json, datum = single_object.split_container(raw_alert)
+    assert schema_json.startswith(b"{")
+    assert len(schema_json) + len(datum) < len(raw_alert)
+
+    cached = single_object.CachedSchema(schema_json)
+    want = AlertRecord.from_file_safe(io.BytesIO(raw_alert)).raw_dict
+    assert cached.read(datum) == want
+
+
+def test_encode_decode(raw_alert):
+    schema_json, datum = single_object.split_container(raw_alert)
+    cached = single_object.CachedSchema(schema_json)
+    encoded = single_object.encode(cached.fingerprint, datum)
+    assert encoded[:2] == b"\xc3\x01"
+    assert single_object.is_single_object(encoded)
+    assert not single_object.is_single_object(raw_alert)
+    assert single_object.decode(encoded) == (cached.fingerprint, datum)
+
+    with pytest.raises(ValueError):
+        single_object.decode(raw_alert)
+
+
+def test_rebuilt_container(raw_alert):
+    schema_json, datum = single_object.split_container(raw_alert)
+    cached = single_object.CachedSchema(schema_json)
+    rebuilt = cached.container(datum)
+    assert single_object.split_container(rebuilt) == (schema_json, datum)
+
+    want = AlertRecord.from_file_safe(io.BytesIO(raw_alert))
+    have = AlertRecord.from_file_safe(io.BytesIO(rebuilt))
+    assert have.raw_dict == want.raw_dict
+    assert AlertRecord.from_file_unsafe(io.BytesIO(rebuilt)).jd == want.jd
+
+
+def test_schema_cache(raw_alert):
+    schema_json, _ = single_object.split_container(raw_alert)
+    cache = single_object.SchemaCache()
+    cached = cache.add(schema_json)
+    assert cache.add(schema_json) is cached
+    assert cache.get(cached.fingerprint) is cached
+    assert cache.get(b"\x00" * 8) is None
+
+
+def test_read_container(raw_alert):
+    with DataFileReader(io.BytesIO(raw_alert), DatumReader()) as df:
+        want = next(df)
+        schema_json = df.meta["avro.schema"]
+    assert single_object.read_container(raw_alert) == want
+
+    # Containers that can't be split are read with the general reader.
+    buf = io.BytesIO()
+    writer = DataFileWriter(
+        buf, DatumWriter(), schema.parse(schema_json.decode()), codec="deflate"
+    )
+    writer.append(want)
+    writer.flush()
+    deflated = buf.getvalue()
+    with pytest.raises(ValueError):
+        single_object.split_container(deflated)
+    assert single_object.read_container(deflated) == want
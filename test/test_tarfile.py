@@ -1,7 +1,14 @@
 import pytest
 import tempfile
+import os
 import shutil
-from alertbase.alert_tar import iterate_tarfile
+import threading
+import tarfile
+from alertbase.alert_tar import (
+    iterate_tarfile,
+    iterate_tarfile_entries,
+    AsyncTarfileReader,
+)
 
 
 @pytest.fixture(scope="function")
@@ -20,3 +27,110 @@ def test_iterate_tarfile(alert_tarball):
         i += 1
 
     assert i == 2567
+
+
+@pytest.fixture(scope="function")
+def small_tarball(tmp_path):
+    """A gzipped tarball of 10 copies of a single alert file."""
+    src = "testdata/alertfiles/1311156250015010003.avro"
+    dst = tmp_path / "small.tar.gz"
+    with tarfile.open(dst, mode="w:gz") as tf:
+        for i in range(10):
+            tf.add(src, arcname=f"alert_{i}.avro")
+    return dst
+
+
+def test_iterate_small_tarfile(small_tarball):
+    alerts = list(iterate_tarfile(small_tarball))
+    assert len(alerts) == 10
+    assert alerts[0].candidate_id == 1311156250015010003
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("n_parse_worker", [0, 2])
+async def test_async_tarfile_reader(small_tarball, n_parse_worker):
+    alerts = []
+    reader = AsyncTarfileReader(small_tarball, n_parse_worker, batch_size=3)
+    async with reader:
+        async for alert in reader:
+            alerts.append(alert)
+    assert len(alerts) == 10
+    assert alerts[0].candidate_id == 1311156250015010003
+    assert alerts[0].object_id == "ZTF18aaylcqb"
+    assert alerts[0].jd == 2459065.65625
+    assert (
+        alerts[0].raw_data
+        == open("testdata/alertfiles/1311156250015010003.avro", "rb").read()
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_tarfile_reader_stop_early(small_tarball):
+    # Stopping early must not leave the reader thread blocked on a full queue.
+    reader = AsyncTarfileReader(small_tarball, batch_size=1, max_queued_batches=1)
+    async with reader:
+        async for alert in reader:
+            break
+    assert not reader._thread.is_alive()
+
+
+def test_iterate_tarfile_from_pipe(small_tarball):
+    # Non-seekable inputs, like pipes, can be read.
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with open(small_tarball, "rb") as src, os.fdopen(write_fd, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with os.fdopen(read_fd, "rb") as pipe:
+        alerts = list(iterate_tarfile(pipe))
+    writer.join()
+    assert len(alerts) == 10
+
+
+def test_iterate_tarfile_skips_directories(tmp_path):
+    src = "testdata/alertfiles/1311156250015010003.avro"
+    dst = tmp_path / "nested.tar.gz"
+    with tarfile.open(dst, mode="w:gz") as tf:
+        tf.add("testdata/alertfiles", arcname="alerts", recursive=False)
+        tf.add(src, arcname="alerts/alert.avro")
+    assert len(list(iterate_tarfile(dst))) == 1
+
+
+def test_iterate_tarfile_entries_start_offset(small_tarball):
+    entries = list(iterate_tarfile_entries(small_tarball))
+    assert len(entries) == 10
+    offsets = [offset for offset, _ in entries]
+    assert offsets == sorted(offsets)
+
+    resumed = list(iterate_tarfile_entries(small_tarball, start_offset=offsets[4]))
+    assert resumed == entries[4:]
+
+
+def test_iterate_tarfile_entries_start_offset_from_pipe(small_tarball):
+    offsets = [offset for offset, _ in iterate_tarfile_entries(small_tarball)]
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with open(small_tarball, "rb") as src, os.fdopen(write_fd, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with os.fdopen(read_fd, "rb") as pipe:
+        entries = list(iterate_tarfile_entries(pipe, start_offset=offsets[4]))
+    writer.join()
+    assert [offset for offset, _ in entries] == offsets[4:]
+
+
+@pytest.mark.asyncio
+async def test_async_tarfile_reader_start_offset(small_tarball):
+    offsets = [offset for offset, _ in iterate_tarfile_entries(small_tarball)]
+    reader = AsyncTarfileReader(small_tarball, start_offset=offsets[7])
+    entries = []
+    async with reader:
+        async for offset, alert in reader.entries():
+            entries.append((offset, alert.candidate_id))
+    assert entries == [(offset, 1311156250015010003) for offset in offsets[7:]]